@@ -1,3 +1,32 @@
 from django.contrib import admin
+from .models import FAQEntry, Payment, Task
+from .taskqueue import requeue
 
 # Register your models here.
+
+
+@admin.register(FAQEntry)
+class FAQEntryAdmin(admin.ModelAdmin):
+    list_display = ('question', 'priority', 'is_active', 'updated_at')
+    list_filter = ('is_active',)
+    search_fields = ('question', 'keywords', 'answer')
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('reference', 'application', 'provider', 'amount', 'status', 'created_at', 'confirmed_at')
+    list_filter = ('status', 'provider')
+    search_fields = ('reference', 'provider_payment_id')
+    raw_id_fields = ('application',)
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'queue', 'priority', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'queue', 'name')
+    readonly_fields = ('claimed_by', 'claimed_at', 'created_at', 'finished_at', 'last_error')
+    actions = ['requeue_dead']
+
+    @admin.action(description='Requeue selected dead tasks')
+    def requeue_dead(self, request, queryset):
+        self.message_user(request, f'{requeue(queryset)} task(s) requeued.')
@@ -0,0 +1,69 @@
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, transaction
+from .counters import record_transition
+from .models import BusPassApplication, UserProfile
+from .payments import start_payment
+
+# Pass application submission. One transaction, one write per row:
+#
+#   INSERT application (PENDING, fee computed from the catalogue)
+#   INSERT payment (confirmed later by the provider's webhook, see payments.py)
+#   UPDATE route counters
+#   UPDATE the profile's preferred boarding location (that column only)
+#
+# Duplicates are caught by constraints rather than a check-then-insert: the
+# partial unique index allows one active application per user and route, and
+# the form's idempotency key is unique, so a double-submitted form finds the
+# application its first submit created.
+
+STOP_DISCOUNT = Decimal('150')
+
+
+def application_fee(route, position):
+    """Route fee less 150 per stop position (1-based); never negative."""
+    discount = STOP_DISCOUNT * position if position is not None else Decimal('0')
+    try:
+        base_fee = Decimal(route.fee)
+    except (InvalidOperation, TypeError):
+        base_fee = Decimal('0')
+    return max(base_fee - discount, Decimal('0'))
+
+
+def submit_application(user, route, boarding_location, catalogue, idempotency_key=None, renewed_from=None):
+    """Create an application for ``user`` on ``route`` and start its payment.
+
+    The application is PENDING with ``application.payment`` set, or already
+    PAID if after the stop discount there is nothing to pay.
+
+    ``renewed_from`` makes it the renewal of that pass (see validity.py).
+
+    Returns (application, created). A repeated submit with the same
+    idempotency key, or a second renewal of the same pass, returns the
+    earlier application with created=False; any other clash with an active
+    application returns (None, False).
+    """
+    fee = application_fee(route, catalogue.stop_position(route.id, boarding_location))
+    application = BusPassApplication(
+        user=user,
+        route=route,
+        boarding_location=boarding_location,
+        status='PENDING' if fee else 'PAID',
+        paid_fee=fee,
+        idempotency_key=idempotency_key or None,
+        renewed_from=renewed_from,
+    )
+    try:
+        with transaction.atomic():
+            application.save(force_insert=True)
+            if fee:
+                start_payment(application)
+            record_transition(route.id, None, application.status)
+            UserProfile.objects.filter(user=user).update(preferred_boarding_location=boarding_location)
+    except IntegrityError:
+        earlier = None
+        if idempotency_key:
+            earlier = BusPassApplication.objects.filter(user=user, idempotency_key=idempotency_key).first()
+        if earlier is None and renewed_from is not None:
+            earlier = BusPassApplication.objects.filter(renewed_from=renewed_from).first()
+        return earlier, False
+    return application, True
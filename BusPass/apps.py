@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BuspassConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'BusPass'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
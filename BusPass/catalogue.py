@@ -0,0 +1,104 @@
+import threading
+import time
+from django.core.cache import cache
+from django.db import transaction
+from .models import BoardingLocation, BusRoute
+from .versioning import bump_version, current_version
+
+# Route catalogue: every route with its ordered boarding locations. Routes
+# change a few times a term but are read on every route listing and
+# application form, so the catalogue is cached in two layers:
+#
+#   * the cache holds the catalogue under a version token (see versioning.py),
+#     so one worker's rebuild serves all of them;
+#   * each process keeps the catalogue it last used and only compares its
+#     version with the token every CATALOGUE_RECHECK_SECONDS.
+#
+# Saving or deleting a route or stop (see signals.py) replaces the version
+# token once the transaction commits. Bulk writes send no signals, so code
+# using them must call invalidate_catalogue() itself.
+
+CATALOGUE_VERSION_KEY = 'busmate:route-catalogue:version'
+CATALOGUE_RECHECK_SECONDS = 2.0
+CATALOGUE_TIMEOUT = 24 * 3600
+
+
+class RouteCatalogue:
+    """Routes (ordered by id) and their stops (ordered by position, name)."""
+
+    def __init__(self, routes, stops, version=None):
+        self.routes = routes
+        self.version = version
+        self.checked_at = time.monotonic()
+        self._by_id = {route.id: route for route in routes}
+        self._stops = stops  # route id -> [(name, position), ...]
+        self._positions = {
+            route_id: {name: position for name, position in route_stops}
+            for route_id, route_stops in stops.items()
+        }
+
+    @classmethod
+    def load(cls, version=None):
+        """Build from the database (two queries)."""
+        routes = list(BusRoute.objects.order_by('id'))
+        stops = {}
+        for route_id, name, position in BoardingLocation.objects.order_by(
+            'route_id', 'position', 'name'
+        ).values_list('route_id', 'name', 'position'):
+            stops.setdefault(route_id, []).append((name, position))
+        return cls(routes, stops, version)
+
+    def __getstate__(self):
+        return {'routes': self.routes, 'stops': self._stops}
+
+    def __setstate__(self, state):
+        self.__init__(state['routes'], state['stops'])
+
+    def route(self, route_id):
+        return self._by_id.get(route_id)
+
+    def stops_for(self, route_id):
+        """Stop names of a route in boarding order."""
+        return [name for name, _ in self._stops.get(route_id, ())]
+
+    def stop_position(self, route_id, name):
+        """1-based position of stop ``name`` on the route, or None."""
+        return self._positions.get(route_id, {}).get(name)
+
+
+_catalogue = None
+_lock = threading.Lock()
+
+
+def _data_key(version):
+    return f'busmate:route-catalogue:{version}'
+
+
+def invalidate_catalogue():
+    """Drop the cached catalogue (after the current transaction commits)."""
+    def bump():
+        global _catalogue
+        bump_version(CATALOGUE_VERSION_KEY)
+        _catalogue = None
+    transaction.on_commit(bump)
+
+
+def route_catalogue():
+    """The current catalogue, from process memory, the shared cache or the database."""
+    global _catalogue
+    current = _catalogue
+    if current is not None and time.monotonic() - current.checked_at < CATALOGUE_RECHECK_SECONDS:
+        return current
+    with _lock:
+        version = current_version(CATALOGUE_VERSION_KEY)
+        current = _catalogue
+        if current is not None and current.version == version:
+            current.checked_at = time.monotonic()
+            return current
+        current = cache.get(_data_key(version))
+        if current is None:
+            current = RouteCatalogue.load()
+            cache.set(_data_key(version), current, timeout=CATALOGUE_TIMEOUT)
+        current.version = version
+        _catalogue = current
+        return current
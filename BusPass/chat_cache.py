@@ -0,0 +1,163 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+# Cache of LLM support chat replies. Most students ask the same few questions
+# in slightly different words, so a lookup first tries the normalised message
+# exactly and then the closest earlier question by word overlap (Jaccard
+# similarity over content words, found through an inverted index). Entries
+# expire after a TTL and the least recently used ones are dropped once the
+# cache is full. The cache lives in process memory, like the latency stats.
+#
+# Candidates come from the inverted index lists of the query's rarest words
+# only: a question sharing none of the rarest (n - ceil(t * n) + 1) of the
+# query's n words cannot reach similarity t, so common words like "bus" never
+# force a scan of the whole cache.
+
+STOPWORDS = frozenset(
+    "a an the i me my we our you your it its is are am was be been do does did "
+    "can could would should will to of in on at for from with and or so "
+    "please hi hello hey thanks thank what how where when why which".split()
+)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(message):
+    """Lowercase, strip punctuation and collapse whitespace."""
+    return ' '.join(_WORD.findall(message.lower()))
+
+
+def content_words(normalized):
+    words = set()
+    for word in normalized.split():
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('es') and word[:-2].endswith(('ss', 'sh', 'ch', 'x', 'us')):
+            word = word[:-2]  # "passes" ~ "pass", "buses" ~ "bus"
+        elif len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us')):
+            word = word[:-1]  # "seats" ~ "seat"
+        words.add(word)
+    return frozenset(words)
+
+
+class CacheEntry:
+    __slots__ = ('question', 'words', 'reply', 'created', 'hits')
+
+    def __init__(self, question, words, reply):
+        self.question = question
+        self.words = words
+        self.reply = reply
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class ResponseCache:
+    """LRU + TTL cache of replies keyed by normalised question."""
+
+    def __init__(self, max_entries=500, ttl=3600, similarity=0.75):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # normalised question -> CacheEntry, oldest use first
+        self._index = {}               # content word -> set of normalised questions
+        self._lock = threading.Lock()
+        self.hits = self.similar_hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, message):
+        """Cached reply for ``message`` or None."""
+        key = normalize(message)
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                entry = self._nearest(content_words(key))
+                if entry is not None:
+                    self.similar_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.hits += 1
+            self._entries.move_to_end(entry.question)
+            return entry.reply
+
+    def set(self, message, reply):
+        key = normalize(message)
+        if not key or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = CacheEntry(key, content_words(key), reply)
+            self._entries[key] = entry
+            for word in entry.words:
+                self._index.setdefault(word, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self.hits = self.similar_hits = self.misses = 0
+
+    def top_questions(self, limit=20):
+        """Most frequently answered-from-cache questions, as (question, hits)."""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e.hits, reverse=True)
+            return [(e.question, e.hits) for e in entries[:limit]]
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+        }
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def _nearest(self, words):
+        if not words:
+            return None
+        postings = sorted((self._index.get(word, ()) for word in words), key=len)
+        prefix = len(words) - math.ceil(self.similarity * len(words)) + 1
+        candidates = set()
+        for keys in postings[:prefix]:
+            candidates.update(keys)
+        best, best_score = None, self.similarity
+        for key in candidates:
+            entry = self._live(key)
+            if entry is None:
+                continue
+            score = len(words & entry.words) / len(words | entry.words)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for word in entry.words:
+            keys = self._index.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[word]
+
+
+response_cache = ResponseCache(
+    max_entries=getattr(settings, 'BUSPASS_CHAT_CACHE_SIZE', 500),
+    ttl=getattr(settings, 'BUSPASS_CHAT_CACHE_TTL', 3600),
+    similarity=getattr(settings, 'BUSPASS_CHAT_CACHE_SIMILARITY', 0.75),
+)
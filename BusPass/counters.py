@@ -0,0 +1,91 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from .models import BusPassApplication, RouteCounters
+
+# Per-route application counters (RouteCounters). Every status change calls
+# record_transition() in the same transaction as the status write, which
+# moves the counts with a single UPDATE ... SET col = col +/- n, so the routes
+# page can show availability without counting applications. Anything that
+# slips past (manual edits, crashes between writes) is repaired by reconcile().
+
+COUNTER_FIELDS = {
+    'PENDING': 'pending',
+    'PAID': 'paid',
+    'WAITLISTED': 'waitlisted',
+    'ALLOCATED': 'allocated',
+}
+
+
+def record_transition(route_id, old_status, new_status, count=1):
+    """Move ``count`` applications on a route from ``old_status`` to ``new_status``.
+
+    Either status may be None (application created / leaves the counted
+    statuses). Call after the status change has been written.
+    """
+    old_field = COUNTER_FIELDS.get(old_status)
+    new_field = COUNTER_FIELDS.get(new_status)
+    if not count or old_field == new_field:
+        return
+    changes = {}
+    if old_field:
+        changes[old_field] = F(old_field) - count
+    if new_field:
+        changes[new_field] = F(new_field) + count
+    if RouteCounters.objects.filter(route_id=route_id).update(**changes):
+        return
+    # No counters row yet (route created since the counters were seeded):
+    # create it from the application table, which already has this change.
+    try:
+        with transaction.atomic():
+            RouteCounters.objects.create(route_id=route_id, **count_applications(route_id).get(route_id, {}))
+    except IntegrityError:
+        RouteCounters.objects.filter(route_id=route_id).update(**changes)  # created concurrently
+
+
+def count_applications(route_id=None):
+    """{route id: {counter field: count}} straight from the application table."""
+    rows = BusPassApplication.objects.filter(status__in=list(COUNTER_FIELDS))
+    if route_id is not None:
+        rows = rows.filter(route_id=route_id)
+    counts = {}
+    for row in rows.values('route_id', 'status').annotate(n=Count('id')).order_by():
+        counts.setdefault(row['route_id'], {})[COUNTER_FIELDS[row['status']]] = row['n']
+    return counts
+
+
+def seats_left(route, counters):
+    """Seats on ``route`` not yet taken or claimed by someone already in the queue."""
+    if counters is None:
+        return route.max_seats
+    claimed = counters.allocated + counters.paid + counters.pending + counters.waitlisted
+    return max(route.max_seats - claimed, 0)
+
+
+def reconcile(routes, dry_run=False):
+    """Compare each route's counters with the application table and fix drift.
+
+    Returns a list of (route, {field: (stored, actual)}) for routes that drifted.
+    Each route is fixed under a row lock so concurrent transitions are not lost.
+    """
+    drifted = []
+    for route in routes:
+        with transaction.atomic():
+            counters = RouteCounters.objects.select_for_update().filter(route=route).first()
+            actual = count_applications(route.id).get(route.id, {})
+            diff = {}
+            for field in COUNTER_FIELDS.values():
+                stored = getattr(counters, field) if counters is not None else None
+                if stored != actual.get(field, 0):
+                    diff[field] = (stored, actual.get(field, 0))
+            if not diff:
+                continue
+            drifted.append((route, diff))
+            if dry_run:
+                continue
+            if counters is None:
+                RouteCounters.objects.create(route=route, **actual)
+            else:
+                RouteCounters.objects.filter(pk=counters.pk).update(
+                    **{field: actual.get(field, 0) for field in COUNTER_FIELDS.values()}
+                )
+    return drifted
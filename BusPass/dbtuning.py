@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from django.conf import settings
+
+# SQLite settings for serving real traffic. Applied to every new connection
+# through the connection_created signal (wired up in signals.py):
+#
+#   busy_timeout          wait up to 5s for the write lock instead of failing at once
+#   mmap_size/cache_size  keep hot pages in memory
+#
+# and, with the BUSPASS_SQLITE_WAL setting on,
+#
+#   journal_mode=WAL      readers no longer block behind a writer and vice versa
+#   synchronous=NORMAL    fsync at checkpoints, not every commit (safe with WAL)
+#
+# WAL is not a connection setting but a property of the database file, kept
+# until it is switched back, and it puts -wal/-shm files next to the database.
+# So it is off unless the served database asks for it (BUSPASS_SQLITE_WAL=1 in
+# the server's environment); a manage.py command run against the checked-in
+# development database leaves that file as it is.
+#
+# Override or extend with the BUSPASS_SQLITE_PRAGMAS setting.
+#
+# Transactions that write (applying, paying, releasing a seat) start with
+# their write rather than a read. SQLite's transactions start as readers, and
+# a reader that later needs the write lock while another connection holds it
+# fails at once with "database is locked", busy_timeout or not; a transaction
+# whose first statement writes waits for the lock instead.
+
+DEFAULT_PRAGMAS = {
+    'busy_timeout': 5000,       # ms
+    'mmap_size': 134217728,     # 128 MB
+    'cache_size': -20000,       # negative = KiB, so 20 MB
+    'temp_store': 'MEMORY',
+}
+WAL_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+
+def sqlite_pragmas(wal=None):
+    if wal is None:
+        wal = getattr(settings, 'BUSPASS_SQLITE_WAL', False)
+    return {**DEFAULT_PRAGMAS, **(WAL_PRAGMAS if wal else {}), **getattr(settings, 'BUSPASS_SQLITE_PRAGMAS', {})}
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """connection_created receiver: tune SQLite connections, leave others alone."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, sqlite_pragmas())
+
+
+# --- Benchmark (manage.py benchmark_sqlite) ---
+
+BASELINE_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def _writer(path, pragmas, timeout, deadline, stats, lock):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_pragmas(conn, pragmas)
+    done = errors = 0
+    while time.monotonic() < deadline:
+        try:
+            # The shape of an application submit: insert the row, bump the route counter
+            conn.execute('BEGIN')
+            conn.execute('INSERT INTO bench (route, payload) VALUES (?, ?)', (done % 20, 'x' * 200))
+            conn.execute('UPDATE bench_counter SET n = n + 1 WHERE route = ?', (done % 20,))
+            conn.execute('COMMIT')
+            done += 1
+        except sqlite3.OperationalError:  # "database is locked"
+            errors += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    conn.close()
+    with lock:
+        stats['writes'] += done
+        stats['errors'] += errors
+
+
+def _reader(path, pragmas, timeout, deadline, stats, lock):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_pragmas(conn, pragmas)
+    done = errors = 0
+    while time.monotonic() < deadline:
+        try:
+            conn.execute('SELECT route, count(*) FROM bench GROUP BY route').fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    conn.close()
+    with lock:
+        stats['reads'] += done
+        stats['errors'] += errors
+
+
+def run_benchmark(pragmas, writers=8, readers=4, seconds=5.0, timeout=5.0):
+    """Hammer a scratch database with parallel writers and readers.
+
+    Returns a dict with writes/s, reads/s and the number of lock errors.
+    """
+    fd, path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path, isolation_level=None)
+        apply_pragmas(conn, {'journal_mode': pragmas.get('journal_mode', 'DELETE')})
+        conn.execute('CREATE TABLE bench (id INTEGER PRIMARY KEY, route INTEGER, payload TEXT)')
+        conn.execute('CREATE INDEX bench_route ON bench (route)')
+        conn.execute('CREATE TABLE bench_counter (route INTEGER PRIMARY KEY, n INTEGER)')
+        conn.executemany('INSERT INTO bench_counter VALUES (?, 0)', [(route,) for route in range(20)])
+        conn.close()
+
+        stats = {'writes': 0, 'reads': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+        threads = [threading.Thread(target=_writer, args=(path, pragmas, timeout, deadline, stats, lock))
+                   for _ in range(writers)]
+        threads += [threading.Thread(target=_reader, args=(path, pragmas, timeout, deadline, stats, lock))
+                    for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            'writes_per_s': round(stats['writes'] / seconds),
+            'reads_per_s': round(stats['reads'] / seconds),
+            'errors': stats['errors'],
+        }
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            try:
+                os.unlink(path + suffix)
+            except OSError:
+                pass
@@ -0,0 +1,123 @@
+import csv
+import itertools
+import json
+from asgiref.sync import sync_to_async
+from .models import BusPassApplication, BusRoute, DailyRouteStats, UserProfile
+
+# Streaming exports. Rows are pulled with .values_list().iterator() and
+# encoded one line at a time, so memory use stays flat however many rows are
+# exported. Under ASGI, Django 4.2 reads a sync iterator into a list before
+# sending anything, so the view wraps the lines with aiter_export() there.
+
+EXPORT_CHUNK_SIZE = 2000
+
+# dataset name -> (model, [(column header, ORM lookup), ...])
+EXPORTS = {
+    'applications': (BusPassApplication, [
+        ('id', 'id'),
+        ('username', 'user__username'),
+        ('first_name', 'user__first_name'),
+        ('last_name', 'user__last_name'),
+        ('email', 'user__email'),
+        ('user_type', 'user__userprofile__user_type'),
+        ('department', 'user__userprofile__department'),
+        ('mobile_number', 'user__userprofile__mobile_number'),
+        ('route', 'route__name'),
+        ('boarding_location', 'boarding_location'),
+        ('status', 'status'),
+        ('seat_number', 'seat_number'),
+        ('paid_fee', 'paid_fee'),
+        ('application_date', 'application_date'),
+    ]),
+    'routes': (BusRoute, [
+        ('id', 'id'),
+        ('name', 'name'),
+        ('description', 'description'),
+        ('fee', 'fee'),
+        ('max_seats', 'max_seats'),
+    ]),
+    'profiles': (UserProfile, [
+        ('id', 'id'),
+        ('username', 'user__username'),
+        ('first_name', 'user__first_name'),
+        ('last_name', 'user__last_name'),
+        ('email', 'user__email'),
+        ('is_admin', 'is_admin'),
+        ('user_type', 'user_type'),
+        ('department', 'department'),
+        ('mobile_number', 'mobile_number'),
+        ('preferred_boarding_location', 'preferred_boarding_location'),
+    ]),
+    'daily_stats': (DailyRouteStats, [
+        ('day', 'day'),
+        ('route', 'route__name'),
+        ('department', 'department'),
+        ('applications', 'applications'),
+        ('revenue', 'revenue'),
+        ('allocated', 'allocated'),
+        ('cancelled', 'cancelled'),
+        ('rejected', 'rejected'),
+    ]),
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """File-like object whose write() just hands the line back (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(dataset, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Return (headers, iterator of value tuples) for ``dataset``."""
+    model, columns = EXPORTS[dataset]
+    queryset = model.objects.filter(**(filters or {})).order_by('id')
+    rows = queryset.values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=chunk_size)
+    return [header for header, _ in columns], rows
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_csv(headers, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(headers, rows):
+    for row in rows:
+        yield json.dumps({h: _jsonable(v) for h, v in zip(headers, row)}) + '\n'
+
+
+def stream_export(dataset, fmt, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Iterator of encoded lines for ``dataset`` in format ``fmt`` (csv/jsonl)."""
+    headers, rows = export_rows(dataset, filters, chunk_size)
+    if fmt == 'csv':
+        return iter_csv(headers, rows)
+    return iter_jsonl(headers, rows)
+
+
+def aiter_export(lines, batch_size=EXPORT_CHUNK_SIZE):
+    """Async iterator over ``lines`` for ASGI, pulling a batch of lines per thread hop."""
+    # thread_sensitive: every batch runs in the same thread, on the same DB connection and cursor
+    next_batch = sync_to_async(lambda: ''.join(itertools.islice(lines, batch_size)), thread_sensitive=True)
+
+    async def batches():
+        while True:
+            batch = await next_batch()
+            if not batch:
+                return
+            yield batch
+    return batches()
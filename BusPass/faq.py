@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from .chat_cache import content_words, normalize
+from .models import FAQEntry
+from .versioning import bump_version, current_version
+
+# FAQ answers for the support chat. Active FAQEntry rows are compiled into an
+# inverted index (content word -> keyword phrases containing it), so matching
+# a message costs a few dict lookups however many entries there are. Each
+# entry is scored by the IDF-weighted words of its phrases found in the
+# message; keywords count fully, words of the entry's question half.
+#
+# Saving or deleting an entry bumps a version token (see versioning.py); each
+# process compares its compiled matcher against that token at most once every
+# FAQ_RECHECK_SECONDS and rebuilds it when it is stale.
+
+FAQ_VERSION_KEY = 'busmate:faq-version'
+FAQ_RECHECK_SECONDS = 2.0
+QUESTION_WEIGHT = 0.5
+MIN_COVERAGE = 0.5  # share of the message's words an answer must explain to skip the LLM
+
+FALLBACK_REPLY = (
+    "I can help with routes, applying for a pass, status, allocation, and cancellations. "
+    "Please share more details about your question."
+)
+
+
+def split_keywords(raw):
+    """Keyword phrases (as word sets) from comma/newline separated text."""
+    phrases = []
+    for line in (raw or '').splitlines():
+        for part in line.split(','):
+            words = content_words(normalize(part))
+            if words and words not in phrases:
+                phrases.append(words)
+    return phrases
+
+
+class FAQMatch:
+    __slots__ = ('entry_id', 'answer', 'score', 'coverage')
+
+    def __init__(self, entry_id, answer, score, coverage):
+        self.entry_id = entry_id
+        self.answer = answer
+        self.score = score
+        self.coverage = coverage
+
+
+class FAQMatcher:
+    """Compiled FAQ index over a set of FAQEntry rows."""
+
+    def __init__(self, entries, version=None):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self._answers = {}
+        self._rank = {}  # entry id -> (priority, -id) for tie breaks
+        compiled = []
+        question_df = defaultdict(int)
+        for entry in entries:
+            keyword_phrases = split_keywords(entry.keywords)
+            question_words = content_words(normalize(entry.question))
+            for word in question_words:
+                question_df[word] += 1
+            compiled.append((entry.id, keyword_phrases, question_words))
+            self._answers[entry.id] = entry.answer
+            self._rank[entry.id] = (entry.priority, -entry.id)
+
+        # Question words used by most entries ("about", "get") behave like
+        # stopwords: they would make every lookup score every entry.
+        common = {w for w, count in question_df.items() if len(compiled) >= 20 and count > len(compiled) / 2}
+        weighted = []
+        for entry_id, keyword_phrases, question_words in compiled:
+            covered = set().union(*keyword_phrases)
+            phrases = [(p, 1.0) for p in keyword_phrases]
+            phrases += [(frozenset([w]), QUESTION_WEIGHT) for w in question_words - covered - common]
+            weighted.append((entry_id, phrases))
+
+        # Inverse document frequency over entries: words that appear in many
+        # entries ("bus", "pass") say little about which one is meant.
+        df = defaultdict(int)
+        for _, phrases in weighted:
+            for word in set().union(*(p for p, _ in phrases)):
+                df[word] += 1
+        n = max(len(weighted), 1)
+        self._idf = {word: math.log(1 + n / count) for word, count in df.items()}
+
+        # Each phrase is indexed under its rarest word only, so it is checked
+        # once per lookup and only when that word is in the message.
+        self._postings = defaultdict(list)
+        for entry_id, phrases in weighted:
+            for words, weight in phrases:
+                value = weight * sum(self._idf[w] for w in words)
+                self._postings[min(words, key=lambda w: (df[w], w))].append((entry_id, words, value))
+
+    def __len__(self):
+        return len(self._answers)
+
+    def match(self, message):
+        """Best FAQMatch for ``message``, or None if no entry matches at all."""
+        words = content_words(normalize(message))
+        if not words:
+            return None
+        scores = defaultdict(float)
+        matched = defaultdict(set)
+        for word in words:
+            for entry_id, phrase, value in self._postings.get(word, ()):
+                if phrase <= words:
+                    scores[entry_id] += value
+                    matched[entry_id] |= phrase
+        if not scores:
+            return None
+        best = max(scores, key=lambda entry_id: (scores[entry_id], self._rank[entry_id]))
+        return FAQMatch(best, self._answers[best], scores[best], len(matched[best]) / len(words))
+
+
+_matcher = None
+_lock = threading.Lock()
+
+
+def invalidate_faq():
+    bump_version(FAQ_VERSION_KEY)
+
+
+def _needs_check():
+    return _matcher is None or time.monotonic() - _matcher.checked_at >= FAQ_RECHECK_SECONDS
+
+
+def get_matcher():
+    """The compiled matcher, rebuilt from the database if entries changed."""
+    global _matcher
+    if not _needs_check():
+        return _matcher
+    with _lock:
+        version = current_version(FAQ_VERSION_KEY)
+        if _matcher is not None and _matcher.version == version:
+            _matcher.checked_at = time.monotonic()
+        else:
+            _matcher = FAQMatcher(FAQEntry.objects.filter(is_active=True), version)
+        return _matcher
+
+
+async def aget_matcher():
+    """Async ``get_matcher``: stays on the event loop unless a recheck is due."""
+    if not _needs_check():
+        return _matcher
+    return await sync_to_async(get_matcher)()
@@ -1,10 +1,28 @@
+import uuid
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.auth.models import User
 from .models import BusRoute, BusPassApplication, UserProfile, BoardingLocation
-from django.core.files.images import get_image_dimensions
+from .catalogue import route_catalogue
+from .photos import prepare_photo, store_photo
+from .tasks import delete_replaced_photo
 from django.core.exceptions import ValidationError
 
+
+def prepare_profile_photo(photo):
+    """Check an uploaded profile photo and re-encode it (see photos.py)."""
+    # Check file size (5MB max)
+    if photo.size > 5 * 1024 * 1024:
+        raise ValidationError("Image file too large (max 5MB)")
+    # Check file type
+    if not getattr(photo, 'content_type', None) in ['image/jpeg', 'image/png']:
+        raise ValidationError("Only JPG and PNG images are allowed")
+    try:
+        return prepare_photo(photo)
+    except ValueError:
+        raise ValidationError("Invalid image file")
+
+
 class UserRegistrationForm(UserCreationForm):
     photo = forms.ImageField(required=False, label='Profile Photo', 
                            help_text='Upload a square photo (max 5MB, JPG/PNG only)')
@@ -34,6 +52,14 @@ class UserRegistrationForm(UserCreationForm):
             'photo': forms.FileInput(attrs={'accept': 'image/*', 'capture': 'camera'})
         }
 
+    prepared_photo = None
+
+    def clean_photo(self):
+        photo = self.cleaned_data.get('photo')
+        if photo:
+            self.prepared_photo = prepare_profile_photo(photo)
+        return photo
+
     def save(self, commit=True):
         user = super().save(commit=False)
         if commit:
@@ -47,26 +73,10 @@ class UserRegistrationForm(UserCreationForm):
                 mobile_number=self.cleaned_data.get('mobile_number') or ''
             )
             
-            # Handle photo upload
-            photo = self.cleaned_data.get('photo')
-            if photo:
-                # Validate image
-                try:
-                    w, h = get_image_dimensions(photo)
-                    # Check file size (5MB max)
-                    if photo.size > 5*1024*1024:
-                        raise ValidationError("Image file too large (max 5MB)")
-                    # Check file type
-                    if not photo.content_type in ['image/jpeg', 'image/png']:
-                        raise ValidationError("Only JPG and PNG images are allowed")
-                    
-                    # Save the photo
-                    profile.photo = photo
-                    profile.save()
-                except Exception as e:
-                    # If there's any error with the image, we'll just skip saving it
-                    # The form will still be valid but the photo won't be saved
-                    pass
+            # Store the photo re-encoded in clean_photo
+            if self.prepared_photo is not None:
+                profile.photo = store_photo(self.prepared_photo)
+                profile.save(update_fields=['photo'])
 
         return user
 
@@ -81,16 +91,39 @@ class BusRouteForm(forms.ModelForm):
         model = BusRoute
         fields = ['name', 'description', 'fee', 'max_seats']
 
+class RouteImportForm(forms.Form):
+    csv_file = forms.FileField(required=False, label='Routes CSV',
+                               help_text='Columns: route, fee, max_seats, description, stop (one row per stop)')
+    csv_text = forms.CharField(required=False, widget=forms.HiddenInput)
+    prune = forms.BooleanField(required=False, label='Remove stops not listed in the file')
+    confirm = forms.BooleanField(required=False, widget=forms.HiddenInput)
+
+    def clean(self):
+        cleaned = super().clean()
+        upload = cleaned.get('csv_file')
+        if upload:
+            try:
+                cleaned['csv_text'] = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise ValidationError("The file must be UTF-8 encoded CSV")
+        if not cleaned.get('csv_text'):
+            raise ValidationError("Please choose a CSV file to import")
+        return cleaned
+
 class BusPassApplicationForm(forms.ModelForm):
     # Boarding location becomes a dropdown based on the route
     boarding_location = forms.ChoiceField(choices=[], label='Boarding Location')
+    # Fresh per rendered form, so submitting the same form twice is recognised.
+    # Not a model field here: uniqueness is left to the database.
+    idempotency_key = forms.CharField(max_length=64, required=False, widget=forms.HiddenInput)
 
     def __init__(self, *args, **kwargs):
         route = kwargs.pop('route', None)
         super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            self.initial.setdefault('idempotency_key', uuid.uuid4().hex)
         if route is not None:
-            locs = BoardingLocation.objects.filter(route=route).order_by('position', 'name')
-            choices = [(bl.name, bl.name) for bl in locs]
+            choices = [(name, name) for name in route_catalogue().stops_for(route.id)]
             # Fallback: if no locations defined, allow free text via a text input
             if choices:
                 self.fields['boarding_location'].choices = choices
@@ -98,6 +131,9 @@ class BusPassApplicationForm(forms.ModelForm):
                 # Replace with CharField if none available
                 self.fields['boarding_location'] = forms.CharField(label='Boarding Location')
 
+    def clean_idempotency_key(self):
+        return self.cleaned_data.get('idempotency_key') or None
+
     class Meta:
         model = BusPassApplication
         fields = ['boarding_location']
@@ -121,22 +157,17 @@ class UserProfileEditForm(forms.ModelForm):
             self.fields['first_name'].initial = self.instance.user.first_name
             self.fields['last_name'].initial = self.instance.user.last_name
     
+    prepared_photo = None
+
     def clean_photo(self):
         photo = self.cleaned_data.get('photo')
-        if photo:
-            try:
-                # Check file size (5MB max)
-                if photo.size > 5 * 1024 * 1024:
-                    raise ValidationError("Image file too large (max 5MB)")
-                # Check file type
-                if not photo.content_type in ['image/jpeg', 'image/png']:
-                    raise ValidationError("Only JPG and PNG images are allowed")
-            except AttributeError:
-                # Handle case when file is not an image
-                raise ValidationError("Invalid image file")
+        if photo and 'photo' in self.changed_data:
+            self.prepared_photo = prepare_profile_photo(photo)
         return photo
     
     def save(self, commit=True):
+        old_photo = self.initial.get('photo')
+        old_photo = old_photo.name if old_photo else ''
         profile = super().save(commit=False)
         user = profile.user
         
@@ -146,7 +177,13 @@ class UserProfileEditForm(forms.ModelForm):
         user.last_name = self.cleaned_data['last_name']
         
         if commit:
+            # The re-encoded photo replaces the raw upload; files under the
+            # same content hash are stored once
+            if self.prepared_photo is not None:
+                profile.photo = store_photo(self.prepared_photo)
             user.save()
             profile.save()
+            if old_photo and old_photo != profile.photo.name:
+                delete_replaced_photo.enqueue(name=old_photo)
         
         return profile
\ No newline at end of file
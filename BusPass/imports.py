@@ -0,0 +1,199 @@
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .catalogue import invalidate_catalogue
+from .models import BusRoute, BoardingLocation
+
+# Route/stop import. A CSV has one row per stop:
+#
+#     route,fee,max_seats,description,stop
+#     Route 1,2500,50,Via city centre,Main Gate
+#     Route 1,,,,Market Junction
+#
+# Stops are numbered in file order. Route columns may be left blank on every
+# row after a route's first one. The whole file is validated and diffed
+# against the database with a couple of queries, then written with bulk
+# operations in a single transaction.
+
+REQUIRED_COLUMNS = ('route', 'stop')
+
+
+def split_stop_names(raw):
+    """Split newline/comma separated stop names, dropping blanks and repeats (first wins)."""
+    seen = set()
+    ordered = []
+    for line in (raw or '').splitlines():
+        for part in line.split(','):
+            name = part.strip()
+            if name and name not in seen:
+                seen.add(name)
+                ordered.append(name)
+    return ordered
+
+
+class RouteImportPlan:
+    """What an import would change. Built by ``plan_route_import``."""
+
+    def __init__(self):
+        self.routes_to_create = []   # BusRoute instances (unsaved)
+        self.routes_to_update = []   # (BusRoute, {field: (old, new)})
+        self.stops_to_create = []    # (route name, stop name, position)
+        self.stops_to_update = []    # (BoardingLocation, old position)
+        self.stops_to_delete = []    # BoardingLocation instances (only with prune)
+
+    @property
+    def has_changes(self):
+        return any([self.routes_to_create, self.routes_to_update, self.stops_to_create,
+                    self.stops_to_update, self.stops_to_delete])
+
+    def summary(self):
+        lines = []
+        for route in self.routes_to_create:
+            lines.append(f"+ route {route.name} (fee {route.fee}, {route.max_seats} seats)")
+        for route, changes in self.routes_to_update:
+            for field, (old, new) in changes.items():
+                lines.append(f"~ route {route.name}: {field} {old} -> {new}")
+        for route_name, stop, position in self.stops_to_create:
+            lines.append(f"+ stop {route_name} #{position}: {stop}")
+        for stop, old_position in self.stops_to_update:
+            lines.append(f"~ stop {stop.route.name}: {stop.name} #{old_position} -> #{stop.position}")
+        for stop in self.stops_to_delete:
+            lines.append(f"- stop {stop.route.name}: {stop.name}")
+        return lines
+
+
+def parse_routes_csv(text):
+    """Validate CSV text. Returns (rows by route name, list of error strings)."""
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [c.strip().lower() for c in (reader.fieldnames or [])]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        return {}, [f"Missing column(s): {', '.join(missing)}"]
+    reader.fieldnames = columns
+
+    routes = {}
+    errors = []
+    for lineno, row in enumerate(reader, start=2):
+        row = {k: (v or '').strip() for k, v in row.items() if k}
+        name, stop = row.get('route', ''), row.get('stop', '')
+        if not name:
+            errors.append(f"Line {lineno}: route name is required")
+            continue
+        if len(name) > 100:
+            errors.append(f"Line {lineno}: route name longer than 100 characters")
+            continue
+        entry = routes.setdefault(name, {'fee': None, 'max_seats': None, 'description': None, 'stops': []})
+
+        if row.get('fee'):
+            try:
+                fee = Decimal(row['fee'])
+                if fee < 0 or fee.as_tuple().exponent < -2:
+                    raise InvalidOperation
+            except InvalidOperation:
+                errors.append(f"Line {lineno}: invalid fee {row['fee']!r}")
+            else:
+                if entry['fee'] is not None and entry['fee'] != fee:
+                    errors.append(f"Line {lineno}: conflicting fee for {name}")
+                entry['fee'] = fee
+        if row.get('max_seats'):
+            if not row['max_seats'].isdigit() or int(row['max_seats']) < 1:
+                errors.append(f"Line {lineno}: invalid max_seats {row['max_seats']!r}")
+            else:
+                seats = int(row['max_seats'])
+                if entry['max_seats'] is not None and entry['max_seats'] != seats:
+                    errors.append(f"Line {lineno}: conflicting max_seats for {name}")
+                entry['max_seats'] = seats
+        if row.get('description'):
+            entry['description'] = row['description']
+
+        if stop:
+            if len(stop) > 200:
+                errors.append(f"Line {lineno}: stop name longer than 200 characters")
+            elif stop not in entry['stops']:
+                entry['stops'].append(stop)
+    return routes, errors
+
+
+def plan_route_import(routes, prune=False):
+    """Diff parsed rows against the database. Returns (plan, errors)."""
+    plan = RouteImportPlan()
+    errors = []
+    existing = {r.name: r for r in BusRoute.objects.filter(name__in=list(routes))}
+    stops = {}
+    for stop in BoardingLocation.objects.filter(route__in=list(existing.values())).select_related('route'):
+        stops.setdefault(stop.route.name, {})[stop.name] = stop
+
+    for name, data in routes.items():
+        route = existing.get(name)
+        if route is None:
+            if data['fee'] is None:
+                errors.append(f"New route {name} needs a fee")
+                continue
+            plan.routes_to_create.append(BusRoute(
+                name=name,
+                fee=data['fee'],
+                max_seats=data['max_seats'] or 50,
+                description=data['description'] or '',
+            ))
+            plan.stops_to_create.extend((name, stop, pos) for pos, stop in enumerate(data['stops'], start=1))
+            continue
+
+        changes = {}
+        for field in ('fee', 'max_seats', 'description'):
+            new = data[field]
+            if new is not None and getattr(route, field) != new:
+                changes[field] = (getattr(route, field), new)
+        if changes:
+            plan.routes_to_update.append((route, changes))
+
+        current = stops.get(name, {})
+        for pos, stop_name in enumerate(data['stops'], start=1):
+            stop = current.get(stop_name)
+            if stop is None:
+                plan.stops_to_create.append((name, stop_name, pos))
+            elif stop.position != pos:
+                old = stop.position
+                stop.position = pos
+                plan.stops_to_update.append((stop, old))
+        if prune and data['stops']:
+            listed = set(data['stops'])
+            plan.stops_to_delete.extend(s for n, s in current.items() if n not in listed)
+    return plan, errors
+
+
+def apply_route_import(plan, batch_size=500):
+    """Write a plan with bulk operations in one transaction."""
+    with transaction.atomic():
+        BusRoute.objects.bulk_create(plan.routes_to_create, batch_size=batch_size)
+        updated = []
+        for route, changes in plan.routes_to_update:
+            for field, (_, new) in changes.items():
+                setattr(route, field, new)
+            updated.append(route)
+        if updated:
+            BusRoute.objects.bulk_update(updated, ['fee', 'max_seats', 'description'], batch_size=batch_size)
+        if plan.stops_to_delete:
+            BoardingLocation.objects.filter(id__in=[s.id for s in plan.stops_to_delete]).delete()
+        if plan.stops_to_update:
+            BoardingLocation.objects.bulk_update(
+                [s for s, _ in plan.stops_to_update], ['position'], batch_size=batch_size
+            )
+        if plan.stops_to_create:
+            # Not every backend hands back primary keys from bulk_create, so
+            # resolve route ids by name in one query.
+            names = {route_name for route_name, _, _ in plan.stops_to_create}
+            route_ids = dict(BusRoute.objects.filter(name__in=names).values_list('name', 'id'))
+            BoardingLocation.objects.bulk_create(
+                [BoardingLocation(route_id=route_ids[r], name=stop, position=pos)
+                 for r, stop, pos in plan.stops_to_create],
+                batch_size=batch_size,
+            )
+        invalidate_catalogue()  # bulk operations send no signals
+    return {
+        'routes_created': len(plan.routes_to_create),
+        'routes_updated': len(plan.routes_to_update),
+        'stops_created': len(plan.stops_to_create),
+        'stops_updated': len(plan.stops_to_update),
+        'stops_deleted': len(plan.stops_to_delete),
+    }
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from django.conf import settings
+
+try:
+    import httpx
+except ImportError:  # Without httpx the chat skips the LLM backends and answers from the FAQ
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# LLM backends for the support chat. Each backend is an async generator of
+# reply chunks. Backends are tried in order behind a circuit breaker, so a
+# backend that keeps failing is skipped outright for a while instead of
+# costing every student a full timeout.
+
+SYSTEM_PROMPT = (
+    "You are a friendly support assistant for a college bus pass system called Busmate. "
+    "Answer concisely. If asked about status or steps, list clear steps."
+)
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://127.0.0.1:11434')
+HF_MODEL = "microsoft/Phi-3-mini-4k-instruct"  # small instruct model for fast replies
+MAX_NEW_TOKENS = 180
+
+CONNECT_TIMEOUT = 3.0   # a backend that can't accept a connection this fast is down
+READ_TIMEOUT = 20.0     # max wait between bytes; generation can be slow
+REPLY_DEADLINE = 30.0   # whole reply, all tries and backends included
+POOL_SIZE = 20          # max open connections per client
+KEEPALIVE_CONNECTIONS = 10
+RETRY_ATTEMPTS = 3      # tries per backend, only while nothing has been sent yet
+RETRY_BACKOFF = 0.25    # seconds, doubled after each failed try
+RETRY_STATUSES = (502, 503)  # the backend (or a proxy in front of it) is restarting or overloaded
+
+
+class CircuitBreaker:
+    """Open after ``threshold`` consecutive failures; allow one trial call after ``reset_after`` seconds."""
+
+    def __init__(self, name, threshold=3, reset_after=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.threshold:
+            if self.opened_at is None or self.trial_running:
+                logger.warning("Support chat backend %s disabled for %.0fs", self.name, self.reset_after)
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+
+class BackendError(RuntimeError):
+    """A backend answered with an error status. Only RETRY_STATUSES are worth retrying."""
+
+    def __init__(self, backend, status, text):
+        super().__init__(f"{backend} responded {status}: {text!r}")
+        self.retryable = status in RETRY_STATUSES
+
+
+def _retryable(exc):
+    if isinstance(exc, BackendError):
+        return exc.retryable
+    # Only failures to connect: the request never reached the backend. A read
+    # timeout means it is generating (or hung), and asking again would only
+    # queue a second generation behind the first.
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+async def _next_chunk(chunks, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"no reply within {REPLY_DEADLINE:g}s")
+    try:
+        return await asyncio.wait_for(chunks.__anext__(), remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"no reply within {REPLY_DEADLINE:g}s") from None
+
+
+class LatencyHistogram:
+    """Per-bucket (non-cumulative) counts of call durations in seconds."""
+
+    BOUNDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.BOUNDS) and seconds > self.BOUNDS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+    def snapshot(self):
+        labels = [f"<={b:g}s" for b in self.BOUNDS] + [f">{self.BOUNDS[-1]:g}s"]
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+# backend name -> {'first_chunk': ..., 'total': ..., 'failed': ...} histograms for this process
+LATENCY = {}
+
+
+def _observe(name, kind, seconds):
+    LATENCY.setdefault(name, {}).setdefault(kind, LatencyHistogram()).observe(seconds)
+
+
+def latency_report():
+    """Per-backend latency histograms plus circuit breaker state."""
+    return {
+        name: {
+            'breaker': breaker.state,
+            **{kind: h.snapshot() for kind, h in sorted(LATENCY.get(name, {}).items())},
+        }
+        for name, _, breaker in BACKENDS
+    }
+
+
+# At most BUSPASS_LLM_MAX_CONCURRENCY generations run at once (per event
+# loop, i.e. per ASGI worker); other chats wait up to
+# BUSPASS_LLM_QUEUE_TIMEOUT seconds for a slot before giving up.
+_gates = weakref.WeakKeyDictionary()
+
+
+def llm_gate():
+    loop = asyncio.get_running_loop()
+    gate = _gates.get(loop)
+    if gate is None:
+        gate = asyncio.Semaphore(getattr(settings, 'BUSPASS_LLM_MAX_CONCURRENCY', 2))
+        _gates[loop] = gate
+    return gate
+
+
+async def acquire_llm_slot():
+    """Wait for a generation slot. Returns False if none freed up in time."""
+    try:
+        await asyncio.wait_for(llm_gate().acquire(), getattr(settings, 'BUSPASS_LLM_QUEUE_TIMEOUT', 2.0))
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+# One AsyncClient (and so one connection pool) per event loop. Under ASGI
+# there is a single loop per process; under WSGI each async view call gets a
+# short-lived loop, and pooled connections cannot outlive it, so the chat view
+# closes the client with aclose_client() once the reply is done.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=30.0,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_client():
+    """Close the current event loop's client, if it has one."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def stream_ollama(message):
+    """Stream a reply from a local Ollama server's chat API."""
+    body = {
+        "model": os.environ.get('OLLAMA_MODEL', 'llama3:latest'),
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": message},
+        ],
+        "stream": True,
+        "options": {"temperature": 0.2, "num_predict": MAX_NEW_TOKENS},
+    }
+    async with get_client().stream('POST', f"{OLLAMA_URL}/api/chat", json=body) as resp:
+        if resp.status_code != 200:
+            text = (await resp.aread())[:300]
+            raise BackendError('Ollama', resp.status_code, text)
+        # One JSON object per line: { message: { role, content }, done: bool }
+        async for line in resp.aiter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            chunk = (data.get('message') or {}).get('content') or ''
+            if chunk:
+                yield chunk
+            # No break on done: reading to the end lets the connection go back to the pool
+
+
+async def stream_huggingface(message):
+    """Reply from the Hugging Face Inference API (not streamed; one chunk)."""
+    hf_key = os.environ.get('HUGGINGFACE_API_KEY')
+    if not hf_key:
+        return
+    prompt = f"{SYSTEM_PROMPT}\n\nUser: {message}\nAssistant:"
+    resp = await get_client().post(
+        f"https://api-inference.huggingface.co/models/{HF_MODEL}",
+        headers={"Authorization": f"Bearer {hf_key}"},
+        json={"inputs": prompt, "parameters": {"max_new_tokens": MAX_NEW_TOKENS, "temperature": 0.2}},
+    )
+    if resp.status_code != 200:
+        raise BackendError('HF', resp.status_code, resp.text[:300])
+    data = resp.json()
+    # API may return a list of dicts with 'generated_text'
+    if isinstance(data, list) and data and 'generated_text' in data[0]:
+        full = data[0]['generated_text']
+        reply = full.split("Assistant:")[-1].strip() or full.strip()
+    else:
+        # Some models return a dict with generated_text or text
+        reply = (data.get('generated_text') or data.get('text') or '').strip()
+    if reply:
+        yield reply
+
+
+BACKENDS = [
+    ('ollama', stream_ollama, CircuitBreaker('ollama')),
+    ('huggingface', stream_huggingface, CircuitBreaker('huggingface')),
+]
+
+
+async def stream_llm_reply(message, outcome=None):
+    """Yield reply chunks from the first healthy backend; yields nothing if none could answer.
+
+    Connection failures and 502/503 before the first chunk are retried with
+    exponential backoff; once part of a reply has gone out there is no
+    retrying or switching backends. The whole reply gets REPLY_DEADLINE
+    seconds, so a hung backend costs one slow try, not one per retry.
+    If given, ``outcome['complete']`` is set once a backend finished a reply.
+    """
+    if httpx is None:
+        return
+    deadline = time.monotonic() + REPLY_DEADLINE
+    for name, backend, breaker in BACKENDS:
+        if time.monotonic() >= deadline:
+            return
+        if not breaker.allow():
+            continue
+        produced = False
+        try:
+            for attempt in range(RETRY_ATTEMPTS):
+                started = time.monotonic()
+                chunks = backend(message)
+                try:
+                    while True:
+                        try:
+                            chunk = await _next_chunk(chunks, deadline)
+                        except StopAsyncIteration:
+                            break
+                        if not produced:
+                            produced = True
+                            _observe(name, 'first_chunk', time.monotonic() - started)
+                        yield chunk
+                    _observe(name, 'total', time.monotonic() - started)
+                    break
+                except Exception as e:
+                    _observe(name, 'failed', time.monotonic() - started)
+                    delay = RETRY_BACKOFF * 2 ** attempt
+                    if (produced or attempt + 1 == RETRY_ATTEMPTS or not _retryable(e)
+                            or time.monotonic() + delay >= deadline):
+                        raise
+                    logger.info("Support chat backend %s failed (%s), retrying", name, e)
+                    await asyncio.sleep(delay)
+                finally:
+                    await chunks.aclose()
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning("Support chat backend %s failed: %s", name, e)
+            if produced:
+                return  # Part of a reply already went out; don't splice in another backend
+            continue
+        finally:
+            breaker.trial_running = False  # also when the client disconnects mid-stream
+        breaker.record_success()
+        if produced:
+            if outcome is not None:
+                outcome['complete'] = True
+            return
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from BusPass.models import BusRoute
+from BusPass.seating import bulk_allocate
+from BusPass.tasks import pass_allocated
+
+
+class Command(BaseCommand):
+    help = "Allocate seats to PAID applications, oldest first, for one or more routes (default: all)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help='Route ids or names. Omit to process every route.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        routes = BusRoute.objects.order_by('name')
+        wanted = options['routes']
+        if wanted:
+            ids = [int(r) for r in wanted if r.isdigit()]
+            names = [r for r in wanted if not r.isdigit()]
+            routes = routes.filter(id__in=ids) | routes.filter(name__in=names)
+            missing = set(wanted) - {str(r.id) for r in routes} - {r.name for r in routes}
+            if missing:
+                raise CommandError(f"Unknown route(s): {', '.join(sorted(missing))}")
+
+        total_allocated = total_waitlisted = 0
+        for route in routes:
+            result = bulk_allocate(route, batch_size=options['batch_size'])
+            pass_allocated(result['allocated_ids'])
+            total_allocated += result['allocated']
+            total_waitlisted += result['waitlisted']
+            self.stdout.write(f"{route.name}: allocated {result['allocated']}, waitlisted {result['waitlisted']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: allocated {total_allocated}, waitlisted {total_waitlisted}"
+        ))
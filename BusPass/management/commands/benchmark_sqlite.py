@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from BusPass.dbtuning import BASELINE_PRAGMAS, run_benchmark, sqlite_pragmas
+
+
+class Command(BaseCommand):
+    help = ("Compare SQLite throughput with parallel writers and readers, stock settings vs the "
+            "tuned pragmas. Uses a scratch database file, never the real one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help="Lock wait in seconds for the baseline (Django's default is 5).")
+
+    def handle(self, *args, **options):
+        runs = [
+            ('baseline', BASELINE_PRAGMAS),
+            ('tuned', sqlite_pragmas(wal=True)),
+        ]
+        self.stdout.write(f"{options['writers']} writers, {options['readers']} readers, {options['seconds']}s each")
+        for label, pragmas in runs:
+            result = run_benchmark(pragmas, options['writers'], options['readers'], options['seconds'], options['timeout'])
+            self.stdout.write(
+                f"{label:>8}: {result['writes_per_s']:>6} writes/s  {result['reads_per_s']:>6} reads/s  "
+                f"{result['errors']} lock errors"
+            )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from BusPass.models import UserProfile
+from BusPass.photos import ORPHAN_GRACE_SECONDS, orphaned_photos, prepare_photo, store_photo, thumbnail_name
+
+
+class Command(BaseCommand):
+    help = ("Delete stored profile photos no profile uses (old uploads, replaced photos). "
+            "With --reencode, first move photos from before the image pipeline onto it. Safe to run from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reencode', action='store_true',
+                            help='Re-encode photos stored as uploaded and generate their thumbnails.')
+        parser.add_argument('--grace', type=int, default=ORPHAN_GRACE_SECONDS,
+                            help='Keep unused files younger than this many seconds (uploads in progress).')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted.')
+
+    def handle(self, *args, **options):
+        if options['reencode'] and not options['dry_run']:
+            self.reencode()
+        referenced = set(UserProfile.objects.exclude(photo='').exclude(photo__isnull=True)
+                         .values_list('photo', flat=True))
+        count = size = 0
+        for name, nbytes in orphaned_photos(referenced, grace_seconds=options['grace']):
+            if not options['dry_run']:
+                default_storage.delete(name)
+            count += 1
+            size += nbytes
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f"{count} unused photo file(s), {size / 1024:.0f} KB, {verb}"))
+
+    def reencode(self):
+        done = failed = 0
+        for profile in UserProfile.objects.exclude(photo='').exclude(photo__isnull=True).only('id', 'photo'):
+            if thumbnail_name(profile.photo.name, 'md'):
+                continue  # already processed
+            try:
+                with profile.photo.open('rb') as fh:
+                    name = store_photo(prepare_photo(fh))
+            except (OSError, ValueError) as exc:
+                self.stderr.write(f"Profile {profile.id}: cannot re-encode {profile.photo.name}: {exc}")
+                failed += 1
+                continue
+            UserProfile.objects.filter(pk=profile.pk, photo=profile.photo.name).update(photo=name)
+            done += 1
+        self.stdout.write(f"Re-encoded {done} photo(s), {failed} unreadable")
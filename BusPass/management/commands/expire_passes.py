@@ -0,0 +1,28 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from BusPass.validity import expire_passes, queue_renewal_reminders
+
+
+class Command(BaseCommand):
+    help = ("Expire passes past their end date, hand their seats to paid renewals and queue "
+            "renewal reminders. Run nightly from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Run as of this day (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--no-reminders', action='store_true', help='Only expire, do not queue reminders.')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['date']}")
+        result = expire_passes(today)
+        self.stdout.write(
+            f"Expired {result['expired']} pass(es), freed {result['seats_freed']} seat(s); "
+            f"renewed {result['renewed']}, requeued {result['requeued']} renewal(s)"
+        )
+        if not options['no_reminders']:
+            self.stdout.write(f"Queued {queue_renewal_reminders(today)} renewal reminder(s)")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from BusPass.exports import EXPORTS, EXPORT_FORMATS, EXPORT_CHUNK_SIZE, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream applications, routes or profiles to CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='fmt', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--status', help='Only applications with this status')
+        parser.add_argument('--route', type=int, help='Only applications on this route id')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['dataset'] == 'applications':
+            if options['status']:
+                filters['status'] = options['status']
+            if options['route']:
+                filters['route_id'] = options['route']
+
+        lines = stream_export(options['dataset'], options['fmt'], filters, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
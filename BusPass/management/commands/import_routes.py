@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from BusPass.imports import parse_routes_csv, plan_route_import, apply_route_import
+
+
+class Command(BaseCommand):
+    help = "Validate a routes/stops CSV, print the diff against the database, then apply it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the diff')
+        parser.add_argument('--prune', action='store_true', help='Remove stops not listed in the file')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_path'], encoding='utf-8-sig', newline='') as fh:
+                text = fh.read()
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        rows, errors = parse_routes_csv(text)
+        if not errors:
+            plan, errors = plan_route_import(rows, prune=options['prune'])
+        if errors:
+            raise CommandError("Import aborted:\n" + "\n".join(errors))
+
+        for line in plan.summary():
+            self.stdout.write(line)
+        if not plan.has_changes:
+            self.stdout.write("Nothing to change.")
+            return
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING("Dry run: no changes written."))
+            return
+
+        counts = apply_route_import(plan)
+        self.stdout.write(self.style.SUCCESS(
+            "Imported: {routes_created} routes created, {routes_updated} updated; "
+            "{stops_created} stops created, {stops_updated} moved, {stops_deleted} removed.".format(**counts)
+        ))
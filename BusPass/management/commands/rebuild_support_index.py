@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from BusPass.support_search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Reindex all support messages in the full-text index."
+
+    def handle(self, *args, **options):
+        if rebuild_index():
+            self.stdout.write(self.style.SUCCESS("Support message search index rebuilt"))
+        else:
+            self.stdout.write("Full-text index is SQLite only; other databases search without one")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from BusPass.counters import reconcile
+from BusPass.models import BusRoute
+
+
+class Command(BaseCommand):
+    help = "Recount each route's applications and repair drifted route counters. Safe to run from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it.')
+
+    def handle(self, *args, **options):
+        drifted = reconcile(BusRoute.objects.order_by('id'), dry_run=options['dry_run'])
+        for route, diff in drifted:
+            changes = ', '.join(f"{field} {stored} -> {actual}" for field, (stored, actual) in diff.items())
+            self.stdout.write(f"{route.name}: {changes}")
+        verb = 'would be fixed' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} route(s) {verb}"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from BusPass.reporting import RECHECK_DAYS, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Refresh the reporting rollups (DailyRouteStats) for recent days. Run nightly from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the rollups for the whole history.')
+        parser.add_argument('--recheck-days', type=int, default=RECHECK_DAYS,
+                            help='Also recompute this many past days to pick up status changes.')
+
+    def handle(self, *args, **options):
+        start, rows = refresh_rollups(full=options['full'], recheck_days=options['recheck_days'])
+        if start is None:
+            self.stdout.write("No applications yet; nothing to roll up")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rows} row(s) from {start}"))
@@ -0,0 +1,34 @@
+import signal
+from django.core.management.base import BaseCommand
+from BusPass import tasks  # noqa: F401  (registers the tasks)
+from BusPass.taskqueue import Worker, queue_limits
+
+
+class Command(BaseCommand):
+    help = ("Run background tasks from the task table. Runs until interrupted; "
+            "start as many workers as needed, on any machine sharing the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help='Queue to work (repeatable). Default: every queue in BUSPASS_TASK_QUEUES.')
+        parser.add_argument('--concurrency', type=int,
+                            help='Tasks per queue at once, overriding BUSPASS_TASK_QUEUES.')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between polls when idle.')
+        parser.add_argument('--drain', action='store_true', help='Exit once no task is due.')
+
+    def handle(self, *args, **options):
+        limits = queue_limits(options['queues'])
+        if options['concurrency']:
+            limits = {queue: options['concurrency'] for queue in limits}
+        worker = Worker(limits, poll_seconds=options['poll'])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the running tasks finish...")
+            worker.stop.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        queues = ', '.join(f"{queue} x{limit}" for queue, limit in limits.items())
+        self.stdout.write(f"Worker {worker.worker_id} on {queues}")
+        counts = worker.run(drain=options['drain'])
+        self.stdout.write(self.style.SUCCESS(f"Done {counts['done']}, failed {counts['failed']}"))
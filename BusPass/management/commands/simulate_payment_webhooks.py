@@ -0,0 +1,77 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import connection
+from BusPass.models import Payment
+from BusPass.payments import FakeGateway, confirm_payment
+
+
+class Command(BaseCommand):
+    help = ("Act as the fake payment gateway: send the webhook for pending 'fake' payments, "
+            "optionally repeated and from many threads, to exercise confirmation under bursts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Pending payments to decide.')
+        parser.add_argument('--repeat', type=int, default=1, help='Deliveries per callback (duplicates).')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Share of payments to fail.')
+        parser.add_argument('--url', default='',
+                            help='Site root to POST to, e.g. http://127.0.0.1:8000/buspass. '
+                                 'Without it callbacks are applied in this process.')
+
+    def handle(self, *args, **options):
+        gateway = FakeGateway()
+        payments = list(Payment.objects.filter(provider=gateway.name, status='PENDING').order_by('id')[:options['limit']])
+        if not payments:
+            self.stdout.write("No pending fake payments.")
+            return
+        callbacks = [gateway.callback(p, succeeded=random.random() >= options['decline_rate']) for p in payments]
+        deliveries = callbacks * options['repeat']
+        random.shuffle(deliveries)
+
+        url = options['url'].rstrip('/')
+        if url:
+            url += '/payment/webhook/fake/'
+        results = Counter()
+        lock = threading.Lock()
+
+        def worker(chunk):
+            local = Counter()
+            for body, headers in chunk:
+                local[self._deliver(gateway, url, body, headers)] += 1
+            if not url:
+                connection.close()
+            with lock:
+                results.update(local)
+
+        concurrency = max(options['concurrency'], 1)
+        threads = [threading.Thread(target=worker, args=(deliveries[i::concurrency],)) for i in range(concurrency)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        summary = ', '.join(f"{result} {count}" for result, count in sorted(results.items()))
+        self.stdout.write(f"{len(deliveries)} callbacks for {len(payments)} payments in {elapsed:.2f}s "
+                          f"({len(deliveries) / elapsed:.0f}/s): {summary}")
+
+    def _deliver(self, gateway, url, body, headers):
+        if not url:
+            event = gateway.parse_callback(body, headers[gateway.SIGNATURE_HEADER])
+            return confirm_payment(event) if event is not None else 'rejected'
+        request = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json', **headers})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())['result']
+        except urllib.error.HTTPError as exc:
+            return f'http {exc.code}'
+        except urllib.error.URLError:
+            return 'unreachable'
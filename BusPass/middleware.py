@@ -0,0 +1,39 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+from .roles import resolve_role
+
+
+class UserRoleMiddleware:
+    """Attach the session-cached role to ``request.user`` as ``busmate_role``.
+
+    Must come after AuthenticationMiddleware. The user stays lazy, so requests
+    that never touch ``request.user`` do not pay for it. Async-capable so the
+    async support chat view is not pushed onto a worker thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._wrap_user(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._wrap_user(request)
+        return await self.get_response(request)
+
+    def _wrap_user(self, request):
+        user = request.user
+        request.user = SimpleLazyObject(lambda: self._with_role(request, user))
+
+    @staticmethod
+    def _with_role(request, user):
+        if user.is_authenticated:
+            user.busmate_role = resolve_role(request, user)
+        return user
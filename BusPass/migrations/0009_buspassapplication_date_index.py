@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0008_userprofile_photo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='buspassapplication',
+            index=models.Index(fields=['-application_date', '-id'], name='bpa_date_id_idx'),
+        ),
+    ]
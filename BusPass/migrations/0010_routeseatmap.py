@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0009_buspassapplication_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteSeatMap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occupied', models.TextField(default='0')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='seat_map', to='BusPass.busroute')),
+            ],
+        ),
+    ]
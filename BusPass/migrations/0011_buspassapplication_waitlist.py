@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0010_routeseatmap'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='buspassapplication',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending Approval'), ('PAID', 'Fee Paid'), ('WAITLISTED', 'Waitlisted'), ('ALLOCATED', 'Seat Allocated'), ('REJECTED', 'Rejected'), ('CANCELLED', 'Cancelled by User')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='buspassapplication',
+            index=models.Index(fields=['route', 'status', 'application_date', 'id'], name='bpa_route_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0011_buspassapplication_waitlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='pass_token',
+            field=models.CharField(blank=True, default='', max_length=80),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:28
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_active_applications(apps, schema_editor):
+    """Keep one active application per (user, route) so the constraint can be added.
+
+    The survivor is the most advanced one (allocated, then waitlisted, paid,
+    pending), newest first; the rest are cancelled. Seat maps of the affected
+    routes are dropped and get rebuilt from ALLOCATED rows on next use.
+    """
+    BusPassApplication = apps.get_model('BusPass', 'BusPassApplication')
+    RouteSeatMap = apps.get_model('BusPass', 'RouteSeatMap')
+    rank = {'ALLOCATED': 0, 'WAITLISTED': 1, 'PAID': 2, 'PENDING': 3}
+    active = BusPassApplication.objects.filter(status__in=list(rank))
+    duplicated = (
+        active.values('user_id', 'route_id').annotate(n=models.Count('id')).filter(n__gt=1).order_by()
+    )
+
+    losers, routes = [], set()
+    for key in duplicated:
+        group = list(active.filter(user_id=key['user_id'], route_id=key['route_id']))
+        route_id = key['route_id']
+        group.sort(key=lambda a: (rank[a.status], -a.application_date.timestamp(), -a.id))
+        losers.extend(a.id for a in group[1:])
+        routes.add(route_id)
+    if losers:
+        BusPassApplication.objects.filter(id__in=losers).update(status='CANCELLED', seat_number=None, pass_token='')
+        RouteSeatMap.objects.filter(route_id__in=routes).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0012_buspassapplication_pass_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boardinglocation',
+            index=models.Index(fields=['route', 'position', 'name'], name='bl_route_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='buspassapplication',
+            index=models.Index(fields=['user', '-application_date'], name='bpa_user_date_idx'),
+        ),
+        migrations.RunPython(cancel_duplicate_active_applications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='buspassapplication',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'PAID', 'WAITLISTED', 'ALLOCATED'])), fields=('user', 'route'), name='bpa_one_active_per_route'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:37
+
+from django.db import migrations, models
+
+# The answers the support chat used to hard-code, as starting FAQ entries.
+INITIAL_FAQ = [
+    ("How do I see the bus routes?", "route, routes, bus, timings, stops",
+     "To view routes, go to 'View Routes' from your dashboard. "
+     "Click a route to apply, fill the form, and submit."),
+    ("How do I apply for a bus pass?", "apply, application, new pass",
+     "Apply by choosing a route, completing the form, and submitting. "
+     "You are then taken to the payment page. Once the payment is confirmed your status changes from PENDING "
+     "to PAID, and an admin may ALLOCATE a seat or put you on the WAITLIST if the route is full. "
+     "A declined payment cancels the application; you can then apply again."),
+    ("What is my pass status or seat?", "status, allocated, seat, waitlist",
+     "Check 'My Bus Pass' to see the latest status. If ALLOCATED, you'll see your seat number and can download the pass."),
+    ("How do I cancel my pass?", "cancel, refund",
+     "You can cancel a PENDING, PAID, WAITLISTED or ALLOCATED application from 'My Bus Pass' using the Cancel button."),
+    ("How do I log in or register?", "login, log in, register, account, password",
+     "Use Login from the navbar or register at /buspass/register/. If login fails, make sure cookies are enabled and retry."),
+]
+
+
+def add_initial_faq(apps, schema_editor):
+    FAQEntry = apps.get_model('BusPass', 'FAQEntry')
+    FAQEntry.objects.bulk_create([
+        FAQEntry(question=question, keywords=keywords, answer=answer)
+        for question, keywords, answer in INITIAL_FAQ
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0013_application_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FAQEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.CharField(max_length=200)),
+                ('keywords', models.TextField(blank=True, help_text='Comma or newline separated words/phrases that should trigger this answer')),
+                ('answer', models.TextField()),
+                ('priority', models.IntegerField(default=0, help_text='Breaks ties between equally good matches (higher wins)')),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'FAQ entry',
+                'verbose_name_plural': 'FAQ entries',
+                'ordering': ['-priority', 'id'],
+            },
+        ),
+        migrations.RunPython(add_initial_faq, migrations.RunPython.noop),
+    ]
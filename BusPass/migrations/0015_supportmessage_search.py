@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+FTS_TABLE = 'buspass_supportmessage_fts'
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 index of message text, kept in sync by triggers (SQLite only;
+    # see BusPass/support_search.py for the fallback on other backends).
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    statements = [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            message, content='BusPass_supportmessage', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON BusPass_supportmessage BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON BusPass_supportmessage BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF message ON BusPass_supportmessage BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+        END""",
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('_ai', '_ad', '_au'):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0014_faqentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='supportmessage',
+            index=models.Index(fields=['-created_at', '-id'], name='sm_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supportmessage',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='sm_user_date_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_counters(apps, schema_editor):
+    BusPassApplication = apps.get_model('BusPass', 'BusPassApplication')
+    RouteCounters = apps.get_model('BusPass', 'RouteCounters')
+    BusRoute = apps.get_model('BusPass', 'BusRoute')
+    fields = {'PENDING': 'pending', 'PAID': 'paid', 'WAITLISTED': 'waitlisted', 'ALLOCATED': 'allocated'}
+    counts = {}
+    rows = BusPassApplication.objects.filter(status__in=list(fields)).values('route_id', 'status').annotate(
+        n=models.Count('id')
+    )
+    for row in rows:
+        counts.setdefault(row['route_id'], {})[fields[row['status']]] = row['n']
+    RouteCounters.objects.bulk_create([
+        RouteCounters(route_id=route_id, **counts.get(route_id, {}))
+        for route_id in BusRoute.objects.values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0015_supportmessage_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteCounters',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pending', models.IntegerField(default=0)),
+                ('paid', models.IntegerField(default=0)),
+                ('waitlisted', models.IntegerField(default=0)),
+                ('allocated', models.IntegerField(default=0)),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='BusPass.busroute')),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0016_routecounters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRouteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('department', models.CharField(blank=True, max_length=100)),
+                ('applications', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('allocated', models.PositiveIntegerField(default=0)),
+                ('cancelled', models.PositiveIntegerField(default=0)),
+                ('rejected', models.PositiveIntegerField(default=0)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='BusPass.busroute')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyroutestats',
+            constraint=models.UniqueConstraint(fields=('day', 'route', 'department'), name='drs_day_route_dept_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0017_dailyroutestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+OLD_APPLY_ANSWER = (
+    "Apply by choosing a route, completing the form, and submitting. "
+    "Your status will be PENDING, then PAID (simulated), and an admin may ALLOCATE a seat."
+)
+NEW_APPLY_ANSWER = (
+    "Apply by choosing a route, completing the form, and submitting. "
+    "You are then taken to the payment page. Once the payment is confirmed your status changes from PENDING "
+    "to PAID, and an admin may ALLOCATE a seat or put you on the WAITLIST if the route is full. "
+    "A declined payment cancels the application; you can then apply again."
+)
+
+
+def update_apply_answer(apps, schema_editor):
+    # Only the seeded text; an answer an admin already edited is left alone
+    FAQEntry = apps.get_model('BusPass', 'FAQEntry')
+    FAQEntry.objects.filter(answer=OLD_APPLY_ANSWER).update(answer=NEW_APPLY_ANSWER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0018_buspassapplication_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='buspassapplication',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Awaiting Payment'), ('PAID', 'Fee Paid'), ('WAITLISTED', 'Waitlisted'), ('ALLOCATED', 'Seat Allocated'), ('REJECTED', 'Rejected'), ('CANCELLED', 'Cancelled by User')], default='PENDING', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=30)),
+                ('reference', models.CharField(max_length=64, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('status', models.CharField(choices=[('PENDING', 'Awaiting Confirmation'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('provider_payment_id', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('confirmed_at', models.DateTimeField(blank=True, null=True)),
+                ('application', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment', to='BusPass.buspassapplication')),
+            ],
+        ),
+        migrations.RunPython(update_apply_answer, migrations.RunPython.noop),
+    ]
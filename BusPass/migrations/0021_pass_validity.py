@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:07
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def start_terms(apps, schema_editor):
+    # Passes allocated before validity periods existed start their term now
+    # rather than on their application date, so none expires on deploy
+    BusPassApplication = apps.get_model('BusPass', 'BusPassApplication')
+    today = timezone.localdate()
+    BusPassApplication.objects.filter(status='ALLOCATED', valid_until__isnull=True).update(
+        valid_from=today,
+        valid_until=today + datetime.timedelta(days=getattr(settings, 'BUSPASS_PASS_VALIDITY_DAYS', 365)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BusPass', '0020_task'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='buspassapplication',
+            name='bpa_one_active_per_route',
+        ),
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='reminded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='renewed_from',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='renewal', to='BusPass.buspassapplication'),
+        ),
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='valid_from',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='buspassapplication',
+            name='valid_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='buspassapplication',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Awaiting Payment'), ('PAID', 'Fee Paid'), ('SCHEDULED', 'Renewal Scheduled'), ('WAITLISTED', 'Waitlisted'), ('ALLOCATED', 'Seat Allocated'), ('REJECTED', 'Rejected'), ('CANCELLED', 'Cancelled by User'), ('EXPIRED', 'Expired')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='buspassapplication',
+            index=models.Index(fields=['status', 'valid_until'], name='bpa_status_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='buspassapplication',
+            constraint=models.UniqueConstraint(condition=models.Q(('renewed_from__isnull', True), ('status__in', ['PENDING', 'PAID', 'SCHEDULED', 'WAITLISTED', 'ALLOCATED'])), fields=('user', 'route'), name='bpa_one_active_per_route'),
+        ),
+        migrations.RunPython(start_terms, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 import os
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .photos import thumbnail_url
 
 def user_profile_photo_path(instance, filename):    
     # File will be uploaded to MEDIA_ROOT/user_<id>/<filename>
@@ -24,6 +26,15 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username + (" (Admin)" if self.is_admin else "")
 
+    @property
+    def avatar_url(self):
+        """Small square thumbnail of the photo, for avatars."""
+        return thumbnail_url(self.photo, 'md')
+
+    @property
+    def avatar_large_url(self):
+        return thumbnail_url(self.photo, 'lg')
+
 class BusRoute(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
@@ -40,17 +51,27 @@ class BoardingLocation(models.Model):
 
     class Meta:
         unique_together = ('route', 'name')
+        indexes = [
+            # Ordered stop list for the application form dropdown
+            models.Index(fields=['route', 'position', 'name'], name='bl_route_position_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.route.name})"
 
+# Statuses in which an application still holds (or is queued for) a seat
+ACTIVE_APPLICATION_STATUSES = ['PENDING', 'PAID', 'SCHEDULED', 'WAITLISTED', 'ALLOCATED']
+
 class BusPassApplication(models.Model):
     STATUS_CHOICES = [
-        ('PENDING', 'Pending Approval'),
+        ('PENDING', 'Awaiting Payment'),
         ('PAID', 'Fee Paid'),
+        ('SCHEDULED', 'Renewal Scheduled'),
+        ('WAITLISTED', 'Waitlisted'),
         ('ALLOCATED', 'Seat Allocated'),
         ('REJECTED', 'Rejected'),
         ('CANCELLED', 'Cancelled by User'),
+        ('EXPIRED', 'Expired'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -60,6 +81,34 @@ class BusPassApplication(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     seat_number = models.CharField(max_length=10, blank=True, null=True) # Allocated seat
     paid_fee = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    pass_token = models.CharField(max_length=80, blank=True, default='') # Signed QR token (see tokens.py)
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True, unique=True) # One per rendered form (see applications.py)
+    valid_from = models.DateField(blank=True, null=True) # Set when a seat is allocated
+    valid_until = models.DateField(blank=True, null=True) # Last day the pass is valid
+    renewed_from = models.OneToOneField('self', on_delete=models.SET_NULL, blank=True, null=True, related_name='renewal') # Pass this one renews (see validity.py)
+    reminded_at = models.DateTimeField(blank=True, null=True) # Renewal reminder queued
+
+    class Meta:
+        indexes = [
+            # Backs the keyset-paginated admin listing (newest first)
+            models.Index(fields=['-application_date', '-id'], name='bpa_date_id_idx'),
+            # Per-route FIFO queues (PAID / WAITLISTED); the head is one index seek
+            models.Index(fields=['route', 'status', 'application_date', 'id'], name='bpa_route_queue_idx'),
+            # "My pass": a user's applications, newest first
+            models.Index(fields=['user', '-application_date'], name='bpa_user_date_idx'),
+            # Nightly expiry and renewal reminders: allocated passes by end date
+            models.Index(fields=['status', 'valid_until'], name='bpa_status_expiry_idx'),
+        ]
+        constraints = [
+            # One active application per user and route (a renewal runs
+            # alongside the pass it renews). The partial unique index also
+            # serves the duplicate check in apply_for_pass.
+            models.UniqueConstraint(
+                fields=['user', 'route'],
+                condition=models.Q(status__in=ACTIVE_APPLICATION_STATUSES, renewed_from__isnull=True),
+                name='bpa_one_active_per_route',
+            ),
+        ]
     
     def __str__(self):
         return f"Pass for {self.user.username} on Route {self.route.name}"
@@ -69,5 +118,132 @@ class SupportMessage(models.Model):
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Support inbox: newest first, overall and per user (keyset pagination)
+            models.Index(fields=['-created_at', '-id'], name='sm_date_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='sm_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"SupportMessage({self.user.username}, {self.created_at:%Y-%m-%d %H:%M})"
+
+class RouteSeatMap(models.Model):
+    """Per-route seat inventory stored as a bitmask (bit n-1 set => seat n taken)."""
+    route = models.OneToOneField(BusRoute, on_delete=models.CASCADE, related_name='seat_map')
+    occupied = models.TextField(default='0')  # hex-encoded bitmask
+    version = models.PositiveIntegerField(default=0)  # bumped on every change (optimistic lock)
+
+    @property
+    def mask(self):
+        return int(self.occupied or '0', 16)
+
+    def __str__(self):
+        return f"Seat map for {self.route.name}"
+
+class FAQEntry(models.Model):
+    """Support chat FAQ answer, matched on its keywords and question words."""
+    question = models.CharField(max_length=200)
+    keywords = models.TextField(blank=True, help_text="Comma or newline separated words/phrases that should trigger this answer")
+    answer = models.TextField()
+    priority = models.IntegerField(default=0, help_text="Breaks ties between equally good matches (higher wins)")
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-priority', 'id']
+        verbose_name = 'FAQ entry'
+        verbose_name_plural = 'FAQ entries'
+
+    def __str__(self):
+        return self.question
+
+class RouteCounters(models.Model):
+    """Denormalised application counts per route, kept current on every status change.
+
+    Maintained by BusPass.counters; ``manage.py reconcile_route_counters``
+    repairs any drift from the application table.
+    """
+    route = models.OneToOneField(BusRoute, on_delete=models.CASCADE, related_name='counters')
+    pending = models.IntegerField(default=0)
+    paid = models.IntegerField(default=0)
+    waitlisted = models.IntegerField(default=0)
+    allocated = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Counters for {self.route.name}"
+
+class DailyRouteStats(models.Model):
+    """Reporting rollup: applications made on ``day`` for a route by one department.
+
+    Outcome columns reflect the applications' status at the last refresh
+    (``manage.py refresh_reports``), not on ``day`` itself.
+    """
+    day = models.DateField()
+    route = models.ForeignKey(BusRoute, on_delete=models.CASCADE, related_name='daily_stats')
+    department = models.CharField(max_length=100, blank=True)
+    applications = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    allocated = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'route', 'department'], name='drs_day_route_dept_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.route.name} {self.department or '-'}"
+
+class Payment(models.Model):
+    """Fee payment for an application, confirmed by the provider's webhook (see payments.py)."""
+    STATUS_CHOICES = [
+        ('PENDING', 'Awaiting Confirmation'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+
+    application = models.OneToOneField(BusPassApplication, on_delete=models.CASCADE, related_name='payment')
+    provider = models.CharField(max_length=30)
+    reference = models.CharField(max_length=64, unique=True) # Our id for the payment, sent to the provider
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    provider_payment_id = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    confirmed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Payment {self.reference} ({self.status})"
+
+class Task(models.Model):
+    """A unit of background work, run by ``manage.py run_tasks`` (see taskqueue.py)."""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('DEAD', 'Dead (out of attempts)'),
+    ]
+
+    name = models.CharField(max_length=100) # Registered task name
+    kwargs = models.JSONField(default=dict, blank=True)
+    queue = models.CharField(max_length=30, default='default')
+    priority = models.SmallIntegerField(default=0) # Higher runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now) # Not before; pushed back on retry
+    claimed_by = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Claiming: the next due tasks of a queue, highest priority first
+            models.Index(fields=['queue', 'status', '-priority', 'run_at', 'id'], name='task_claim_idx'),
+        ]
+
     def __str__(self):
-        return f"SupportMessage({self.user.username}, {self.created_at:%Y-%m-%d %H:%M})"
\ No newline at end of file
+        return f"{self.name} #{self.id} ({self.status})"
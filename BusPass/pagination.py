@@ -0,0 +1,88 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# Keyset (cursor) pagination over a (timestamp, id) pair, newest first.
+# Unlike OFFSET paging every page is a single indexed range scan, so page 500
+# costs the same as page 1.
+
+
+def encode_cursor(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, pk) for a cursor string, or None if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        ts_raw, pk_raw = raw.rsplit('|', 1)
+        timestamp = parse_datetime(ts_raw)
+        pk = int(pk_raw)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if timestamp is None:
+        return None
+    return timestamp, pk
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, field, page_size, after=None, before=None):
+    """Slice ``queryset`` into a page ordered by (-field, -id).
+
+    ``after`` moves forward (older rows), ``before`` moves back (newer rows).
+    Runs exactly one query; one extra row is fetched to detect another page.
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key is not None:
+        ts, pk = before_key
+        qs = queryset.filter(Q(**{f'{field}__gt': ts}) | Q(**{field: ts, 'id__gt': pk}))
+        rows = list(qs.order_by(field, 'id')[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        qs = queryset
+        if after_key is not None:
+            ts, pk = after_key
+            qs = qs.filter(Q(**{f'{field}__lt': ts}) | Q(**{field: ts, 'id__lt': pk}))
+        rows = list(qs.order_by(f'-{field}', '-id')[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after_key is not None
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_next:
+            last = rows[-1]
+            next_cursor = encode_cursor(getattr(last, field), last.pk)
+        if has_prev:
+            first = rows[0]
+            prev_cursor = encode_cursor(getattr(first, field), first.pk)
+    return KeysetPage(rows, next_cursor, prev_cursor)
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core import checks
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+try:
+    import qrcode
+except ImportError:  # the pass still renders, but scanners cannot verify it: install qrcode
+    qrcode = None
+
+# Bus pass rendering. Passes are drawn with Pillow (PNG, and PDF from the same
+# image) and cached on disk under a hash of everything that appears on the
+# pass. A repeat download is then just a file read; anything that changes the
+# pass (seat, route, name, photo...) changes the hash and triggers a re-render.
+
+RENDER_VERSION = '2'  # bump when the layout changes to invalidate old renders
+PASS_FORMATS = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+}
+
+CARD_SIZE = (1011, 638)  # 85.6 x 54 mm at 300 dpi
+CARD_DPI = 300
+BRAND_COLOUR = (63, 81, 181)
+
+
+@checks.register()
+def check_qrcode(app_configs, **kwargs):
+    if qrcode is not None:
+        return []
+    return [checks.Warning(
+        'qrcode is not installed, so bus passes are rendered without their QR code.',
+        hint='pip install qrcode', id='BusPass.W001',
+    )]
+
+
+def pass_cache_dir():
+    return Path(getattr(settings, 'BUSPASS_PASS_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'passes'))
+
+
+def pass_fields(bus_pass):
+    user = bus_pass.user
+    return {
+        'id': bus_pass.id,
+        'name': user.get_full_name() or user.username,
+        'username': user.username,
+        'route': bus_pass.route.name,
+        'boarding': bus_pass.boarding_location,
+        'seat': bus_pass.seat_number or '',
+        'status': bus_pass.status,
+        'issued': bus_pass.application_date.strftime('%Y-%m-%d'),
+        'valid_until': bus_pass.valid_until.strftime('%d %b %Y') if bus_pass.valid_until else '',
+        'token': bus_pass.pass_token,  # encoded in the QR code
+    }
+
+
+def _photo_field(bus_pass):
+    try:
+        photo = bus_pass.user.userprofile.photo
+    except UserProfile.DoesNotExist:
+        return None
+    return photo or None
+
+
+def pass_fingerprint(bus_pass):
+    """Content hash of the pass fields and the profile photo."""
+    digest = hashlib.sha256(RENDER_VERSION.encode())
+    for key, value in sorted(pass_fields(bus_pass).items()):
+        digest.update(f'{key}={value}\0'.encode())
+    photo = _photo_field(bus_pass)
+    if photo is not None:
+        # Uploaded photos never overwrite each other, so the stored name
+        # changes whenever the photo does; the size guards against edits in place.
+        try:
+            size = photo.size
+        except OSError:
+            size = 0
+        digest.update(f'photo={photo.name}:{size}'.encode())
+    return digest.hexdigest()[:32]
+
+
+def _font(size):
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+def render_pass_image(bus_pass):
+    """Draw the pass card and return it as a PIL image."""
+    fields = pass_fields(bus_pass)
+    card = Image.new('RGB', CARD_SIZE, 'white')
+    draw = ImageDraw.Draw(card)
+    width, height = CARD_SIZE
+
+    draw.rectangle([0, 0, width, 110], fill=BRAND_COLOUR)
+    draw.text((40, 30), 'BUSMATE COLLEGE BUS PASS', fill='white', font=_font(48))
+
+    photo_box = (40, 150, 290, 430)
+    photo = _photo_field(bus_pass)
+    if photo is not None:
+        try:
+            with photo.open('rb') as fh, Image.open(fh) as img:
+                img = ImageOps.exif_transpose(img).convert('RGB')
+                img = ImageOps.fit(img, (photo_box[2] - photo_box[0], photo_box[3] - photo_box[1]))
+                card.paste(img, photo_box[:2])
+        except (OSError, ValueError):
+            photo = None
+    if photo is None:
+        draw.rectangle(photo_box, fill=(224, 224, 224))
+        draw.text((photo_box[0] + 70, photo_box[1] + 110), 'No photo', fill=(117, 117, 117), font=_font(30))
+
+    label_font, value_font = _font(26), _font(34)
+    y = 150
+    for label, value in (
+        ('Name', fields['name']),
+        ('Route', fields['route']),
+        ('Boarding', fields['boarding']),
+        ('Seat', fields['seat']),
+    ):
+        draw.text((330, y), label.upper(), fill=(110, 110, 110), font=label_font)
+        draw.text((330, y + 28), value, fill='black', font=value_font)
+        y += 80
+
+    draw.text((40, 470), f"Pass #{fields['id']}  Issued {fields['issued']}", fill=(80, 80, 80), font=label_font)
+    if fields['valid_until']:
+        draw.text((40, 520), f"VALID UNTIL {fields['valid_until'].upper()}", fill=(46, 125, 50), font=_font(40))
+    else:
+        draw.text((40, 520), 'VALID', fill=(46, 125, 50), font=_font(48))
+
+    if qrcode is None and fields['token']:
+        logger.error("qrcode is not installed: pass #%s rendered without its QR code", fields['id'])
+    elif fields['token']:
+        qr = qrcode.QRCode(border=1, box_size=6)
+        qr.add_data(fields['token'])
+        qr.make(fit=True)
+        qr_img = qr.make_image(fill_color='black', back_color='white').convert('RGB')
+        qr_img.thumbnail((240, 240))
+        card.paste(qr_img, (width - qr_img.width - 40, height - qr_img.height - 40))
+    return card
+
+
+def render_pass(bus_pass, fmt):
+    """Render the pass in ``fmt`` ('pdf' or 'png') and return the bytes."""
+    image = render_pass_image(bus_pass)
+    buf = io.BytesIO()
+    if fmt == 'pdf':
+        image.save(buf, 'PDF', resolution=CARD_DPI)
+    else:
+        image.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+def rendered_pass_path(bus_pass, fmt):
+    """Path of the cached render for the pass's current content, rendering it if needed.
+
+    Returns (path, fingerprint). The fingerprint doubles as the HTTP ETag.
+    """
+    fingerprint = pass_fingerprint(bus_pass)
+    cache_dir = pass_cache_dir()
+    path = cache_dir / f'{bus_pass.id}-{fingerprint}.{fmt}'
+    if path.exists():
+        return path, fingerprint
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data = render_pass(bus_pass, fmt)
+    # Write to a temp file and rename so concurrent downloads never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+    # Drop renders of older versions of this pass
+    for stale in cache_dir.glob(f'{bus_pass.id}-*.{fmt}'):
+        if stale != path:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+    return path, fingerprint
@@ -0,0 +1,166 @@
+import abc
+import hashlib
+import hmac
+import json
+import logging
+import uuid
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from .counters import record_transition
+from .models import BusPassApplication, Payment
+
+logger = logging.getLogger(__name__)
+
+# Payments. Submitting an application never talks to the payment provider:
+# the application is stored as PENDING with a Payment row, and the user is
+# sent to the provider's hosted checkout page, whose URL is built locally.
+# The provider then calls payment_webhook, and confirm_payment() moves the
+# application to PAID (or CANCELLED if the payment failed). A paid renewal of
+# a pass that is still running becomes SCHEDULED instead (see validity.py).
+#
+# Webhooks are delivered at least once, possibly many times and in bursts, so
+# confirm_payment() is a pair of conditional UPDATEs: only the first callback
+# for a payment changes anything, repeats are answered 'duplicate'.
+#
+# Providers are picked with the BUSPASS_PAYMENT_PROVIDER setting. 'fake' is a
+# local stand-in gateway for development, tests and load runs (see
+# ``manage.py simulate_payment_webhooks``).
+
+PaymentEvent = namedtuple('PaymentEvent', 'reference succeeded amount provider_payment_id')
+
+
+class PaymentProvider(abc.ABC):
+    """What a payment gateway integration has to provide."""
+
+    name = ''
+
+    @abc.abstractmethod
+    def checkout_url(self, payment):
+        """URL of the hosted page where the user pays ``payment``. Must not do network calls."""
+
+    @abc.abstractmethod
+    def parse_webhook(self, request):
+        """The PaymentEvent carried by a webhook request, or None if it is not authentic."""
+
+
+class FakeGateway(PaymentProvider):
+    """Local gateway: a checkout page on this site and HMAC-signed JSON callbacks."""
+
+    name = 'fake'
+    SIGNATURE_HEADER = 'X-Fake-Signature'
+
+    def _key(self):
+        secret = getattr(settings, 'BUSPASS_PAYMENT_WEBHOOK_SECRET', None) or settings.SECRET_KEY
+        return hashlib.sha256(f'busmate.fake-gateway:{secret}'.encode()).digest()
+
+    def sign(self, body):
+        return hmac.new(self._key(), body, hashlib.sha256).hexdigest()
+
+    def callback(self, payment, succeeded=True):
+        """(body, headers) of the webhook the gateway sends once ``payment`` is decided."""
+        body = json.dumps({
+            'reference': payment.reference,
+            'status': 'succeeded' if succeeded else 'failed',
+            'amount': str(payment.amount),
+            'id': f'fake_{uuid.uuid4().hex[:16]}',
+        }).encode()
+        return body, {self.SIGNATURE_HEADER: self.sign(body)}
+
+    def checkout_url(self, payment):
+        return reverse('fake_gateway_checkout', args=[payment.reference])
+
+    def parse_webhook(self, request):
+        return self.parse_callback(request.body, request.headers.get(self.SIGNATURE_HEADER, ''))
+
+    def parse_callback(self, body, signature):
+        if not hmac.compare_digest(signature.encode(), self.sign(body).encode()):
+            return None
+        try:
+            data = json.loads(body)
+            return PaymentEvent(
+                reference=str(data['reference']),
+                succeeded=data['status'] == 'succeeded',
+                amount=Decimal(str(data['amount'])),
+                provider_payment_id=str(data.get('id', '')),
+            )
+        except (ValueError, KeyError, TypeError, InvalidOperation):
+            return None
+
+
+PROVIDERS = {
+    'fake': FakeGateway,
+}
+
+
+def get_provider(name=None):
+    """Provider instance by name; defaults to the configured one. None if unknown."""
+    provider_class = PROVIDERS.get(name or getattr(settings, 'BUSPASS_PAYMENT_PROVIDER', 'fake'))
+    return provider_class() if provider_class else None
+
+
+def checkout_url_for(application):
+    """Where to send the user to pay for ``application``; None if nothing is awaiting payment."""
+    if application.status != 'PENDING':
+        return None
+    payment = getattr(application, 'payment', None)
+    provider = get_provider(payment.provider) if payment is not None and payment.status == 'PENDING' else None
+    return provider.checkout_url(payment) if provider is not None else None
+
+
+def start_payment(application, provider=None):
+    """Create the PENDING Payment for a new application (inside the caller's transaction)."""
+    payment = Payment(
+        application=application,
+        provider=(provider or get_provider()).name,
+        reference=uuid.uuid4().hex,
+        amount=application.paid_fee,
+    )
+    payment.save(force_insert=True)
+    return payment
+
+
+def confirm_payment(event):
+    """Apply a webhook event. Returns 'paid', 'failed', 'duplicate' or 'unknown'.
+
+    Safe to call any number of times per payment and from many workers at
+    once: the conditional UPDATEs let exactly one caller apply it.
+    """
+    status = 'SUCCEEDED' if event.succeeded else 'FAILED'
+    with transaction.atomic():
+        updated = Payment.objects.filter(
+            reference=event.reference, status='PENDING', amount=event.amount,
+        ).update(status=status, provider_payment_id=event.provider_payment_id, confirmed_at=timezone.now())
+        if not updated:
+            return _unapplied(event)
+        application_id, route_id, renews_status = Payment.objects.filter(reference=event.reference).values_list(
+            'application_id', 'application__route_id', 'application__renewed_from__status'
+        ).get()
+        if not event.succeeded:
+            new_status = 'CANCELLED'
+        elif renews_status == 'ALLOCATED':
+            new_status = 'SCHEDULED'  # takes over the seat when the current pass expires
+        else:
+            new_status = 'PAID'
+        if BusPassApplication.objects.filter(pk=application_id, status='PENDING').update(status=new_status):
+            record_transition(route_id, 'PENDING', new_status)
+        elif event.succeeded:
+            # Cancelled (or otherwise moved on) while the payment was in flight
+            logger.warning("Payment %s succeeded for application %s that is no longer pending; refund it",
+                           event.reference, application_id)
+    return 'paid' if event.succeeded else 'failed'
+
+
+def _unapplied(event):
+    payment = Payment.objects.filter(reference=event.reference).only('status', 'amount').first()
+    if payment is None:
+        logger.warning("Webhook for unknown payment %s", event.reference)
+        return 'unknown'
+    if payment.status == 'PENDING':
+        logger.warning("Webhook amount %s does not match payment %s (%s); ignored",
+                       event.amount, event.reference, payment.amount)
+        return 'unknown'
+    return 'duplicate'
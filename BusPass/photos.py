@@ -0,0 +1,193 @@
+import datetime
+import hashlib
+import io
+import os
+import re
+from collections import namedtuple
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+# Profile photos. Uploads are never stored as-is: prepare_photo() decodes the
+# upload (JPEG at a reduced scale where possible), applies and drops the EXIF
+# orientation, and re-encodes a bounded JPEG plus square thumbnails for the
+# avatar sizes. None of the metadata (GPS, camera...) survives re-encoding.
+#
+# Files are named after a hash of the uploaded bytes,
+#
+#   profile_photos/ab/<hash>.jpg, profile_photos/ab/<hash>_md.jpg, ...
+#
+# so uploading the same picture again (or someone else uploading it) reuses
+# the stored files instead of adding copies, and a name never changes content.
+# Photos no longer used by any profile are deleted when replaced (see
+# tasks.delete_replaced_photo) and by ``manage.py clean_photos``, which also
+# sweeps up uploads from before this pipeline (user_<id>/profile_photos/).
+#
+# A reused file is shared, so "no profile uses it" can stop being true at any
+# moment: another user may be saving a profile with the same picture. Storing
+# a photo therefore refreshes the modification time of files it reuses (and
+# re-creates any deleted meanwhile), and deletion only removes files unused
+# for ORPHAN_GRACE_SECONDS. A replaced photo younger than that is left to
+# clean_photos.
+
+PIPELINE_VERSION = '1'  # bump when the encoding changes, so new uploads get new names
+PHOTO_DIR = 'profile_photos'
+LEGACY_PHOTO_DIR_RE = re.compile(r'^user_\d+$')
+PHOTO_MAX_SIZE = 800  # px, longest side; the pass card prints it at 250 x 280
+PHOTO_QUALITY = 85
+THUMBNAIL_SIZES = {  # square, about twice the displayed size for sharp avatars
+    'md': 200,
+    'lg': 300,
+}
+THUMBNAIL_QUALITY = 80
+ORPHAN_GRACE_SECONDS = 3600  # unreferenced files younger than this may be an upload in progress
+
+_PIPELINE_NAME_RE = re.compile(rf'^{PHOTO_DIR}/[0-9a-f]{{2}}/([0-9a-f]{{32}})(?:_([a-z]+))?\.jpg$')
+
+PreparedPhoto = namedtuple('PreparedPhoto', 'digest files data')  # files: {name: JPEG bytes}; data: the upload
+
+
+def photo_name(digest, size=None):
+    suffix = f'_{size}' if size else ''
+    return f'{PHOTO_DIR}/{digest[:2]}/{digest}{suffix}.jpg'
+
+
+def thumbnail_name(name, size):
+    """Stored name of thumbnail ``size`` of photo ``name``; None for photos from before the pipeline."""
+    match = _PIPELINE_NAME_RE.match(name or '')
+    if match is None or match.group(2) or size not in THUMBNAIL_SIZES:
+        return None
+    return photo_name(match.group(1), size)
+
+
+def thumbnail_url(photo, size):
+    """URL of a thumbnail of ``photo`` (a FieldFile), falling back to the photo itself."""
+    if not photo:
+        return ''
+    name = thumbnail_name(photo.name, size)
+    return photo.storage.url(name) if name else photo.url
+
+
+def photo_files(name):
+    """Every stored file belonging to photo ``name`` (the photo and its thumbnails)."""
+    names = [name]
+    for size in THUMBNAIL_SIZES:
+        thumb = thumbnail_name(name, size)
+        if thumb:
+            names.append(thumb)
+    return names
+
+
+def _encode(image, quality):
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _decode(data):
+    image = Image.open(io.BytesIO(data))
+    # For JPEGs, let the decoder scale down by up to 8x: much faster than
+    # decoding a 12 MP photo in full only to shrink it
+    image.draft('RGB', (PHOTO_MAX_SIZE, PHOTO_MAX_SIZE))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        flat = Image.new('RGB', image.size, 'white')
+        flat.paste(image, mask=image.getchannel('A'))
+        return flat
+    return image.convert('RGB')
+
+
+def _render(data, digest):
+    try:
+        image = _decode(data)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as exc:
+        raise ValueError('Not a readable image') from exc
+    image.thumbnail((PHOTO_MAX_SIZE, PHOTO_MAX_SIZE), Image.LANCZOS)
+    files = {photo_name(digest): _encode(image, PHOTO_QUALITY)}
+    for size, px in THUMBNAIL_SIZES.items():
+        files[photo_name(digest, size)] = _encode(ImageOps.fit(image, (px, px), Image.LANCZOS), THUMBNAIL_QUALITY)
+    return files
+
+
+def prepare_photo(upload):
+    """Decode and re-encode an uploaded photo. Raises ValueError if it is not a usable image."""
+    upload.seek(0)
+    data = upload.read()
+    digest = hashlib.sha256(PIPELINE_VERSION.encode() + b'\0' + data).hexdigest()[:32]
+    if all(default_storage.exists(n) for n in photo_files(photo_name(digest))):
+        return PreparedPhoto(digest, {}, data)  # seen before: nothing to encode
+    return PreparedPhoto(digest, _render(data, digest), data)
+
+
+def _touch(name):
+    """Mark stored file ``name`` as just used. False if it is not stored."""
+    try:
+        os.utime(default_storage.path(name))
+    except FileNotFoundError:
+        return False
+    except NotImplementedError:  # storage without local paths: existence is all we can check
+        return default_storage.exists(name)
+    return True
+
+
+def store_photo(prepared):
+    """Write a prepared photo's files, refreshing those stored already. Returns the photo's name."""
+    name = photo_name(prepared.digest)
+    files = prepared.files
+    for stored in photo_files(name):
+        if _touch(stored):
+            continue
+        if stored not in files:
+            files = _render(prepared.data, prepared.digest)  # deleted since prepare_photo looked
+        saved = default_storage.save(stored, ContentFile(files[stored]))
+        if saved != stored:
+            default_storage.delete(saved)  # stored concurrently under the same hash
+    return name
+
+
+def delete_photo(name, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Delete photo ``name`` and its thumbnails, except files used in the last ``grace_seconds``.
+
+    The caller checks no profile uses it.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=grace_seconds)
+    for stored in photo_files(name):
+        try:
+            if default_storage.get_modified_time(stored) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        default_storage.delete(stored)
+
+
+def _walk(directory):
+    dirs, files = default_storage.listdir(directory)
+    for file in files:
+        yield f'{directory}/{file}'
+    for sub in dirs:
+        yield from _walk(f'{directory}/{sub}')
+
+
+def stored_photos():
+    """Names of every stored photo file, thumbnails and pre-pipeline uploads included."""
+    try:
+        top_dirs, _ = default_storage.listdir('')
+    except FileNotFoundError:
+        return
+    for directory in top_dirs:
+        if directory == PHOTO_DIR:
+            yield from _walk(directory)
+        elif LEGACY_PHOTO_DIR_RE.match(directory) and default_storage.exists(f'{directory}/profile_photos'):
+            yield from _walk(f'{directory}/profile_photos')
+
+
+def orphaned_photos(referenced, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Stored photo files not belonging to any name in ``referenced``, as (name, bytes)."""
+    keep = {stored for name in referenced for stored in photo_files(name)}
+    cutoff = timezone.now() - datetime.timedelta(seconds=grace_seconds)
+    for name in stored_photos():
+        if name in keep or default_storage.get_modified_time(name) > cutoff:
+            continue
+        yield name, default_storage.size(name)
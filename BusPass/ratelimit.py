@@ -0,0 +1,49 @@
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+# Per-user token buckets for the support endpoints, kept in Django's cache so
+# limits hold across workers when a shared backend (Redis, Memcached) is
+# configured. With the default local-memory cache every worker process keeps
+# its own buckets, so a user gets up to ``burst`` requests per process.
+#
+# A bucket holds up to ``burst`` tokens and refills at ``per_minute`` tokens
+# a minute; each request takes one. The read-modify-write is serialised
+# within a process, which makes it exact with the local-memory cache; across
+# processes sharing a cache it is not atomic, and requests from one user
+# racing on different workers can occasionally get a token or two extra.
+
+DEFAULT_RATE_LIMITS = {
+    # name: (burst, per_minute)
+    'support_message': (3, 2),
+    'support_chat': (5, 10),
+}
+
+
+def _limits(name):
+    return getattr(settings, 'BUSPASS_RATE_LIMITS', {}).get(name, DEFAULT_RATE_LIMITS[name])
+
+
+_lock = threading.Lock()
+
+
+def take_token(name, user_id):
+    """Take a token from the user's ``name`` bucket.
+
+    Returns 0 if the request may go ahead, otherwise the seconds until a
+    token will be available.
+    """
+    burst, per_minute = _limits(name)
+    rate = per_minute / 60.0
+    key = f'busmate:ratelimit:{name}:{user_id}'
+    with _lock:
+        now = time.time()
+        tokens, stamp = cache.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        if tokens < 1:
+            return max(1, math.ceil((1 - tokens) / rate))
+        # Keep the entry until the bucket would be full again anyway
+        cache.set(key, (tokens - 1, now), timeout=math.ceil(burst / rate))
+    return 0
@@ -0,0 +1,138 @@
+import datetime
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import BusPassApplication, DailyRouteStats, RouteCounters
+
+# Usage reports. The dashboard never groups the raw application table; it
+# reads DailyRouteStats, one row per (day, route, department), which
+# ``manage.py refresh_reports`` keeps up to date. A refresh only recomputes
+# recent days: everything from the last rolled-up day, plus RECHECK_DAYS
+# back so cancellations and rejections of recent applications are picked up.
+# Rebuild everything with --full (e.g. after bulk edits to old applications).
+#
+# Revenue counts the fee of applications that hold, held or wait for a seat;
+# cancelled and rejected ones are treated as refunded.
+
+RECHECK_DAYS = 60
+REPORT_PERIODS = (30, 90, 365)
+REVENUE_STATUSES = ['PAID', 'SCHEDULED', 'WAITLISTED', 'ALLOCATED', 'EXPIRED']
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def refresh_rollups(full=False, recheck_days=RECHECK_DAYS):
+    """Recompute DailyRouteStats from the first stale day on. Returns (start day, rows written)."""
+    today = timezone.localdate()
+    last = None if full else DailyRouteStats.objects.order_by('-day').values_list('day', flat=True).first()
+    if last is None:
+        first = BusPassApplication.objects.aggregate(first=Min('application_date'))['first']
+        if first is None:
+            DailyRouteStats.objects.all().delete()
+            return None, 0
+        start = timezone.localtime(first).date()
+    else:
+        start = min(last, today - datetime.timedelta(days=recheck_days))
+
+    rows = (
+        BusPassApplication.objects.filter(application_date__gte=_day_start(start))
+        .annotate(day=TruncDate('application_date'), dept=Coalesce('user__userprofile__department', Value('')))
+        .values('day', 'route_id', 'dept')
+        .annotate(
+            applications=Count('id'),
+            revenue=Coalesce(
+                Sum('paid_fee', filter=Q(status__in=REVENUE_STATUSES)),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            allocated=Count('id', filter=Q(status='ALLOCATED')),
+            cancelled=Count('id', filter=Q(status='CANCELLED')),
+            rejected=Count('id', filter=Q(status='REJECTED')),
+        )
+        .order_by()
+    )
+    stats = [
+        DailyRouteStats(
+            day=row['day'], route_id=row['route_id'], department=row['dept'],
+            applications=row['applications'], revenue=row['revenue'],
+            allocated=row['allocated'], cancelled=row['cancelled'], rejected=row['rejected'],
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        DailyRouteStats.objects.filter(day__gte=start).delete()
+        DailyRouteStats.objects.bulk_create(stats, batch_size=1000)
+    return start, len(stats)
+
+
+def _totals(queryset):
+    return queryset.annotate(
+        total_applications=Sum('applications'),
+        total_revenue=Sum('revenue'),
+        total_allocated=Sum('allocated'),
+        total_cancelled=Sum('cancelled'),
+        total_rejected=Sum('rejected'),
+    )
+
+
+def _rates(row):
+    applications = row['total_applications'] or 0
+    row['cancel_rate'] = round(100 * (row['total_cancelled'] or 0) / applications, 1) if applications else 0
+    row['reject_rate'] = round(100 * (row['total_rejected'] or 0) / applications, 1) if applications else 0
+    return row
+
+
+def usage_report(routes, days=30):
+    """Figures for the reports dashboard over the last ``days`` days.
+
+    ``routes`` is the route list to report occupancy for (the catalogue's).
+    Reads only rollup and counter rows, so cost does not grow with history.
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    period = DailyRouteStats.objects.filter(day__gte=since)
+    names = {route.id: route.name for route in routes}
+
+    totals = _rates(period.aggregate(
+        total_applications=Sum('applications'),
+        total_revenue=Sum('revenue'),
+        total_allocated=Sum('allocated'),
+        total_cancelled=Sum('cancelled'),
+        total_rejected=Sum('rejected'),
+    ))
+    by_route = [
+        _rates(dict(row, route_name=names.get(row['route_id'], f"#{row['route_id']}")))
+        for row in _totals(period.values('route_id')).order_by('-total_applications')
+    ]
+    by_department = [
+        _rates(row) for row in _totals(period.values('department')).order_by('-total_applications')
+    ]
+    per_day = list(period.values('day').annotate(total_applications=Sum('applications')).order_by('day'))
+    peak = max((row['total_applications'] for row in per_day), default=0)
+    for row in per_day:
+        row['percent'] = round(100 * row['total_applications'] / peak) if peak else 0
+
+    counters = RouteCounters.objects.in_bulk(field_name='route_id')
+    occupancy = []
+    for route in routes:
+        allocated = counters[route.id].allocated if route.id in counters else 0
+        occupancy.append({
+            'route_name': route.name,
+            'allocated': allocated,
+            'max_seats': route.max_seats,
+            'percent': round(100 * allocated / route.max_seats) if route.max_seats > 0 else 0,
+        })
+
+    return {
+        'days': days,
+        'since': since,
+        'totals': totals,
+        'by_route': by_route,
+        'by_department': by_department,
+        'per_day': per_day,
+        'occupancy': occupancy,
+        'data_until': DailyRouteStats.objects.order_by('-day').values_list('day', flat=True).first(),
+    }
@@ -0,0 +1,49 @@
+import uuid
+from django.core.cache import cache
+from .models import UserProfile
+
+# A user's role (admin or normal user) is read on almost every request by the
+# user_passes_test checks. Rather than loading UserProfile each time, the role
+# is kept in the session together with an "epoch" token held in the cache.
+# Saving or deleting a profile drops the epoch, which makes every session of
+# that user re-read the profile on its next request. With a shared cache
+# backend that is immediate; with the per-process local-memory cache other
+# workers pick the change up once their epoch entry expires.
+
+ROLE_SESSION_KEY = '_busmate_role'
+ROLE_EPOCH_TIMEOUT = 300  # seconds
+
+ADMIN = 'ADMIN'
+USER = 'USER'
+
+
+def _epoch_key(user_id):
+    return f'busmate:role-epoch:{user_id}'
+
+
+def load_role(user):
+    """Read the role straight from the user's profile (one query if not cached)."""
+    try:
+        return ADMIN if user.userprofile.is_admin else USER
+    except UserProfile.DoesNotExist:
+        return USER  # Users without a profile are treated as normal users
+
+
+def resolve_role(request, user):
+    """Role for ``user`` on this request, served from the session while current."""
+    key = _epoch_key(user.pk)
+    epoch = cache.get(key)
+    cached = request.session.get(ROLE_SESSION_KEY)
+    if epoch is not None and cached and cached.get('uid') == user.pk and cached.get('epoch') == epoch:
+        return cached['role']
+
+    if epoch is None:
+        cache.add(key, uuid.uuid4().hex, ROLE_EPOCH_TIMEOUT)
+        epoch = cache.get(key)
+    role = load_role(user)
+    request.session[ROLE_SESSION_KEY] = {'uid': user.pk, 'role': role, 'epoch': epoch}
+    return role
+
+
+def invalidate_role(user_id):
+    cache.delete(_epoch_key(user_id))
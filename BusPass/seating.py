@@ -0,0 +1,267 @@
+import datetime
+import logging
+import re
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .counters import record_transition
+from .models import ACTIVE_APPLICATION_STATUSES, BusPassApplication, RouteSeatMap
+from .tokens import default_valid_until, forget_token, issue_token
+
+logger = logging.getLogger(__name__)
+
+# Seat inventory for a route is a single RouteSeatMap row holding a bitmask of
+# occupied seats. Finding the lowest free seat is a couple of integer ops on
+# that mask instead of a COUNT over the application table, and every change
+# is a compare-and-swap on the row's version so two admins approving at the
+# same moment can never be handed the same seat.
+
+MAX_CLAIM_ATTEMPTS = 5
+_SEAT_RE = re.compile(r'^S-(\d+)$')
+
+
+def seat_label(seat):
+    return f"S-{seat:03d}"
+
+
+def parse_seat(label):
+    """Return the 1-based seat number for a label like 'S-007', or None."""
+    match = _SEAT_RE.match(label or '')
+    return int(match.group(1)) if match else None
+
+
+def new_term(start=None):
+    """(valid_from, valid_until) of a pass whose term starts on ``start`` (default: today)."""
+    start = start or timezone.localdate()
+    return start, start + datetime.timedelta(days=getattr(settings, 'BUSPASS_PASS_VALIDITY_DAYS', 365))
+
+
+def pass_token(application, seat):
+    """Signed QR token for ``application`` holding ``seat``; it expires with the pass."""
+    return issue_token(application.id, application.route_id, seat, application.valid_until or default_valid_until())
+
+
+def ensure_pass_token(application):
+    """Issue the token for an ALLOCATED pass that has none (older passes, renewals that took over a seat)."""
+    if application.status == 'ALLOCATED' and not application.pass_token:
+        application.pass_token = pass_token(application, parse_seat(application.seat_number) or 0)
+        BusPassApplication.objects.filter(pk=application.pk).update(pass_token=application.pass_token)
+    return application.pass_token
+
+
+def lowest_free_seat(mask):
+    """1-based number of the lowest clear bit in ``mask``."""
+    return (~mask & (mask + 1)).bit_length()
+
+
+def _rebuild_mask(route_id):
+    mask = 0
+    labels = BusPassApplication.objects.filter(
+        route_id=route_id, status='ALLOCATED'
+    ).values_list('seat_number', flat=True)
+    for label in labels:
+        seat = parse_seat(label)
+        if seat:
+            mask |= 1 << (seat - 1)
+    return mask
+
+
+def seat_map_for_update(route_id):
+    """The route's seat map, created from the allocated seats on first use. Change it with swap_seat_map()."""
+    seat_map = RouteSeatMap.objects.select_for_update().filter(route_id=route_id).first()
+    if seat_map is None:
+        # First use of this route: seed the map from seats already handed out.
+        seat_map, _ = RouteSeatMap.objects.get_or_create(
+            route_id=route_id,
+            defaults={'occupied': format(_rebuild_mask(route_id), 'x')},
+        )
+    return seat_map
+
+
+def swap_seat_map(seat_map, new_mask):
+    """Store ``new_mask`` if nobody changed the map since it was read."""
+    return RouteSeatMap.objects.filter(pk=seat_map.pk, version=seat_map.version).update(
+        occupied=format(new_mask, 'x'), version=F('version') + 1
+    ) == 1
+
+
+def allocate_seat(application):
+    """Give a PAID application the lowest free seat on its route.
+
+    Returns the seat label. If the route is full the application joins the
+    route's waitlist instead and None is returned; None is also returned if
+    the application is no longer PAID (e.g. another admin processed it first).
+    """
+    route = application.route
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        with transaction.atomic():
+            seat_map = seat_map_for_update(route.id)
+            mask = seat_map.mask
+            seat = lowest_free_seat(mask)
+            if seat > route.max_seats:
+                if BusPassApplication.objects.filter(pk=application.pk, status='PAID').update(status='WAITLISTED'):
+                    record_transition(route.id, 'PAID', 'WAITLISTED')
+                    application.status = 'WAITLISTED'
+                return None
+            if not swap_seat_map(seat_map, mask | (1 << (seat - 1))):
+                continue
+            label = seat_label(seat)
+            application.valid_from, application.valid_until = new_term()
+            token = pass_token(application, seat)
+            claimed = BusPassApplication.objects.filter(pk=application.pk, status='PAID').update(
+                status='ALLOCATED', seat_number=label, pass_token=token,
+                valid_from=application.valid_from, valid_until=application.valid_until,
+            )
+            if not claimed:
+                transaction.set_rollback(True)
+                return None
+            record_transition(route.id, 'PAID', 'ALLOCATED')
+        application.status = 'ALLOCATED'
+        application.seat_number = label
+        application.pass_token = token
+        return label
+    logger.warning("Gave up allocating a seat on route %s after %d attempts", route.id, MAX_CLAIM_ATTEMPTS)
+    return None
+
+
+def waitlist_head(route_id):
+    """Oldest WAITLISTED application on the route (an index seek, not a scan)."""
+    return (
+        BusPassApplication.objects.select_for_update()
+        .filter(route_id=route_id, status='WAITLISTED')
+        .order_by('application_date', 'id')
+        .first()
+    )
+
+
+def waitlist_position(application):
+    """1-based place of a WAITLISTED application in its route's queue."""
+    return BusPassApplication.objects.filter(
+        Q(application_date__lt=application.application_date)
+        | Q(application_date=application.application_date, id__lt=application.id),
+        route_id=application.route_id,
+        status='WAITLISTED',
+    ).count() + 1
+
+
+def release_seat(application, status):
+    """Move ``application`` to ``status`` (REJECTED/CANCELLED) and free its seat.
+
+    If a seat was freed, the head of the route's waitlist is promoted into it.
+    The status change, the seat release and the promotion commit together.
+    The row is re-read first, so a stale ``application`` (promoted, released
+    or expired since it was loaded) is handled by its current state; if it is
+    no longer active nothing changes. Returns the promoted application, if any.
+    """
+    route = application.route
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        promoted = None
+        with transaction.atomic():
+            current = (
+                BusPassApplication.objects.select_for_update()
+                .filter(pk=application.pk).values('status', 'seat_number').first()
+            )
+            if current is None or current['status'] not in ACTIVE_APPLICATION_STATUSES:
+                if current is not None:
+                    application.status, application.seat_number = current['status'], current['seat_number']
+                return None
+            old_status, old_seat = current['status'], current['seat_number']
+            # Only from the state just read; anyone who got there in between
+            # makes this a no-op
+            released = BusPassApplication.objects.filter(
+                pk=application.pk, status=old_status, seat_number=old_seat,
+            ).update(status=status, seat_number=None, pass_token='')
+            if not released:
+                continue
+            if old_status == 'ALLOCATED':
+                pass_id = application.pk
+                transaction.on_commit(lambda: forget_token(pass_id))  # its token stops verifying
+            seat = parse_seat(old_seat) if old_status == 'ALLOCATED' else None
+            if seat:
+                seat_map = seat_map_for_update(route.id)
+                mask = seat_map.mask & ~(1 << (seat - 1))
+                next_seat = lowest_free_seat(mask)
+                if next_seat <= route.max_seats:
+                    promoted = waitlist_head(route.id)
+                    if promoted is not None:
+                        mask |= 1 << (next_seat - 1)
+                if not swap_seat_map(seat_map, mask):
+                    transaction.set_rollback(True)
+                    continue
+                if promoted is not None:
+                    promoted.valid_from, promoted.valid_until = new_term()
+                    promoted.pass_token = pass_token(promoted, next_seat)
+                    if not BusPassApplication.objects.filter(pk=promoted.pk, status='WAITLISTED').update(
+                        status='ALLOCATED', seat_number=seat_label(next_seat), pass_token=promoted.pass_token,
+                        valid_from=promoted.valid_from, valid_until=promoted.valid_until,
+                    ):
+                        # The head left the waitlist (e.g. cancelled) meanwhile; start over
+                        transaction.set_rollback(True)
+                        continue
+                    promoted.status = 'ALLOCATED'
+                    promoted.seat_number = seat_label(next_seat)
+                    record_transition(route.id, 'WAITLISTED', 'ALLOCATED')
+            record_transition(route.id, old_status, status)
+        application.status = status
+        application.seat_number = None
+        application.pass_token = ''
+        return promoted
+    logger.warning("Gave up releasing seat %s on route %s", application.seat_number, route.id)
+    return None
+
+
+def free_seat_count(mask, max_seats):
+    taken = bin(mask & ((1 << max_seats) - 1)).count('1') if max_seats > 0 else 0
+    return max(max_seats - taken, 0)
+
+
+def bulk_allocate(route, batch_size=500):
+    """Allocate seats to a route's WAITLISTED and PAID queue, oldest application first.
+
+    Everything happens in one transaction: the seat map is claimed once, only
+    as many applications as there are free seats are loaded, they are written
+    back with batched bulk_update, and whoever is left over is moved to the
+    waitlist with a single UPDATE. Returns a dict with the number of
+    applications ``allocated`` (and their ids, ``allocated_ids``) and the
+    number ``waitlisted``.
+    """
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        with transaction.atomic():
+            seat_map = seat_map_for_update(route.id)
+            mask = seat_map.mask
+            queue = BusPassApplication.objects.filter(route=route, status__in=['WAITLISTED', 'PAID'])
+            waiting = queue.count()
+            free = free_seat_count(mask, route.max_seats)
+            batch = list(
+                queue.select_for_update()
+                .order_by('application_date', 'id')
+                .only('id', 'route_id', 'status', 'seat_number', 'pass_token', 'valid_from', 'valid_until')[:free]
+            )
+            valid_from, valid_until = new_term()
+            from_waitlist = sum(1 for application in batch if application.status == 'WAITLISTED')
+            for application in batch:
+                seat = lowest_free_seat(mask)
+                mask |= 1 << (seat - 1)
+                application.status = 'ALLOCATED'
+                application.seat_number = seat_label(seat)
+                application.valid_from, application.valid_until = valid_from, valid_until
+                application.pass_token = pass_token(application, seat)
+            if batch and not swap_seat_map(seat_map, mask):
+                continue
+            BusPassApplication.objects.bulk_update(
+                batch, ['status', 'seat_number', 'pass_token', 'valid_from', 'valid_until'], batch_size=batch_size
+            )
+            record_transition(route.id, 'WAITLISTED', 'ALLOCATED', from_waitlist)
+            record_transition(route.id, 'PAID', 'ALLOCATED', len(batch) - from_waitlist)
+            if waiting > len(batch):
+                moved = BusPassApplication.objects.filter(route=route, status='PAID').update(status='WAITLISTED')
+                record_transition(route.id, 'PAID', 'WAITLISTED', moved)
+        return {
+            'route': route,
+            'allocated': len(batch),
+            'allocated_ids': [application.id for application in batch],
+            'waitlisted': waiting - len(batch),
+        }
+    logger.warning("Gave up bulk allocation on route %s after %d attempts", route.id, MAX_CLAIM_ATTEMPTS)
+    return {'route': route, 'allocated': 0, 'allocated_ids': [], 'waitlisted': waiting}
@@ -0,0 +1,27 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .catalogue import invalidate_catalogue
+from .dbtuning import configure_sqlite_connection
+from .faq import invalidate_faq
+from .models import BoardingLocation, BusRoute, FAQEntry, UserProfile
+from .roles import invalidate_role
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def userprofile_changed(sender, instance, **kwargs):
+    invalidate_role(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=FAQEntry)
+def faq_changed(sender, instance, **kwargs):
+    invalidate_faq()
+
+
+@receiver([post_save, post_delete], sender=BusRoute)
+@receiver([post_save, post_delete], sender=BoardingLocation)
+def route_catalogue_changed(sender, instance, **kwargs):
+    invalidate_catalogue()
+
+
+connection_created.connect(configure_sqlite_connection, dispatch_uid='buspass-sqlite-pragmas')
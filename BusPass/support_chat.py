@@ -0,0 +1,33 @@
+from .chat_cache import response_cache
+from .faq import FALLBACK_REPLY, MIN_COVERAGE, aget_matcher
+from .llm import acquire_llm_slot, llm_gate, stream_llm_reply
+
+# Support chat pipeline: a confident FAQ match first, then cached LLM replies,
+# then the LLM backends, and finally the best FAQ match (however weak) or a
+# generic hint so the student always gets a reply. The fallback is also used
+# when all LLM slots stay busy for longer than the queue timeout.
+
+
+async def reply_chunks(message):
+    """Async iterator of reply text chunks for ``message``."""
+    faq = (await aget_matcher()).match(message)
+    if faq is not None and faq.coverage >= MIN_COVERAGE:
+        yield faq.answer
+        return
+    cached = response_cache.get(message)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    outcome = {}
+    if await acquire_llm_slot():
+        try:
+            async for chunk in stream_llm_reply(message, outcome):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            llm_gate().release()
+    if outcome.get('complete'):
+        response_cache.set(message, ''.join(chunks).strip())  # only whole replies
+    elif not chunks:
+        yield faq.answer if faq is not None else FALLBACK_REPLY
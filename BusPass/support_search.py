@@ -0,0 +1,69 @@
+import re
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from .models import SupportMessage
+
+# Full-text search over support messages. On SQLite the messages are indexed
+# in an FTS5 table that mirrors BusPass_supportmessage through triggers, so
+# every insert, update and delete (bulk ones included) keeps it in sync. Other
+# backends fall back to a case-insensitive substring match per search word.
+#
+# The table and triggers are created by migration 0015. SQLite drops a
+# table's triggers when a migration rebuilds the table, so such a migration
+# must run 0015's create_search_index again (it only creates what is missing).
+# ``manage.py rebuild_support_index`` reindexes every message.
+
+FTS_TABLE = 'buspass_supportmessage_fts'
+
+# Above this many matches it is cheaper to walk the inbox's date index and
+# probe the match set than to fetch and sort every matching message.
+BROAD_MATCH_ROWS = 1000
+
+_WORD = re.compile(r'\w+')
+
+
+def search_terms(query):
+    return _WORD.findall(query or '')[:16]
+
+
+def fts_expression(terms):
+    """FTS5 query matching all ``terms``; the last one also as a prefix (search-as-you-type)."""
+    quoted = ['"%s"' % t for t in terms]  # \w+ never contains a double quote
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def search_messages(queryset, query):
+    """Restrict a SupportMessage queryset to messages containing every word of ``query``."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    if uses_fts():
+        expression = fts_expression(terms)
+        matches = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM ({matches} LIMIT {BROAD_MATCH_ROWS + 1})', [expression])
+            broad = cursor.fetchone()[0] > BROAD_MATCH_ROWS
+        if not broad:
+            return queryset.filter(id__in=RawSQL(matches, [expression]))
+        # Unary + keeps SQLite from driving the query off the match list
+        table = SupportMessage._meta.db_table
+        return queryset.filter(RawSQL(f'+"{table}"."id" IN ({matches})', [expression], output_field=BooleanField()))
+    for term in terms:
+        queryset = queryset.filter(message__icontains=term)
+    return queryset
+
+
+def rebuild_index():
+    """Reindex every message from BusPass_supportmessage. SQLite only."""
+    if not uses_fts():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
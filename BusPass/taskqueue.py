@@ -0,0 +1,263 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.db import OperationalError, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Background tasks without a broker. Work is a row in the Task table; views
+# only insert rows (thousands of notifications are a few fan-out rows that a
+# worker expands) and ``manage.py run_tasks`` workers execute them.
+#
+#   * Claiming is a conditional UPDATE (status QUEUED -> RUNNING, tagged with
+#     a claim token), so any number of workers can poll the same table.
+#   * Each queue runs at most N tasks at a time per worker
+#     (BUSPASS_TASK_QUEUES = {'email': 4, ...}); higher priority runs first.
+#   * A failing task is retried with exponential backoff; once it is out of
+#     attempts it is parked as DEAD with its traceback (requeue from the admin).
+#   * A task whose worker died is put back after LEASE_SECONDS.
+#
+# Tasks are plain functions registered with @task (see tasks.py); their
+# keyword arguments must be JSON-serialisable.
+
+TASKS = {}
+
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+LEASE_SECONDS = 15 * 60
+DONE_RETENTION_DAYS = 7
+MAINTENANCE_SECONDS = 60
+ENQUEUE_BATCH_SIZE = 500
+FANOUT_CHUNK = 500
+FANOUT_DIRECT = 20
+
+
+def task(queue='default', priority=0, max_attempts=5, name=None):
+    """Register a function as a task. Adds ``func.enqueue(**kwargs)``."""
+    def register(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        func.task_options = {'queue': queue, 'priority': priority, 'max_attempts': max_attempts}
+        func.enqueue = lambda **kwargs: enqueue(func, kwargs)
+        TASKS[func.task_name] = func
+        return func
+    return register
+
+
+def _build(func, kwargs, run_at=None, priority=None):
+    options = func.task_options
+    return Task(
+        name=func.task_name,
+        kwargs=kwargs or {},
+        queue=options['queue'],
+        priority=options['priority'] if priority is None else priority,
+        max_attempts=options['max_attempts'],
+        run_at=run_at or timezone.now(),
+    )
+
+
+def enqueue(func, kwargs=None, run_at=None, priority=None):
+    """Queue one run of task ``func``. Inside a transaction, it is queued only if that commits."""
+    queued = _build(func, kwargs, run_at, priority)
+    queued.save(force_insert=True)
+    return queued
+
+
+def enqueue_many(func, kwargs_list, run_at=None, priority=None):
+    """Queue a run of ``func`` per kwargs dict with batched INSERTs. Returns the count."""
+    rows = [_build(func, kwargs, run_at, priority) for kwargs in kwargs_list]
+    Task.objects.bulk_create(rows, batch_size=ENQUEUE_BATCH_SIZE)
+    return len(rows)
+
+
+@task(priority=100)
+def fan_out(task_name, kwargs_list, priority=None):
+    """Expand one queued row into a run of ``task_name`` per kwargs dict."""
+    enqueue_many(TASKS[task_name], kwargs_list, priority=priority)
+
+
+def enqueue_fanout(func, kwargs_list, priority=None):
+    """Queue many runs of ``func`` at the cost of one row per FANOUT_CHUNK runs.
+
+    A worker expands the rows, so a view can queue thousands of notifications
+    with a couple of INSERTs. Small lists are queued directly.
+    """
+    if len(kwargs_list) <= FANOUT_DIRECT:
+        return enqueue_many(func, kwargs_list, priority=priority)
+    chunks = [kwargs_list[i:i + FANOUT_CHUNK] for i in range(0, len(kwargs_list), FANOUT_CHUNK)]
+    enqueue_many(fan_out, [
+        {'task_name': func.task_name, 'kwargs_list': chunk, 'priority': priority} for chunk in chunks
+    ])
+    return len(kwargs_list)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+def claim(queue, limit, worker_id):
+    """Mark up to ``limit`` due tasks of ``queue`` RUNNING for this worker and return them."""
+    now = timezone.now()
+    due = list(
+        Task.objects.filter(queue=queue, status='QUEUED', run_at__lte=now)
+        .order_by('-priority', 'run_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not due:
+        return []
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+    # Another worker may claim some of the same rows first; we get the rest
+    claimed = Task.objects.filter(id__in=due, status='QUEUED').update(
+        status='RUNNING', claimed_by=token, claimed_at=now, attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return []
+    return list(Task.objects.filter(claimed_by=token, status='RUNNING').order_by('-priority', 'run_at', 'id'))
+
+
+def execute(queued):
+    """Run a claimed task's function. Returns None on success, else the traceback."""
+    func = TASKS.get(queued.name)
+    try:
+        if func is None:
+            raise LookupError(f'No task registered as {queued.name!r}')
+        func(**queued.kwargs)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def finish(done):
+    """Mark tasks that ran successfully DONE, in one UPDATE."""
+    if done:
+        Task.objects.filter(
+            pk__in=[queued.pk for queued in done], claimed_by__in={queued.claimed_by for queued in done},
+        ).update(status='DONE', finished_at=timezone.now(), last_error='')
+
+
+def fail(queued, error):
+    """Schedule a retry of a failed task, or park it as DEAD once out of attempts."""
+    mine = Task.objects.filter(pk=queued.pk, claimed_by=queued.claimed_by)
+    if queued.attempts >= queued.max_attempts:
+        mine.update(status='DEAD', finished_at=timezone.now(), last_error=error)
+        logger.error("Task %s #%s is dead after %d attempts:\n%s", queued.name, queued.pk, queued.attempts, error)
+    else:
+        delay = retry_delay(queued.attempts)
+        mine.update(status='QUEUED', claimed_by='', last_error=error,
+                    run_at=timezone.now() + datetime.timedelta(seconds=delay))
+        logger.warning("Task %s #%s failed (attempt %d), retrying in %ds",
+                       queued.name, queued.pk, queued.attempts, delay)
+
+
+def requeue(queryset):
+    """Give DEAD tasks a fresh set of attempts. Returns the count."""
+    return queryset.filter(status='DEAD').update(
+        status='QUEUED', attempts=0, claimed_by='', run_at=timezone.now(), finished_at=None,
+    )
+
+
+def recover_stale(lease_seconds=LEASE_SECONDS):
+    """Put back tasks whose worker stopped reporting (crashed or killed) mid-run."""
+    stale = Task.objects.filter(status='RUNNING', claimed_at__lt=timezone.now() - datetime.timedelta(seconds=lease_seconds))
+    dead = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='DEAD', finished_at=timezone.now(), last_error='Worker lost while running the task',
+    )
+    return dead + stale.update(status='QUEUED', claimed_by='', run_at=timezone.now())
+
+
+def purge_done(days=DONE_RETENTION_DAYS):
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    return Task.objects.filter(status='DONE', finished_at__lt=cutoff).delete()[0]
+
+
+def queue_limits(queues=None):
+    """{queue: max tasks running at once per worker} from BUSPASS_TASK_QUEUES."""
+    limits = getattr(settings, 'BUSPASS_TASK_QUEUES', {'default': 2})
+    if queues:
+        limits = {queue: limits.get(queue, 1) for queue in queues}
+    return limits
+
+
+class Worker:
+    """Polls the task table and runs tasks in one thread pool per queue.
+
+    Pool threads only run task functions; this thread claims work (one
+    batch ahead, so threads do not wait on a claim) and records outcomes,
+    marking each round of successes DONE with a single UPDATE.
+    """
+
+    def __init__(self, limits, poll_seconds=1.0, worker_id=None):
+        self.limits = limits
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.stop = threading.Event()
+        self.counts = {'done': 0, 'failed': 0}
+
+    def _execute(self, queued):
+        close_old_connections()  # as at the start of a request: drop broken or expired connections
+        return execute(queued)
+
+    def _settle(self, running):
+        done = []
+        for futures in running.values():
+            for future in [future for future in futures if future.done()]:
+                queued = futures.pop(future)
+                error = future.result()
+                if error is None:
+                    done.append(queued)
+                else:
+                    fail(queued, error)
+                    self.counts['failed'] += 1
+        finish(done)
+        self.counts['done'] += len(done)
+
+    def run(self, drain=False):
+        """Work until stopped; with ``drain``, until no task is due or running."""
+        pools = {queue: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f'task-{queue}')
+                 for queue, limit in self.limits.items()}
+        running = {queue: {} for queue in self.limits}  # future -> task
+        next_maintenance = 0
+        try:
+            while not self.stop.is_set():
+                if time.monotonic() >= next_maintenance:
+                    recover_stale()
+                    purge_done()
+                    next_maintenance = time.monotonic() + MAINTENANCE_SECONDS
+                self._settle(running)
+                claimed = 0
+                for queue, limit in self.limits.items():
+                    free = 2 * limit - len(running[queue])
+                    if free < limit:
+                        continue
+                    try:
+                        batch = claim(queue, free, self.worker_id)
+                    except OperationalError as exc:  # e.g. SQLite busy; try again next round
+                        logger.warning("Claiming from %s failed: %s", queue, exc)
+                        batch = []
+                    for queued in batch:
+                        running[queue][pools[queue].submit(self._execute, queued)] = queued
+                    claimed += len(batch)
+                if claimed:
+                    continue
+                in_flight = [future for futures in running.values() for future in futures]
+                if in_flight:
+                    # Nothing new due (or every pool busy): wake when a task finishes
+                    wait(in_flight, timeout=self.poll_seconds, return_when=FIRST_COMPLETED)
+                elif drain:
+                    break
+                else:
+                    self.stop.wait(self.poll_seconds)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+            self._settle(running)
+        return self.counts
@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.core.mail import send_mail
+from .models import BusPassApplication, UserProfile
+from .passes import PASS_FORMATS, rendered_pass_path
+from .photos import delete_photo
+from .reporting import refresh_rollups
+from .seating import ensure_pass_token
+from .taskqueue import enqueue_fanout, task
+
+# Background tasks (run by ``manage.py run_tasks``, see taskqueue.py). Each
+# takes ids rather than objects and re-reads the current state, so a task that
+# runs late or twice still does the right thing.
+
+STATUS_EMAILS = {
+    'ALLOCATED': (
+        'Your bus pass seat is allocated',
+        'Good news! You have seat {seat} on route {route}, boarding at {boarding}.\n'
+        'Download your pass from the My Pass page.',
+    ),
+    'WAITLISTED': (
+        'You are on the waitlist',
+        'Route {route} is currently full, so your application is on the waitlist.\n'
+        'You will get a seat automatically when one frees up.',
+    ),
+    'REJECTED': (
+        'Your bus pass application was rejected',
+        'Your application for route {route} was rejected. '
+        'Contact the transport office if you believe this is an error.',
+    ),
+}
+
+
+@task(queue='email', priority=10)
+def send_status_email(application_id):
+    """Tell the applicant about their application's (current) status."""
+    application = (
+        BusPassApplication.objects.select_related('user', 'route')
+        .filter(pk=application_id).first()
+    )
+    if application is None or not application.user.email or application.status not in STATUS_EMAILS:
+        return
+    subject, body = STATUS_EMAILS[application.status]
+    name = application.user.first_name or application.user.username
+    send_mail(
+        subject,
+        f'Hi {name},\n\n' + body.format(
+            seat=application.seat_number, route=application.route.name, boarding=application.boarding_location,
+        ),
+        settings.DEFAULT_FROM_EMAIL,
+        [application.user.email],
+    )
+
+
+@task(queue='email')
+def send_renewal_reminder(application_id):
+    """Remind the holder of an allocated pass that it ends soon and can be renewed."""
+    application = (
+        BusPassApplication.objects.select_related('user', 'route')
+        .filter(pk=application_id, status='ALLOCATED').first()
+    )
+    if application is None or not application.user.email or application.valid_until is None:
+        return
+    name = application.user.first_name or application.user.username
+    send_mail(
+        'Your bus pass expires soon',
+        f'Hi {name},\n\nYour pass for route {application.route.name} is valid until '
+        f'{application.valid_until:%d %B %Y}.\nRenew it from the My Pass page to keep your seat '
+        f'for the next term.',
+        settings.DEFAULT_FROM_EMAIL,
+        [application.user.email],
+    )
+
+
+@task(queue='render')
+def render_pass_files(application_id):
+    """Pre-render an allocated pass so the first download is a file read."""
+    bus_pass = (
+        BusPassApplication.objects.select_related('user', 'user__userprofile', 'route')
+        .filter(pk=application_id, status='ALLOCATED').first()
+    )
+    if bus_pass is None:
+        return
+    ensure_pass_token(bus_pass)
+    for fmt in PASS_FORMATS:
+        rendered_pass_path(bus_pass, fmt)
+
+
+@task(priority=-5)
+def delete_replaced_photo(name):
+    """Delete a replaced profile photo, unless another profile uses the same picture.
+
+    Files used within ORPHAN_GRACE_SECONDS stay for clean_photos: someone may
+    be saving a profile with the same picture right now.
+    """
+    if not UserProfile.objects.filter(photo=name).exists():
+        delete_photo(name)
+
+
+@task(priority=-10, max_attempts=3)
+def refresh_reports(full=False):
+    refresh_rollups(full=full)
+
+
+def pass_allocated(application_ids):
+    """Queue the follow-up work (email, pass render) for newly allocated passes."""
+    kwargs = [{'application_id': pk} for pk in application_ids]
+    enqueue_fanout(send_status_email, kwargs)
+    enqueue_fanout(render_pass_files, kwargs)
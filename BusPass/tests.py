@@ -1,3 +1,1206 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from . import catalogue, faq, llm
+from .applications import application_fee, submit_application
+from .chat_cache import ResponseCache
+from .counters import reconcile
+from .dbtuning import DEFAULT_PRAGMAS, sqlite_pragmas
+from .forms import UserProfileEditForm
+from .imports import apply_route_import, parse_routes_csv, plan_route_import
+from .models import BoardingLocation, BusPassApplication, BusRoute, DailyRouteStats, FAQEntry, Payment, RouteSeatMap, SupportMessage, Task, UserProfile
+from .pagination import keyset_paginate
+from .passes import check_qrcode, pass_fields, render_pass_image, rendered_pass_path
+from .payments import FakeGateway, PaymentEvent, PaymentProvider, confirm_payment
+from .photos import ORPHAN_GRACE_SECONDS, photo_files, prepare_photo, store_photo, stored_photos
+from .reporting import REVENUE_STATUSES, refresh_rollups
+from .roles import ROLE_SESSION_KEY, _epoch_key
+from .seating import allocate_seat, bulk_allocate, release_seat, waitlist_head, waitlist_position
+from .support_search import rebuild_index, search_messages
+from .taskqueue import Worker, claim, enqueue, enqueue_fanout, recover_stale, task
+from .tasks import delete_replaced_photo
+from .tokens import verify_token, verify_tokens
+from .validity import expire_passes, start_renewal
+from .versioning import VERSION_TIMEOUT
 
-# Create your tests here.
+
+def make_user(username, is_admin=False):
+    user = User.objects.create_user(username, f'{username}@example.com')  # tests log in with force_login
+    UserProfile.objects.create(user=user, is_admin=is_admin, department='BCA')
+    return user
+
+
+def make_application(route, username, status='PAID'):
+    application = BusPassApplication.objects.create(
+        user=make_user(username), route=route, boarding_location='Gate', status=status, paid_fee=route.fee,
+    )
+    reconcile([route])  # keep the route counters in step with rows created directly
+    return application
+
+
+def occupied_seats(route):
+    mask = RouteSeatMap.objects.get(route=route).mask
+    return [seat for seat in range(1, mask.bit_length() + 1) if mask >> (seat - 1) & 1]
+
+
+class BusPassTestCase(TestCase):
+    """Starts each test with empty per-process caches, which outlive the test's transaction."""
+
+    def setUp(self):
+        cache.clear()
+        catalogue._catalogue = None
+        faq._matcher = None
+
+    def assertNoCounterDrift(self):
+        self.assertEqual(reconcile(BusRoute.objects.all(), dry_run=True), [])
+
+
+class AdminApplicationsPaginationTests(TestCase):
+    def setUp(self):
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=50)
+        self.admin = make_user('admin', is_admin=True)
+
+    def make_applications(self, count, start=0):
+        # Pairs share a timestamp, so the id has to break the tie
+        base = timezone.now() - datetime.timedelta(days=1)
+        for n in range(start, start + count):
+            application = make_application(self.route, f'user{n}')
+            BusPassApplication.objects.filter(pk=application.pk).update(
+                application_date=base + datetime.timedelta(minutes=n // 2),
+            )
+        return list(BusPassApplication.objects.order_by('-application_date', '-id').values_list('id', flat=True))
+
+    def page_ids(self, **cursors):
+        page = keyset_paginate(BusPassApplication.objects.all(), 'application_date', 3, **cursors)
+        return [application.pk for application in page], page
+
+    def test_after_cursors_walk_every_row_once(self):
+        expected = self.make_applications(8)
+        seen, page = self.page_ids()
+        self.assertFalse(page.has_previous)
+        while page.has_next:
+            ids, page = self.page_ids(after=page.next_cursor)
+            seen += ids
+        self.assertEqual(seen, expected)
+
+    def test_before_cursor_returns_the_previous_page(self):
+        self.make_applications(8)
+        first, page = self.page_ids()
+        second, page = self.page_ids(after=page.next_cursor)
+        back, page = self.page_ids(before=page.prev_cursor)
+        self.assertEqual(back, first)
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+        self.assertNotEqual(second, first)
+
+    def test_malformed_cursor_starts_from_the_first_page(self):
+        self.make_applications(4)
+        first, _ = self.page_ids()
+        for cursor in ('not-a-cursor', '!!!', 'MjAyNnxhYmM'):
+            self.assertEqual(self.page_ids(after=cursor)[0], first)
+            self.assertEqual(self.page_ids(before=cursor)[0], first)
+
+    def test_listing_query_count_does_not_grow_with_the_page(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin_view_applications')
+        self.client.get(url)  # the first request caches the admin's role in the session
+        self.make_applications(2)
+        # Session, user, one joined page query and the route filter options
+        with mock.patch('BusPass.views.ADMIN_APPLICATIONS_PAGE_SIZE', 20):
+            with self.assertNumQueries(4):
+                self.client.get(url)
+            self.make_applications(18, start=2)
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+        self.assertEqual(len(response.context['page']), 20)
+        self.assertFalse(response.context['page'].has_next)
+
+
+class SeatingTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=2)
+
+    def test_allocation_hands_out_distinct_seats_and_reuses_freed_ones(self):
+        a, b = make_application(self.route, 'a'), make_application(self.route, 'b')
+        self.assertEqual(allocate_seat(a), 'S-001')
+        self.assertEqual(allocate_seat(b), 'S-002')
+        release_seat(a, 'CANCELLED')
+        self.assertEqual(occupied_seats(self.route), [2])
+
+        c = make_application(self.route, 'c')
+        self.assertEqual(allocate_seat(c), 'S-001')
+        self.assertEqual(occupied_seats(self.route), [1, 2])
+        self.assertNoCounterDrift()
+
+    def test_allocating_an_already_processed_application_is_a_no_op(self):
+        a = make_application(self.route, 'a')
+        stale = BusPassApplication.objects.get(pk=a.pk)
+        allocate_seat(a)
+        self.assertIsNone(allocate_seat(stale))
+        self.assertEqual(occupied_seats(self.route), [1])
+        self.assertNoCounterDrift()
+
+    def test_releasing_a_closed_application_changes_nothing(self):
+        a = make_application(self.route, 'a')
+        allocate_seat(a)
+        stale = BusPassApplication.objects.get(pk=a.pk)
+        release_seat(a, 'REJECTED')
+        self.assertIsNone(release_seat(stale, 'CANCELLED'))
+        self.assertEqual(BusPassApplication.objects.get(pk=a.pk).status, 'REJECTED')
+        self.assertEqual(occupied_seats(self.route), [])
+        self.assertNoCounterDrift()
+
+    def test_admin_cannot_reject_twice(self):
+        a = make_application(self.route, 'a')
+        self.client.force_login(make_user('admin', is_admin=True))
+        url = reverse('admin_process_pass', args=[a.pk])
+        self.client.post(url, {'action': 'reject'})
+        self.client.post(url, {'action': 'reject'})
+        self.assertEqual(BusPassApplication.objects.get(pk=a.pk).status, 'REJECTED')
+        self.assertEqual(Task.objects.filter(name__endswith='send_status_email').count(), 1)
+
+
+class BulkAllocationTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=3)
+        base = timezone.now() - datetime.timedelta(days=1)
+        self.queue = []
+        for n, name in enumerate('abcde'):
+            application = make_application(self.route, name)
+            BusPassApplication.objects.filter(pk=application.pk).update(
+                application_date=base + datetime.timedelta(minutes=n),
+            )
+            self.queue.append(application.pk)
+
+    def seats(self):
+        rows = BusPassApplication.objects.filter(pk__in=self.queue).values_list('pk', 'status', 'seat_number')
+        return {pk: (status, seat) for pk, status, seat in rows}
+
+    def test_oldest_applications_get_the_free_seats_in_order(self):
+        held = make_application(self.route, 'held')
+        allocate_seat(held)  # seat 1 is taken before the run
+
+        result = bulk_allocate(self.route, batch_size=1)
+
+        self.assertEqual((result['allocated'], result['waitlisted']), (2, 3))
+        self.assertEqual(result['allocated_ids'], self.queue[:2])
+        seats = self.seats()
+        self.assertEqual([seats[pk] for pk in self.queue], [
+            ('ALLOCATED', 'S-002'), ('ALLOCATED', 'S-003'),
+            ('WAITLISTED', None), ('WAITLISTED', None), ('WAITLISTED', None),
+        ])
+        self.assertEqual(occupied_seats(self.route), [1, 2, 3])
+        self.assertNoCounterDrift()
+
+    def test_full_route_only_moves_newcomers_to_the_waitlist(self):
+        bulk_allocate(self.route)
+        before = self.seats()
+        newcomer = make_application(self.route, 'f')
+
+        result = bulk_allocate(self.route)
+
+        self.assertEqual((result['allocated'], result['waitlisted']), (0, 3))
+        self.assertEqual(self.seats(), before)
+        self.assertEqual(BusPassApplication.objects.get(pk=newcomer.pk).status, 'WAITLISTED')
+        self.assertNoCounterDrift()
+
+
+class WaitlistTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=1)
+
+    def fill(self, names):
+        applications = [make_application(self.route, name) for name in names]
+        for application in applications:
+            allocate_seat(application)
+        return applications
+
+    def test_full_route_waitlists_in_order_and_promotes_the_head(self):
+        a, b, c = self.fill('abc')
+        self.assertEqual((b.status, c.status), ('WAITLISTED', 'WAITLISTED'))
+        self.assertEqual((waitlist_position(b), waitlist_position(c)), (1, 2))
+
+        promoted = release_seat(a, 'CANCELLED')
+
+        self.assertEqual(promoted.pk, b.pk)
+        b.refresh_from_db()
+        self.assertEqual((b.status, b.seat_number), ('ALLOCATED', 'S-001'))
+        self.assertTrue(b.pass_token)
+        self.assertEqual(waitlist_position(c), 1)
+        self.assertEqual(occupied_seats(self.route), [1])
+        self.assertNoCounterDrift()
+
+    def test_releasing_a_waitlisted_application_promotes_nobody(self):
+        a, b = self.fill('ab')
+        self.assertIsNone(release_seat(b, 'CANCELLED'))
+        self.assertEqual(BusPassApplication.objects.get(pk=a.pk).seat_number, 'S-001')
+        self.assertNoCounterDrift()
+
+    def test_releasing_a_stale_copy_uses_the_current_row(self):
+        a, b = self.fill('ab')
+        stale_b = BusPassApplication.objects.get(pk=b.pk)
+        self.assertEqual(stale_b.status, 'WAITLISTED')
+
+        release_seat(a, 'REJECTED')  # promotes b into seat 1
+        release_seat(stale_b, 'CANCELLED')
+
+        b.refresh_from_db()
+        self.assertEqual((b.status, b.seat_number), ('CANCELLED', None))
+        self.assertEqual(occupied_seats(self.route), [])
+        self.assertNoCounterDrift()
+
+    def test_waitlist_head_cancelled_during_promotion_is_skipped(self):
+        a, b, c = self.fill('abc')
+        # b is cancelled by its holder while the release is picking the head
+        stale_b = BusPassApplication.objects.get(pk=b.pk)
+        release_seat(b, 'CANCELLED')
+        heads = iter([stale_b])
+
+        with mock.patch('BusPass.seating.waitlist_head',
+                        side_effect=lambda route_id: next(heads, None) or waitlist_head(route_id)):
+            promoted = release_seat(a, 'CANCELLED')
+
+        self.assertEqual(promoted.pk, c.pk)
+        self.assertEqual(BusPassApplication.objects.get(pk=b.pk).status, 'CANCELLED')
+        self.assertEqual(BusPassApplication.objects.get(pk=c.pk).seat_number, 'S-001')
+        self.assertEqual(occupied_seats(self.route), [1])
+        self.assertNoCounterDrift()
+
+    def test_promotion_goes_ahead_of_a_later_bulk_run(self):
+        a, b = self.fill('ab')
+        release_seat(a, 'CANCELLED')
+        newcomer = make_application(self.route, 'c')
+        self.assertEqual(bulk_allocate(self.route)['allocated'], 0)
+        self.assertEqual(BusPassApplication.objects.get(pk=b.pk).status, 'ALLOCATED')
+        self.assertEqual(BusPassApplication.objects.get(pk=newcomer.pk).status, 'WAITLISTED')
+        self.assertNoCounterDrift()
+
+
+class RoleCacheTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('a')
+        self.client.force_login(self.user)
+        self.url = reverse('admin_view_applications')
+
+    def profile_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, [q['sql'] for q in queries if 'FROM "BusPass_userprofile"' in q['sql']]
+
+    def test_cached_role_needs_no_profile_query(self):
+        response, queries = self.profile_queries()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.client.session[ROLE_SESSION_KEY]['role'], 'USER')
+
+        response, queries = self.profile_queries()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(queries, [])
+
+    def test_role_change_bumps_the_epoch_and_reaches_the_next_request(self):
+        self.client.get(self.url)
+        epoch = cache.get(_epoch_key(self.user.pk))
+
+        profile = UserProfile.objects.get(user=self.user)
+        profile.is_admin = True
+        profile.save()
+        self.assertIsNone(cache.get(_epoch_key(self.user.pk)))
+
+        response, queries = self.profile_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertNotEqual(cache.get(_epoch_key(self.user.pk)), epoch)
+        self.assertEqual(self.client.session[ROLE_SESSION_KEY]['role'], 'ADMIN')
+
+
+class RouteImportTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=40)
+        for position, name in enumerate(['Gate', 'Market', 'Depot'], start=1):
+            BoardingLocation.objects.create(route=self.route, name=name, position=position)
+
+    def plan(self, text, prune=False):
+        rows, errors = parse_routes_csv(text)
+        self.assertEqual(errors, [])
+        return plan_route_import(rows, prune=prune)
+
+    def stops(self, route_name):
+        return list(BoardingLocation.objects.filter(route__name=route_name)
+                    .order_by('position').values_list('name', flat=True))
+
+    def test_parse_errors_name_the_line(self):
+        self.assertEqual(parse_routes_csv('name,stop\nNorth,Gate\n')[1], ['Missing column(s): route'])
+        _, errors = parse_routes_csv(
+            'route,fee,max_seats,stop\n'
+            'North,12.345,40,Gate\n'
+            ',,,Market\n'
+            'East,900,0,Gate\n'
+            'West,900,30,Gate\n'
+            'West,,31,Market\n'
+        )
+        self.assertEqual(errors, [
+            "Line 2: invalid fee '12.345'",
+            'Line 3: route name is required',
+            "Line 4: invalid max_seats '0'",
+            'Line 6: conflicting max_seats for West',
+        ])
+
+    def test_new_route_without_a_fee_is_refused(self):
+        rows, _ = parse_routes_csv('route,stop\nEast,Gate\n')
+        self.assertEqual(plan_route_import(rows)[1], ['New route East needs a fee'])
+
+    def test_preview_lists_the_diff_and_writes_nothing(self):
+        plan, errors = self.plan(
+            'route,fee,max_seats,description,stop\n'
+            'North,1200,,,Market\n'
+            'North,,,,Gate\n'
+            'North,,,,Library\n'
+            'East,900,30,Ring road,Gate\n'
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(plan.summary(), [
+            '+ route East (fee 900, 30 seats)',
+            '~ route North: fee 1000.00 -> 1200',
+            '+ stop North #3: Library',
+            '+ stop East #1: Gate',
+            '~ stop North: Market #2 -> #1',
+            '~ stop North: Gate #1 -> #2',
+        ])
+        self.assertFalse(BusRoute.objects.filter(name='East').exists())
+        self.assertEqual(self.stops('North'), ['Gate', 'Market', 'Depot'])
+
+        self.client.force_login(make_user('admin', is_admin=True))
+        response = self.client.post(reverse('admin_import_routes'), {
+            'csv_text': 'route,fee,stop\nEast,900,Gate\n',
+        })
+        self.assertEqual(response.context['plan'].summary(), ['+ route East (fee 900, 50 seats)', '+ stop East #1: Gate'])
+        self.assertFalse(BusRoute.objects.filter(name='East').exists())
+
+    def test_unlisted_stops_are_removed_only_with_prune(self):
+        text = 'route,stop\nNorth,Gate\nNorth,Depot\n'
+        self.assertEqual(self.plan(text)[0].stops_to_delete, [])
+        plan, _ = self.plan(text, prune=True)
+        self.assertEqual(plan.summary(), ['~ stop North: Depot #3 -> #2', '- stop North: Market'])
+
+        self.assertEqual(apply_route_import(plan)['stops_deleted'], 1)
+        self.assertEqual(self.stops('North'), ['Gate', 'Depot'])
+
+    def test_apply_writes_the_plan_and_refreshes_the_catalogue(self):
+        self.assertEqual([route.name for route in catalogue.route_catalogue().routes], ['North'])
+        plan, _ = self.plan('route,fee,max_seats,stop\nNorth,1200,,Gate\nEast,900,30,Gate\nEast,,,Mall\n')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = apply_route_import(plan)
+
+        self.assertEqual(counts, {'routes_created': 1, 'routes_updated': 1, 'stops_created': 2,
+                                  'stops_updated': 0, 'stops_deleted': 0})
+        self.assertEqual(BusRoute.objects.get(name='North').fee, Decimal('1200'))
+        self.assertEqual(self.stops('East'), ['Gate', 'Mall'])
+        current = catalogue.route_catalogue()
+        east = BusRoute.objects.get(name='East')
+        self.assertEqual([route.name for route in current.routes], ['North', 'East'])
+        self.assertEqual(current.stops_for(east.pk), ['Gate', 'Mall'])
+
+
+class PassRenderingTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        override = override_settings(BUSPASS_PASS_CACHE_DIR=cache_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        self.bus_pass = make_application(route, 'a')
+        allocate_seat(self.bus_pass)
+
+    def test_unchanged_pass_is_served_from_the_render_cache(self):
+        path, fingerprint = rendered_pass_path(self.bus_pass, 'png')
+        with mock.patch('BusPass.passes.render_pass') as render:
+            self.assertEqual(rendered_pass_path(self.bus_pass, 'png'), (path, fingerprint))
+        render.assert_not_called()
+
+        self.bus_pass.seat_number = 'S-002'
+        new_path, new_fingerprint = rendered_pass_path(self.bus_pass, 'png')
+        self.assertNotEqual(new_fingerprint, fingerprint)
+        self.assertTrue(new_path.exists())
+        self.assertFalse(path.exists())  # the old render is dropped
+
+    def test_download_answers_a_matching_etag_with_304(self):
+        self.client.force_login(self.bus_pass.user)
+        url = reverse('download_buspass', args=[self.bus_pass.pk])
+        response = self.client.get(url, {'format': 'png'})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        response = self.client.get(url, {'format': 'png'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_qrcode_is_reported(self):
+        with mock.patch('BusPass.passes.qrcode', None), self.assertLogs('BusPass.passes', 'ERROR'):
+            render_pass_image(self.bus_pass)
+        with mock.patch('BusPass.passes.qrcode', None):
+            self.assertEqual([w.id for w in check_qrcode(None)], ['BusPass.W001'])
+
+
+@override_settings(BUSPASS_SCANNER_KEYS=['scanner-key'])
+class PassVerificationTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        self.bus_pass = make_application(self.route, 'a')
+        allocate_seat(self.bus_pass)
+
+    def verify(self, token):
+        response = self.client.post(reverse('verify_pass'), {'token': token}, HTTP_X_SCANNER_KEY='scanner-key')
+        return response.json()
+
+    def release(self, bus_pass, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            release_seat(bus_pass, status)
+
+    def test_verified_pass_is_served_from_the_cache(self):
+        with self.assertNumQueries(1):
+            result = self.verify(self.bus_pass.pass_token)
+        self.assertTrue(result['valid'])
+        self.assertEqual(result['pass_id'], self.bus_pass.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.verify(self.bus_pass.pass_token)['valid'])
+
+    def test_lost_mark_falls_back_to_the_database(self):
+        self.verify(self.bus_pass.pass_token)
+        cache.clear()  # a restart or an eviction
+        with self.assertNumQueries(1):
+            self.assertTrue(verify_token(self.bus_pass.pass_token)['valid'])
+
+    def test_forged_token_is_rejected_without_a_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(verify_token(self.bus_pass.pass_token[:-2] + 'xx')['reason'], 'bad_signature')
+
+    def test_released_pass_stops_verifying(self):
+        token = self.bus_pass.pass_token
+        self.assertTrue(self.verify(token)['valid'])
+        self.release(self.bus_pass, 'CANCELLED')
+        self.assertEqual(self.verify(token)['reason'], 'revoked')
+
+    def test_only_suspect_tokens_of_a_batch_are_looked_up(self):
+        other = make_application(self.route, 'b')
+        allocate_seat(other)
+        cancelled = other.pass_token
+        self.release(other, 'REJECTED')
+        scans = [(self.bus_pass.pass_token, None), (cancelled, None), ('junk', None)]
+        with self.assertNumQueries(1):
+            results = verify_tokens(scans)
+        self.assertEqual([r['valid'] for r in results], [True, False, False])
+        self.assertEqual(results[1]['reason'], 'revoked')
+
+        with self.assertNumQueries(1):  # the revoked pass is still suspect; the valid one is marked
+            self.assertEqual([r['valid'] for r in verify_tokens(scans)], [True, False, False])
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_tokens(scans[:1])[0]['valid'])
+
+
+class ActiveApplicationConstraintTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        self.application = make_application(self.route, 'a')
+
+    def apply_again(self, status='PENDING'):
+        return BusPassApplication.objects.create(
+            user=self.application.user, route=self.route, boarding_location='Gate', status=status,
+        )
+
+    def test_second_active_application_is_rejected(self):
+        for status in ('PENDING', 'PAID', 'WAITLISTED', 'ALLOCATED'):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                self.apply_again(status)
+
+    def test_closed_applications_do_not_count(self):
+        self.apply_again('CANCELLED')
+        self.application.status = 'REJECTED'
+        self.application.save()
+        self.assertEqual(self.apply_again().status, 'PENDING')
+
+
+class DuplicateApplicationsMigrationTests(TransactionTestCase):
+    # Migration 0013 cancels duplicate active applications before adding the constraint
+    serialized_rollback = True
+    before = [('BusPass', '0012_buspassapplication_pass_token')]
+    after = [('BusPass', '0013_application_indexes_and_constraints')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.latest = MigrationExecutor(connection).loader.graph.leaf_nodes('BusPass')
+        self.apps = self.migrate(self.before)
+
+    def tearDown(self):
+        self.migrate(self.latest)
+
+    def test_most_advanced_newest_application_survives(self):
+        User = self.apps.get_model('auth', 'User')
+        BusRoute = self.apps.get_model('BusPass', 'BusRoute')
+        Application = self.apps.get_model('BusPass', 'BusPassApplication')
+        RouteSeatMap = self.apps.get_model('BusPass', 'RouteSeatMap')
+        route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        RouteSeatMap.objects.create(route=route, occupied='1')
+        base = timezone.now() - datetime.timedelta(days=10)
+
+        def add(username, status, age, seat=None):
+            user, _ = User.objects.get_or_create(username=username)
+            application = Application.objects.create(
+                user=user, route=route, boarding_location='Gate', status=status, seat_number=seat,
+            )
+            Application.objects.filter(pk=application.pk).update(application_date=base - datetime.timedelta(days=age))
+            return application.pk
+
+        allocated = add('a', 'ALLOCATED', age=3, seat='S-001')
+        newer_pending = add('a', 'PENDING', age=1)
+        older_paid = add('b', 'PAID', age=3)
+        newer_paid = add('b', 'PAID', age=1)
+        single = add('c', 'PAID', age=2)
+        closed = add('c', 'CANCELLED', age=4)
+
+        apps = self.migrate(self.after)
+
+        statuses = dict(apps.get_model('BusPass', 'BusPassApplication').objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {
+            allocated: 'ALLOCATED', newer_pending: 'CANCELLED',
+            older_paid: 'CANCELLED', newer_paid: 'PAID',
+            single: 'PAID', closed: 'CANCELLED',
+        })
+        # The route's seat map is rebuilt from its ALLOCATED rows on next use
+        self.assertFalse(apps.get_model('BusPass', 'RouteSeatMap').objects.exists())
+
+
+class AsgiStreamingTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        for name in 'abc':
+            make_application(route, name)
+        self.admin = make_user('admin', is_admin=True)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.admin)
+        response = await client.get(reverse('admin_export', args=['applications', 'csv']))
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 4)  # header + 3 applications
+
+    def test_export_stays_a_sync_stream_under_wsgi(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_export', args=['applications', 'jsonl']))
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+
+class SupportChatTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(make_user('a'))
+
+    def tearDown(self):
+        for _, _, breaker in llm.BACKENDS:
+            breaker.record_success()
+
+    @override_settings(BUSPASS_RATE_LIMITS={'support_chat': (1, 1)})
+    def test_empty_messages_do_not_use_up_the_rate_limit(self):
+        url = reverse('ai_support_chat')
+        for _ in range(3):
+            self.assertEqual(self.client.post(url, {'message': '  '}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'message': 'How do I cancel my pass?'}).status_code, 200)
+        self.assertEqual(self.client.post(url, {'message': 'How do I cancel my pass?'}).status_code, 429)
+
+    @mock.patch.object(llm, 'RETRY_BACKOFF', 0)
+    @mock.patch.object(llm, 'OLLAMA_URL', 'http://127.0.0.1:9')  # nothing listens: connection refused
+    def test_wsgi_request_closes_its_llm_client(self):
+        with self.assertLogs('BusPass.llm', 'WARNING'):
+            response = self.client.post(reverse('ai_support_chat'), {'message': 'zqxw vbnm plok'})
+        self.assertTrue(response.json()['ok'])
+        self.assertEqual(len(llm._clients), 0)
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Answers /api/chat with the next of the server's ``replies``: a status code, or a list of chunks."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        reply = self.server.replies.pop(0) if self.server.replies else 'hang'
+        if reply == 'hang':
+            time.sleep(2)
+            return
+        if isinstance(reply, int):
+            self.send_response(reply)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        try:
+            for chunk in reply:
+                line = json.dumps({'message': {'role': 'assistant', 'content': chunk}, 'done': False})
+                self.wfile.write(line.encode() + b'\n')
+                self.wfile.flush()
+                time.sleep(self.server.chunk_delay)
+        except BrokenPipeError:
+            pass  # the client gave up on the reply
+
+    def log_message(self, *args):
+        pass
+
+
+@mock.patch.object(llm, 'RETRY_BACKOFF', 0)
+@mock.patch.object(llm, 'READ_TIMEOUT', 0.5)
+class LlmRetryTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+        self.server.daemon_threads = True
+        self.server.requests = 0
+        self.server.replies = []
+        self.server.chunk_delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        patcher = mock.patch.object(llm, 'OLLAMA_URL', f'http://127.0.0.1:{self.server.server_port}')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for _, _, breaker in llm.BACKENDS:
+            breaker.record_success()
+
+    @async_to_sync
+    async def reply(self):
+        try:
+            return ''.join([chunk async for chunk in llm.stream_llm_reply('hello')])
+        finally:
+            await llm.aclose_client()
+
+    def test_unavailable_backend_is_retried(self):
+        self.server.replies = [503, ['Hello', ' there']]
+        self.assertEqual(self.reply(), 'Hello there')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_read_timeout_is_not_retried(self):
+        with self.assertLogs('BusPass.llm', 'WARNING'):
+            self.assertEqual(self.reply(), '')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.replies = [400]
+        with self.assertLogs('BusPass.llm', 'WARNING'):
+            self.assertEqual(self.reply(), '')
+        self.assertEqual(self.server.requests, 1)
+
+    @mock.patch.object(llm, 'REPLY_DEADLINE', 0.5)
+    def test_whole_reply_is_bounded_by_the_deadline(self):
+        self.server.replies = [['word '] * 20]
+        self.server.chunk_delay = 0.1
+        started = time.monotonic()
+        with self.assertLogs('BusPass.llm', 'WARNING'):
+            reply = self.reply()
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertTrue(0 < len(reply) < len('word ') * 20)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    QUESTION = 'How do I cancel my bus pass?'
+
+    def test_least_recently_used_entry_is_dropped_when_full(self):
+        replies = ResponseCache(max_entries=2)
+        replies.set('route timings', 'r1')
+        replies.set('seat number', 'r2')
+        self.assertEqual(replies.get('Route timings!'), 'r1')  # now the most recently used
+        replies.set('office hours', 'r3')
+        self.assertEqual(len(replies), 2)
+        self.assertIsNone(replies.get('seat number'))
+        self.assertEqual((replies.get('route timings'), replies.get('office hours')), ('r1', 'r3'))
+
+    def test_entries_expire_after_the_ttl(self):
+        replies = ResponseCache(ttl=60)
+        replies.set(self.QUESTION, 'reply')
+        replies._entries['how do i cancel my bus pass'].created -= 61
+        self.assertIsNone(replies.get(self.QUESTION))
+        self.assertIsNone(replies.get('cancel bus pass'))  # nor found as a similar question
+        self.assertEqual(len(replies), 0)
+
+    def test_similar_questions_share_a_reply_above_the_threshold(self):
+        replies = ResponseCache(similarity=0.75)
+        replies.set(self.QUESTION, 'reply')  # content words: cancel, bus, pass
+        self.assertEqual(replies.get('how do I cancel my bus pass'), 'reply')
+        self.assertEqual(replies.get('cancel bus passes please'), 'reply')   # 3/3
+        self.assertEqual(replies.get('can I cancel my bus pass today'), 'reply')  # 3/4 = 0.75
+        self.assertIsNone(replies.get('cancel bus pass refund today'))  # 3/5
+        self.assertIsNone(replies.get('bus timings'))
+        self.assertEqual(replies.stats()['similar_hits'], 2)
+        self.assertEqual(replies.stats()['misses'], 2)
+
+
+class FAQTests(BusPassTestCase):
+    QUESTION = 'how do I apply for a bus pass'
+
+    def recheck(self):
+        faq._matcher.checked_at -= faq.FAQ_RECHECK_SECONDS
+        return faq.get_matcher()
+
+    def test_seeded_apply_answer_describes_the_payment_flow(self):
+        answer = faq.get_matcher().match(self.QUESTION).answer
+        self.assertIn('payment page', answer)
+        self.assertNotIn('simulated', answer)
+
+    def test_saved_entries_are_matched_on_the_next_check(self):
+        faq.get_matcher()
+        entry = FAQEntry.objects.create(question='I lost my bus pass card', keywords='lost card, replacement',
+                                        answer='Ask the transport office for a replacement.')
+        self.assertEqual(self.recheck().match('I lost my card, can I get a replacement?').entry_id, entry.pk)
+
+        entry.is_active = False
+        entry.save()
+        match = self.recheck().match('I lost my card, can I get a replacement?')
+        self.assertNotEqual(getattr(match, 'entry_id', None), entry.pk)
+
+    def test_change_without_invalidation_is_picked_up_once_the_version_expires(self):
+        faq.get_matcher()
+        # Another process's invalidation only reached its own local-memory cache
+        FAQEntry.objects.filter(question='How do I apply for a bus pass?').update(answer='Ask the office.')
+        self.assertNotEqual(self.recheck().match(self.QUESTION).answer, 'Ask the office.')
+
+        faq._matcher.checked_at -= faq.FAQ_RECHECK_SECONDS
+        with mock.patch('time.time', return_value=time.time() + VERSION_TIMEOUT + 1):
+            self.assertEqual(faq.get_matcher().match(self.QUESTION).answer, 'Ask the office.')
+
+
+class SupportSearchTests(TestCase):
+    def search(self, query):
+        return list(search_messages(SupportMessage.objects.all(), query))
+
+    def test_index_follows_creates_edits_and_deletes(self):
+        message = SupportMessage.objects.create(user=make_user('a'), message='My pass was not renewed')
+        self.assertEqual(self.search('pass renew'), [message])  # stemmed, last word as a prefix
+
+        SupportMessage.objects.filter(pk=message.pk).update(message='Seat changed on the morning bus')
+        self.assertEqual(self.search('renewed'), [])
+        self.assertEqual(self.search('morning seat'), [message])
+
+        message.delete()
+        self.assertEqual(self.search('morning seat'), [])
+
+    def test_rebuild_keeps_search_results(self):
+        message = SupportMessage.objects.create(user=make_user('a'), message='Refund for a cancelled pass')
+        self.assertTrue(rebuild_index())
+        self.assertEqual(self.search('refund'), [message])
+
+
+class RouteCatalogueTests(BusPassTestCase):
+    def route_names(self):
+        return [route.name for route in catalogue.route_catalogue().routes]
+
+    def test_saved_routes_show_up_at_once(self):
+        self.assertEqual(self.route_names(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            BusRoute.objects.create(name='East', fee=900, max_seats=40)
+        self.assertEqual(self.route_names(), ['East'])
+
+    def test_change_from_another_process_shows_up_once_the_version_expires(self):
+        self.assertEqual(self.route_names(), [])
+        # Written elsewhere: that process's invalidation only reached its own local-memory cache
+        BusRoute.objects.bulk_create([BusRoute(name='East', fee=900, max_seats=40)])
+        catalogue._catalogue.checked_at -= catalogue.CATALOGUE_RECHECK_SECONDS
+        self.assertEqual(self.route_names(), [])
+
+        catalogue._catalogue.checked_at -= catalogue.CATALOGUE_RECHECK_SECONDS
+        with mock.patch('time.time', return_value=time.time() + VERSION_TIMEOUT + 1):
+            self.assertEqual(self.route_names(), ['East'])
+
+
+class ReportingTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        east = BusRoute.objects.create(name='East', fee=900, max_seats=40)
+        west = BusRoute.objects.create(name='West', fee=700, max_seats=40)
+        today = timezone.now()
+        for i, (route, status, days_ago) in enumerate([
+            (east, 'PAID', 0), (east, 'ALLOCATED', 0), (east, 'CANCELLED', 3),
+            (west, 'REJECTED', 3), (west, 'ALLOCATED', 90), (east, 'WAITLISTED', 90),
+        ]):
+            application = make_application(route, f'u{i}', status)
+            BusPassApplication.objects.filter(pk=application.pk).update(
+                application_date=today - datetime.timedelta(days=days_ago))
+        UserProfile.objects.filter(user__username__in=['u1', 'u3']).update(department='BBA')
+
+    def rollups(self):
+        return sorted(DailyRouteStats.objects.values_list(
+            'day', 'route_id', 'department', 'applications', 'revenue', 'allocated', 'cancelled', 'rejected'))
+
+    def raw(self):
+        """The rollup rows, counted straight from the applications."""
+        rows = {}
+        for application in BusPassApplication.objects.select_related('user__userprofile'):
+            key = (timezone.localtime(application.application_date).date(), application.route_id,
+                   application.user.userprofile.department)
+            counts = rows.setdefault(key, [0, Decimal('0'), 0, 0, 0])
+            counts[0] += 1
+            if application.status in REVENUE_STATUSES:
+                counts[1] += application.paid_fee
+            counts[2] += application.status == 'ALLOCATED'
+            counts[3] += application.status == 'CANCELLED'
+            counts[4] += application.status == 'REJECTED'
+        return sorted(key + tuple(counts) for key, counts in rows.items())
+
+    def test_rollups_match_the_applications(self):
+        refresh_rollups()
+        self.assertEqual(len(self.rollups()), 6)
+        self.assertEqual(self.rollups(), self.raw())
+
+    def test_refresh_from_the_start_day_again_is_idempotent(self):
+        refresh_rollups()
+        before = self.rollups()
+        start, _ = refresh_rollups(recheck_days=5)
+        self.assertEqual(start, timezone.localdate() - datetime.timedelta(days=5))
+        self.assertEqual(self.rollups(), before)
+
+    def test_refresh_picks_up_recent_status_changes_only(self):
+        refresh_rollups()
+        BusPassApplication.objects.filter(status__in=['PAID', 'ALLOCATED']).update(status='CANCELLED')
+        refresh_rollups(recheck_days=5)
+        after = self.rollups()
+        old_day = timezone.localdate() - datetime.timedelta(days=90)
+        self.assertEqual([row for row in after if row[0] != old_day], [row for row in self.raw() if row[0] != old_day])
+        self.assertNotEqual(after, self.raw())  # the 90-day-old allocation is past the recheck window
+
+        refresh_rollups(full=True)
+        self.assertEqual(self.rollups(), self.raw())
+
+
+class SqliteTuningTests(TestCase):
+    def test_wal_only_when_enabled(self):
+        self.assertNotIn('journal_mode', sqlite_pragmas())
+        with override_settings(BUSPASS_SQLITE_WAL=True):
+            self.assertEqual(sqlite_pragmas()['journal_mode'], 'WAL')
+
+    @override_settings(BUSPASS_SQLITE_WAL=True, BUSPASS_SQLITE_PRAGMAS={'synchronous': 'FULL'})
+    def test_setting_overrides_the_defaults(self):
+        self.assertEqual(sqlite_pragmas()['synchronous'], 'FULL')
+
+    def test_connections_wait_for_the_write_lock(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], DEFAULT_PRAGMAS['busy_timeout'])
+
+
+class ApplyTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        BoardingLocation.objects.create(route=self.route, name='Gate', position=1)
+        reconcile([self.route])  # the route's counters row, as on a route that has had applications
+        self.user = make_user('a')
+        self.client.force_login(self.user)
+        self.url = reverse('apply_for_pass', args=[self.route.pk])
+        self.client.get(self.url)  # warm the route catalogue
+
+    def apply(self, key):
+        return self.client.post(self.url, {'boarding_location': 'Gate', 'idempotency_key': key})
+
+    def test_apply_query_count(self):
+        # Session and user, then one transaction (a savepoint in tests) of four
+        # writes: insert the application and payment, bump the route counters,
+        # set the profile's boarding location. No reads besides the login.
+        with self.assertNumQueries(8):
+            response = self.apply('k1')
+        application = BusPassApplication.objects.get(user=self.user)
+        self.assertEqual((application.status, application.paid_fee), ('PENDING', 850))
+        self.assertRedirects(response, reverse('fake_gateway_checkout', args=[application.payment.reference]),
+                             fetch_redirect_response=False)
+
+    def test_replayed_submit_returns_the_same_checkout(self):
+        first, second = self.apply('k1'), self.apply('k1')
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(BusPassApplication.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_second_application_for_the_route_is_refused(self):
+        self.apply('k1')
+        response = self.apply('k2')
+        self.assertTemplateUsed(response, 'BusPass/application_error.html')
+        self.assertEqual(BusPassApplication.objects.filter(user=self.user).count(), 1)
+        self.assertNoCounterDrift()
+
+    def test_fee_discount_and_unusable_fees(self):
+        self.assertEqual(application_fee(self.route, 2), 700)
+        self.assertEqual(application_fee(self.route, 9), 0)
+        self.assertEqual(application_fee(BusRoute(fee=None), None), 0)
+
+
+class PaymentWebhookTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=5)
+        self.application, _ = submit_application(make_user('a'), self.route, 'Gate', catalogue.route_catalogue())
+        self.gateway = FakeGateway()
+        self.url = reverse('payment_webhook', args=['fake'])
+
+    def deliver(self, succeeded=True, body=None):
+        payment_body, headers = self.gateway.callback(self.application.payment, succeeded)
+        signature = self.gateway.sign(body) if body is not None else headers[FakeGateway.SIGNATURE_HEADER]
+        response = self.client.post(self.url, body or payment_body, content_type='application/json',
+                                    HTTP_X_FAKE_SIGNATURE=signature)
+        return response.status_code, response.json().get('result')
+
+    def status(self):
+        return BusPassApplication.objects.get(pk=self.application.pk).status
+
+    def test_payment_is_applied_once(self):
+        self.assertEqual(self.deliver(), (200, 'paid'))
+        self.assertEqual(self.deliver(), (200, 'duplicate'))
+        self.assertEqual(self.deliver(succeeded=False), (200, 'duplicate'))
+        self.assertEqual(self.status(), 'PAID')
+        self.assertNoCounterDrift()
+
+    def test_failed_payment_cancels_the_application(self):
+        self.assertEqual(self.deliver(succeeded=False), (200, 'failed'))
+        self.assertEqual(self.status(), 'CANCELLED')
+        self.assertNoCounterDrift()
+
+    def test_forged_or_mismatched_callbacks_change_nothing(self):
+        body, _ = self.gateway.callback(self.application.payment)
+        response = self.client.post(self.url, body, content_type='application/json', HTTP_X_FAKE_SIGNATURE='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        wrong_amount = json.dumps({**json.loads(body), 'amount': '1.00'}).encode()
+        with self.assertLogs('BusPass.payments', 'WARNING'):
+            self.assertEqual(self.deliver(body=wrong_amount), (200, 'unknown'))
+        self.assertEqual(self.status(), 'PENDING')
+
+    def test_payment_for_a_cancelled_application_is_flagged_for_refund(self):
+        self.client.force_login(self.application.user)
+        self.client.post(reverse('cancel_pass', args=[self.application.pk]))
+        with self.assertLogs('BusPass.payments', 'WARNING') as logs:
+            self.assertEqual(self.deliver(), (200, 'paid'))
+        self.assertIn('refund', logs.output[0])
+        self.assertEqual(self.status(), 'CANCELLED')
+
+    def test_provider_must_implement_the_gateway_calls(self):
+        class CheckoutOnly(PaymentProvider):
+            def checkout_url(self, payment):
+                return '/pay'
+
+        with self.assertRaises(TypeError):
+            CheckoutOnly()
+
+
+TASK_RUNS = []
+
+
+@task(name='tests.record')
+def record_run(n):
+    TASK_RUNS.append(n)
+
+
+@task(name='tests.broken', max_attempts=2)
+def broken_task():
+    raise RuntimeError('broken')
+
+
+class TaskQueueTests(TransactionTestCase):
+    # Worker threads use their own database connections, so the rows they
+    # read and write must be committed
+    serialized_rollback = True
+
+    def setUp(self):
+        TASK_RUNS.clear()
+
+    def run_worker(self):
+        return Worker({'default': 2}, poll_seconds=0.01).run(drain=True)
+
+    def test_fanout_queues_few_rows_and_runs_every_task(self):
+        enqueue_fanout(record_run, [{'n': n} for n in range(50)])
+        self.assertEqual(Task.objects.count(), 1)
+        self.run_worker()
+        self.assertEqual(sorted(TASK_RUNS), list(range(50)))
+        self.assertFalse(Task.objects.exclude(status='DONE').exists())
+
+    def test_each_task_is_claimed_by_one_worker(self):
+        for n in range(3):
+            record_run.enqueue(n=n)
+        first = claim('default', 10, 'w1')
+        self.assertEqual(len(first), 3)
+        self.assertEqual(claim('default', 10, 'w2'), [])
+
+    def test_claims_run_higher_priority_first(self):
+        low = record_run.enqueue(n=1)
+        urgent = enqueue(record_run, {'n': 2}, priority=50)
+        self.assertEqual([queued.pk for queued in claim('default', 10, 'w1')], [urgent.pk, low.pk])
+
+    def test_failing_task_is_retried_then_parked(self):
+        broken_task.enqueue()
+        with self.assertLogs('BusPass.taskqueue', 'WARNING'):
+            self.assertEqual(self.run_worker()['failed'], 1)
+        queued = Task.objects.get()
+        self.assertEqual((queued.status, queued.attempts), ('QUEUED', 1))
+        self.assertGreater(queued.run_at, timezone.now())
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('BusPass.taskqueue', 'ERROR'):
+            self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'DEAD')
+        self.assertIn('RuntimeError: broken', queued.last_error)
+
+    def test_task_of_a_lost_worker_is_put_back(self):
+        record_run.enqueue(n=1)
+        claim('default', 1, 'gone')
+        Task.objects.update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(recover_stale(), 1)
+        self.run_worker()
+        self.assertEqual(TASK_RUNS, [1])
+
+
+class ExpiryTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = BusRoute.objects.create(name='North', fee=1000, max_seats=2)
+        self.bus_pass = make_application(self.route, 'a')
+        allocate_seat(self.bus_pass)
+        self.day_after = self.bus_pass.valid_until + datetime.timedelta(days=1)
+
+    def test_pass_shows_its_end_date(self):
+        self.assertEqual(pass_fields(self.bus_pass)['valid_until'], self.bus_pass.valid_until.strftime('%d %b %Y'))
+
+    def test_expired_pass_frees_its_seat_for_the_queue(self):
+        self.assertEqual(expire_passes(self.bus_pass.valid_until)['expired'], 0)
+        result = expire_passes(self.day_after)
+        self.assertEqual((result['expired'], result['seats_freed']), (1, 1))
+        self.bus_pass.refresh_from_db()
+        self.assertEqual((self.bus_pass.status, self.bus_pass.seat_number, self.bus_pass.pass_token),
+                         ('EXPIRED', None, ''))
+        self.assertEqual(occupied_seats(self.route), [])
+        self.assertNoCounterDrift()
+
+    def test_paid_renewal_takes_over_the_seat(self):
+        renewal, created = start_renewal(self.bus_pass, catalogue.route_catalogue())
+        self.assertTrue(created)
+        payment = renewal.payment
+        confirm_payment(PaymentEvent(payment.reference, True, payment.amount, 'p1'))
+        self.assertEqual(BusPassApplication.objects.get(pk=renewal.pk).status, 'SCHEDULED')
+
+        result = expire_passes(self.day_after)
+        self.assertEqual((result['expired'], result['renewed'], result['seats_freed']), (1, 1, 0))
+        renewal.refresh_from_db()
+        self.assertEqual((renewal.status, renewal.seat_number), ('ALLOCATED', 'S-001'))
+        self.assertEqual(renewal.valid_until, self.day_after + datetime.timedelta(days=365))
+        self.assertEqual(occupied_seats(self.route), [1])
+        self.assertNoCounterDrift()
+
+    def test_lost_seat_map_updates_are_logged(self):
+        with mock.patch('BusPass.validity.swap_seat_map', return_value=False), \
+                self.assertLogs('BusPass.validity', 'WARNING'):
+            expire_passes(self.day_after)
+
+
+def jpeg_upload(color, size=(1600, 1200)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, 'JPEG')
+    buf.seek(0)
+    return buf
+
+
+class PhotoTests(BusPassTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def age(self, name, seconds=ORPHAN_GRACE_SECONDS + 60):
+        stamp = time.time() - seconds
+        for stored in photo_files(name):
+            os.utime(default_storage.path(stored), (stamp, stamp))
+
+    def stored(self, name):
+        return [default_storage.exists(stored) for stored in photo_files(name)]
+
+    def test_upload_is_reencoded_with_square_thumbnails(self):
+        name = store_photo(prepare_photo(jpeg_upload('red')))
+        self.assertEqual(self.stored(name), [True, True, True])
+        with default_storage.open(name) as fh:
+            self.assertEqual(max(Image.open(fh).size), 800)
+        with default_storage.open(photo_files(name)[1]) as fh:
+            self.assertEqual(Image.open(fh).size, (200, 200))
+
+    def test_same_picture_reuses_the_stored_files_and_refreshes_them(self):
+        name = store_photo(prepare_photo(jpeg_upload('red')))
+        self.age(name)
+        prepared = prepare_photo(jpeg_upload('red'))
+        self.assertEqual(prepared.files, {})
+        self.assertEqual(store_photo(prepared), name)
+        self.assertGreater(default_storage.get_modified_time(name),
+                           timezone.now() - datetime.timedelta(seconds=60))
+
+    def test_files_deleted_after_preparing_are_stored_again(self):
+        name = store_photo(prepare_photo(jpeg_upload('red')))
+        prepared = prepare_photo(jpeg_upload('red'))
+        for stored in photo_files(name):
+            default_storage.delete(stored)
+        store_photo(prepared)
+        self.assertEqual(self.stored(name), [True, True, True])
+
+    def test_replaced_photo_is_deleted_only_when_unused_and_old(self):
+        name = store_photo(prepare_photo(jpeg_upload('red')))
+        delete_replaced_photo(name)
+        self.assertEqual(self.stored(name), [True, True, True])  # just stored: an upload may be using it
+
+        self.age(name)
+        profile = UserProfile.objects.filter(user=make_user('a'))
+        profile.update(photo=name)
+        delete_replaced_photo(name)
+        self.assertEqual(self.stored(name), [True, True, True])
+
+        profile.update(photo='')
+        delete_replaced_photo(name)
+        self.assertEqual(self.stored(name), [False, False, False])
+
+    def edit_form(self, profile):
+        data = {'email': 'a@example.com', 'first_name': 'A', 'last_name': 'B', 'department': 'BCA'}
+        upload = SimpleUploadedFile('me.jpg', jpeg_upload('blue').getvalue(), content_type='image/jpeg')
+        form = UserProfileEditForm(data, {'photo': upload}, instance=profile)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def test_profile_photo_is_stored_only_when_the_form_commits(self):
+        profile = make_user('a').userprofile
+        self.edit_form(profile).save(commit=False)
+        self.assertEqual(list(stored_photos()), [])
+
+        profile = self.edit_form(profile).save()
+        self.assertEqual(sorted(stored_photos()), sorted(photo_files(profile.photo.name)))
@@ -0,0 +1,124 @@
+import base64
+import datetime
+import hashlib
+import hmac
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .models import BusPassApplication
+
+# Signed pass tokens printed in the QR code of every allocated pass.
+#
+#     BM1.<pass id>.<route id>.<seat>.<valid until>.<signature>
+#
+# Numbers are hex; "valid until" is a day count since the Unix epoch and the
+# signature is a truncated HMAC-SHA256 over everything before it. Forged,
+# malformed, expired and wrong-route tokens are turned away with only the
+# secret key and the clock. A token that passes those checks must also still
+# be the one stored on an ALLOCATED pass. Once the database has confirmed
+# that, the pass is marked verified in the cache for VERIFIED_TIMEOUT, and
+# later scans of the same token need no query. Only tokens without a current
+# mark are suspect and looked up (in one query per batch). Releasing a seat
+# drops the mark, so with a shared cache backend a cancelled or rejected pass
+# stops verifying at once; with the per-process local-memory cache other
+# workers stop accepting it once their mark expires. A lost or evicted mark
+# only costs a lookup, never a wrongly accepted pass.
+
+TOKEN_VERSION = 'BM1'
+SIGNATURE_BYTES = 12
+LOOKUP_BATCH_SIZE = 500
+VERIFIED_TIMEOUT = 300  # seconds; bounds how long another process can accept a released pass
+_EPOCH = datetime.date(1970, 1, 1)
+_signing_key = None
+
+
+def _key():
+    global _signing_key
+    if _signing_key is None:
+        secret = getattr(settings, 'BUSPASS_TOKEN_SECRET', None) or settings.SECRET_KEY
+        _signing_key = hashlib.sha256(f'busmate.pass-token:{secret}'.encode()).digest()
+    return _signing_key
+
+
+def _sign(body):
+    mac = hmac.new(_key(), body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(mac).decode().rstrip('=')
+
+
+def default_valid_until():
+    days = getattr(settings, 'BUSPASS_PASS_VALIDITY_DAYS', 365)
+    return timezone.localdate() + datetime.timedelta(days=days)
+
+
+def issue_token(pass_id, route_id, seat, valid_until):
+    """Token for a pass; ``seat`` is the 1-based seat number (0 if none)."""
+    day = (valid_until - _EPOCH).days
+    body = f'{TOKEN_VERSION}.{pass_id:x}.{route_id:x}.{seat:x}.{day:x}'
+    return f'{body}.{_sign(body)}'
+
+
+def _check(token, route_id, on_date):
+    parts = token.split('.')
+    if len(parts) != 6 or parts[0] != TOKEN_VERSION:
+        return {'valid': False, 'reason': 'malformed'}
+    body, signature = '.'.join(parts[:5]), parts[5]
+    if not hmac.compare_digest(_sign(body).encode(), signature.encode()):
+        return {'valid': False, 'reason': 'bad_signature'}
+    try:
+        pass_id, token_route, seat, day = (int(p, 16) for p in parts[1:5])
+    except ValueError:
+        return {'valid': False, 'reason': 'malformed'}
+
+    valid_until = _EPOCH + datetime.timedelta(days=day)
+    details = {
+        'pass_id': pass_id,
+        'route_id': token_route,
+        'seat': seat or None,
+        'valid_until': valid_until.isoformat(),
+    }
+    if valid_until < (on_date or timezone.localdate()):
+        return {'valid': False, 'reason': 'expired', **details}
+    if route_id is not None and token_route != route_id:
+        return {'valid': False, 'reason': 'wrong_route', **details}
+    return {'valid': True, **details}
+
+
+def _verified_key(pass_id):
+    return f'busmate:verified-pass:{pass_id}'
+
+
+def forget_token(pass_id):
+    """Drop the verified mark of ``pass_id``, so its next scan is checked against the database."""
+    cache.delete(_verified_key(pass_id))
+
+
+def verify_tokens(scans, route_id=None):
+    """Check (token, on_date) pairs; ``on_date`` None means today. Returns a result dict per scan.
+
+    Each result has ``valid`` and either the pass details or a ``reason``.
+    """
+    tokens = [(token or '').strip() for token, _ in scans]
+    results = [_check(token, route_id, on_date) for token, (_, on_date) in zip(tokens, scans)]
+    claimed = {result['pass_id']: token for token, result in zip(tokens, results) if result['valid']}
+    marks = cache.get_many([_verified_key(pass_id) for pass_id in claimed])
+    current = {
+        pass_id: token for pass_id, token in claimed.items() if marks.get(_verified_key(pass_id)) == token
+    }
+    suspect = sorted(set(claimed) - set(current))
+    confirmed = {}
+    for i in range(0, len(suspect), LOOKUP_BATCH_SIZE):
+        confirmed.update(BusPassApplication.objects.filter(
+            pk__in=suspect[i:i + LOOKUP_BATCH_SIZE], status='ALLOCATED',
+        ).exclude(pass_token='').values_list('id', 'pass_token'))
+    if confirmed:
+        cache.set_many({_verified_key(pass_id): token for pass_id, token in confirmed.items()}, VERIFIED_TIMEOUT)
+        current.update(confirmed)
+    for token, result in zip(tokens, results):
+        if result['valid'] and current.get(result['pass_id']) != token:
+            result.update(valid=False, reason='revoked')
+    return results
+
+
+def verify_token(token, route_id=None, on_date=None):
+    """Check one token. Returns a dict with ``valid`` and either the pass details or a ``reason``."""
+    return verify_tokens([(token, on_date)], route_id)[0]
@@ -17,16 +17,30 @@ urlpatterns = [
     path('routes/', views.view_routes, name='view_routes'),
     path('apply/<int:route_id>/', views.apply_for_pass, name='apply_for_pass'),
     path('payment_success/', views.payment_success, name='payment_success'),
+    path('payment/checkout/<str:reference>/', views.fake_gateway_checkout, name='fake_gateway_checkout'),
+    path('payment/webhook/<str:provider>/', views.payment_webhook, name='payment_webhook'),
     path('my_pass/', views.my_pass, name='my_pass'),
     path('download_pass/<int:pass_id>/', views.download_buspass, name='download_buspass'),
     path('cancel_pass/<int:pass_id>/', views.cancel_pass, name='cancel_pass'),
+    path('renew_pass/<int:pass_id>/', views.renew_pass, name='renew_pass'),
+    path('verify/', views.verify_pass, name='verify_pass'),
+    path('verify/batch/', views.verify_pass_batch, name='verify_pass_batch'),
     path('support/submit/', views.submit_support_message, name='submit_support_message'),
     path('support/ai/', views.ai_support_chat, name='ai_support_chat'),
     
     # Admin URLs
+    path('admin/reports/', views.admin_reports, name='admin_reports'),
     path('admin/routes/add/', views.admin_add_route, name='admin_add_route'),
+    path('admin/routes/import/', views.admin_import_routes, name='admin_import_routes'),
     path('admin/routes/edit/<int:route_id>/', views.admin_edit_route, name='admin_edit_route'),
     path('admin/routes/view/', views.admin_view_routes, name='admin_view_routes'),
+    path('admin/routes/allocate/', views.admin_bulk_allocate, name='admin_bulk_allocate_all'),
+    path('admin/routes/<int:route_id>/allocate/', views.admin_bulk_allocate, name='admin_bulk_allocate'),
     path('admin/passes/', views.admin_view_applications, name='admin_view_applications'),
     path('admin/process_pass/<int:pass_id>/', views.admin_process_pass, name='admin_process_pass'),
+    path('admin/export/<slug:dataset>.<slug:fmt>', views.admin_export, name='admin_export'),
+    path('admin/support/', views.admin_support_inbox, name='admin_support_inbox'),
+    path('admin/support/user/<int:user_id>/', views.admin_support_inbox, name='admin_support_thread'),
+    path('admin/support/latency/', views.admin_support_latency, name='admin_support_latency'),
+    path('admin/support/questions/', views.admin_support_questions, name='admin_support_questions'),
 ]
\ No newline at end of file
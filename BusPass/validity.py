@@ -0,0 +1,165 @@
+import datetime
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.utils import timezone
+from .applications import submit_application
+from .counters import record_transition
+from .models import ACTIVE_APPLICATION_STATUSES, BusPassApplication
+from .seating import MAX_CLAIM_ATTEMPTS, new_term, parse_seat, seat_map_for_update, swap_seat_map
+from .tasks import pass_allocated, send_renewal_reminder
+from .taskqueue import enqueue_fanout
+
+logger = logging.getLogger(__name__)
+
+# Pass validity and renewal. A pass is valid from the day its seat is
+# allocated for BUSPASS_PASS_VALIDITY_DAYS (its QR token expires with it).
+#
+# In the last BUSPASS_RENEWAL_WINDOW_DAYS of a pass the holder gets a
+# reminder and can renew: the pass is cloned into a new application
+# (renewed_from -> the pass) that goes through payment like any other. Once
+# paid it is SCHEDULED, and when the old pass expires the renewal takes over
+# its seat for a new term, so renewing never means queueing for a seat again.
+# An expired pass can still be renewed; the renewal then joins the queue.
+#
+# ``manage.py expire_passes`` runs nightly. Everything is set-based: a
+# handful of UPDATEs and grouped counts per run, plus one seat-map write per
+# route with freed seats, whatever the number of passes.
+
+
+def renewal_window_days():
+    return getattr(settings, 'BUSPASS_RENEWAL_WINDOW_DAYS', 30)
+
+
+CLOSED_RENEWAL_STATUSES = ('CANCELLED', 'REJECTED')
+
+
+def open_renewal(application):
+    """The renewal of ``application`` that is still going, or None (a failed one does not count)."""
+    renewal = getattr(application, 'renewal', None)
+    if renewal is None or renewal.status in CLOSED_RENEWAL_STATUSES:
+        return None
+    return renewal
+
+
+def can_renew(application, today=None):
+    """Whether the holder may renew ``application`` now."""
+    today = today or timezone.localdate()
+    if open_renewal(application) is not None:
+        return False
+    if application.status == 'EXPIRED':
+        # Renewals are exempt from the one-active-per-route constraint
+        return not BusPassApplication.objects.filter(
+            user_id=application.user_id, route_id=application.route_id, status__in=ACTIVE_APPLICATION_STATUSES,
+        ).exists()
+    return (
+        application.status == 'ALLOCATED'
+        and application.valid_until is not None
+        and application.valid_until - today <= datetime.timedelta(days=renewal_window_days())
+    )
+
+
+def start_renewal(application, catalogue):
+    """Clone ``application`` into a renewal awaiting payment. Returns (renewal, created)."""
+    route = catalogue.route(application.route_id)
+    # A pass has one renewal at a time: detach a failed attempt so the user can try again
+    BusPassApplication.objects.filter(renewed_from=application, status__in=CLOSED_RENEWAL_STATUSES).update(
+        renewed_from=None,
+    )
+    return submit_application(
+        application.user, route, application.boarding_location, catalogue, renewed_from=application,
+    )
+
+
+def _counts_by_route(queryset):
+    return {row['route_id']: row['n'] for row in queryset.values('route_id').annotate(n=Count('id')).order_by()}
+
+
+def expire_passes(today=None):
+    """Expire passes past their end date and hand their seats to scheduled renewals.
+
+    Returns a dict of counts: ``expired``, ``renewed`` (seat handed over),
+    ``requeued`` (renewals whose pass ended early, moved to the PAID queue)
+    and ``seats_freed``.
+    """
+    today = today or timezone.localdate()
+    valid_from, valid_until = new_term(today)
+    passes = BusPassApplication.objects
+
+    with transaction.atomic():
+        # Renewals of passes that were cancelled or rejected meanwhile: no seat
+        # to take over, so they queue like a fresh paid application
+        orphaned = passes.filter(status='SCHEDULED').filter(
+            Q(renewed_from__isnull=True) | ~Q(renewed_from__status='ALLOCATED')
+        )
+        requeued = _counts_by_route(orphaned)
+        if requeued:
+            orphaned.update(status='PAID')
+        for route_id, n in requeued.items():
+            record_transition(route_id, None, 'PAID', n)
+
+        # Scheduled renewals of passes ending today take over the seat
+        handover = passes.filter(
+            status='SCHEDULED', renewed_from__status='ALLOCATED', renewed_from__valid_until__lt=today,
+        )
+        renewed = _counts_by_route(handover)
+        renewed_ids = list(handover.values_list('id', flat=True)) if renewed else []
+        if renewed:
+            handover.update(
+                status='ALLOCATED',
+                seat_number=Subquery(passes.filter(pk=OuterRef('renewed_from_id')).values('seat_number')[:1]),
+                pass_token='',  # issued on first download (ensure_pass_token)
+                valid_from=valid_from,
+                valid_until=valid_until,
+            )
+        for route_id, n in renewed.items():
+            record_transition(route_id, None, 'ALLOCATED', n)
+
+        # Expire; seats not taken over by a renewal are freed
+        expiring = passes.filter(status='ALLOCATED', valid_until__lt=today)
+        freed = {}
+        for route_id, label in expiring.exclude(renewal__status='ALLOCATED').values_list('route_id', 'seat_number'):
+            seat = parse_seat(label)
+            if seat:
+                freed[route_id] = freed.get(route_id, 0) | 1 << (seat - 1)
+        expired = _counts_by_route(expiring)
+        if expired:
+            expiring.update(status='EXPIRED', seat_number=None, pass_token='')
+        for route_id, n in expired.items():
+            record_transition(route_id, 'ALLOCATED', None, n)
+
+        for route_id, seats in freed.items():
+            for _ in range(MAX_CLAIM_ATTEMPTS):
+                seat_map = seat_map_for_update(route_id)
+                if swap_seat_map(seat_map, seat_map.mask & ~seats):
+                    break
+            else:
+                logger.warning("Gave up freeing %d expired seat(s) on route %s after %d attempts",
+                               bin(seats).count('1'), route_id, MAX_CLAIM_ATTEMPTS)
+
+    if renewed_ids:
+        pass_allocated(renewed_ids)
+    return {
+        'expired': sum(expired.values()),
+        'renewed': len(renewed_ids),
+        'requeued': sum(requeued.values()),
+        'seats_freed': sum(bin(seats).count('1') for seats in freed.values()),
+    }
+
+
+def queue_renewal_reminders(today=None):
+    """Queue a reminder for each pass entering its renewal window. Returns the count."""
+    today = today or timezone.localdate()
+    window_end = today + datetime.timedelta(days=renewal_window_days())
+    marker = timezone.now()
+    with transaction.atomic():
+        reminded = BusPassApplication.objects.filter(
+            status='ALLOCATED', valid_until__gte=today, valid_until__lte=window_end,
+            reminded_at__isnull=True, renewal__isnull=True,
+        ).update(reminded_at=marker)
+        if not reminded:
+            return 0
+        ids = BusPassApplication.objects.filter(status='ALLOCATED', reminded_at=marker).values_list('id', flat=True)
+        enqueue_fanout(send_renewal_reminder, [{'application_id': pk} for pk in ids])
+    return reminded
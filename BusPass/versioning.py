@@ -0,0 +1,28 @@
+import uuid
+from django.core.cache import cache
+
+# Version tokens for data that each process keeps compiled in memory (the
+# route catalogue, the FAQ matcher). The token is a random value in the cache:
+# a write replaces it, and a reader whose copy was built under an older token
+# rebuilds. With a shared cache backend a change reaches every worker at once.
+# With the per-process local-memory cache (the default) a write made in
+# another process (a management command, another worker) only replaced that
+# process's token; this one sees the change once its own token expires, so
+# VERSION_TIMEOUT bounds how stale a copy can get.
+
+VERSION_TIMEOUT = 300  # seconds
+
+
+def current_version(key):
+    """The token under ``key``, starting a new one if it is missing or expired."""
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, VERSION_TIMEOUT)  # add: racing readers settle on one token
+        version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    """Replace the token under ``key`` so every copy built under the old one is rebuilt."""
+    cache.set(key, uuid.uuid4().hex, VERSION_TIMEOUT)
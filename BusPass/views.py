@@ -3,31 +3,64 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import login, update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponse, Http404, JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse, FileResponse, HttpResponseNotAllowed
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
-import os
-import requests
+import hmac
+import json
 import logging
-from decimal import Decimal
-from .models import BusRoute, BusPassApplication, UserProfile, SupportMessage, BoardingLocation
-from .forms import BusRouteForm, BusPassApplicationForm, UserRegistrationForm, UserProfileEditForm
+from .models import BusRoute, BusPassApplication, UserProfile, SupportMessage, BoardingLocation, RouteCounters, Payment, ACTIVE_APPLICATION_STATUSES
+from .forms import BusRouteForm, BusPassApplicationForm, UserRegistrationForm, UserProfileEditForm, RouteImportForm
+from .exports import EXPORTS, EXPORT_FORMATS, aiter_export, stream_export
+from .imports import split_stop_names, parse_routes_csv, plan_route_import, apply_route_import
+from .pagination import keyset_paginate
+from .passes import PASS_FORMATS, rendered_pass_path
+from .payments import FakeGateway, checkout_url_for, confirm_payment, get_provider
+from .ratelimit import take_token
+from .reporting import REPORT_PERIODS, usage_report
+from .roles import ADMIN, USER, load_role
+from .applications import submit_application
+from .catalogue import invalidate_catalogue, route_catalogue
+from .chat_cache import response_cache
+from .counters import seats_left
+from .llm import aclose_client, latency_report
+from .support_chat import reply_chunks
+from .support_search import search_messages
+from .seating import allocate_seat, release_seat, bulk_allocate, waitlist_position, ensure_pass_token
+from .tasks import pass_allocated, refresh_reports, send_status_email
+from .tokens import verify_token, verify_tokens
+from .validity import CLOSED_RENEWAL_STATUSES, can_renew, open_renewal, start_renewal
 
 logger = logging.getLogger(__name__)
 
+ADMIN_APPLICATIONS_PAGE_SIZE = 50
+SUPPORT_INBOX_PAGE_SIZE = 50
+DUPLICATE_APPLICATION_MESSAGE = 'You already have an active or pending application for this route.'
+
 # --- Helper Functions for User Type Check ---
+# The role normally comes from UserRoleMiddleware (session-cached); without
+# the middleware it falls back to reading the profile.
+def user_role(user):
+    if not user.is_authenticated:
+        return None
+    role = getattr(user, 'busmate_role', None)
+    return role or load_role(user)
+
 def is_admin(user):
-    try:
-        return user.is_authenticated and user.userprofile.is_admin
-    except UserProfile.DoesNotExist:
-        return False
+    return user_role(user) == ADMIN
 
 def is_normal_user(user):
-    try:
-        return user.is_authenticated and not user.userprofile.is_admin
-    except UserProfile.DoesNotExist:
-        return user.is_authenticated # Treat users without profile as normal users
+    return user_role(user) == USER
 
 # --- Initial Page & Dashboard Views ---
 
@@ -79,78 +112,129 @@ def user_dashboard(request):
 
 @login_required
 def view_routes(request):
-    routes = BusRoute.objects.all()
+    # Routes come from the catalogue cache; availability is one read of the
+    # per-route counters rather than a count per route.
+    counters = RouteCounters.objects.in_bulk(field_name='route_id')
+    routes = [
+        (route, seats_left(route, counters.get(route.id)), counters.get(route.id))
+        for route in route_catalogue().routes
+    ]
     return render(request, 'BusPass/view_routes.html', {'routes': routes})
 
 @login_required
 def apply_for_pass(request, route_id):
-    route = get_object_or_404(BusRoute, id=route_id)
-    
-    # Check if a pending/active pass already exists
-    existing_pass = BusPassApplication.objects.filter(
-        user=request.user, 
-        route=route, 
-        status__in=['PENDING', 'PAID', 'ALLOCATED']
-    ).exists()
-    
-    if existing_pass:
-        # Prevent re-application
-        return render(request, 'BusPass/application_error.html', 
-                      {'message': 'You already have an active or pending application for this route.'})
+    catalogue = route_catalogue()
+    route = catalogue.route(route_id)
+    if route is None:
+        raise Http404()
     
     if request.method == 'POST':
         form = BusPassApplicationForm(request.POST, route=route)
         if form.is_valid():
-            application = form.save(commit=False)
-            application.user = request.user
-            application.route = route
-            application.status = 'PENDING' # Application starts as PENDING
-            # Compute discounted fee based on boarding location position
-            bl_name = application.boarding_location
-            discount = Decimal('0')
-            try:
-                bl = BoardingLocation.objects.get(route=route, name=bl_name)
-                # reduction is 150 per option number (1-based): 1->150, 2->300, ...
-                discount = Decimal('150') * Decimal(bl.position)
-            except BoardingLocation.DoesNotExist:
-                pass
-            # Ensure non-negative
-            try:
-                base_fee = Decimal(route.fee)
-            except Exception:
-                base_fee = Decimal('0')
-            application.paid_fee = max(base_fee - discount, Decimal('0'))
-            application.save()
-            
-            # --- Payment Simulation ---
-            # In a real system, this redirects to a payment gateway.
-            # Here, we'll simulate success and move to the 'PAID' status.
-            application.status = 'PAID' 
-            application.save()
-
-            # Update user's preferred boarding location
-            try:
-                profile = request.user.userprofile
-                profile.preferred_boarding_location = application.boarding_location
-                profile.save()
-            except UserProfile.DoesNotExist:
-                pass
-            
-            return redirect('payment_success')
+            # Duplicates (including a double-submitted form) are settled by
+            # the database constraints inside submit_application
+            application, created = submit_application(
+                request.user, route, form.cleaned_data['boarding_location'], catalogue,
+                idempotency_key=form.cleaned_data['idempotency_key'],
+            )
+            if application is None:
+                return render(request, 'BusPass/application_error.html',
+                              {'message': DUPLICATE_APPLICATION_MESSAGE})
+            # Off to the payment provider; its webhook confirms the payment
+            return redirect(checkout_url_for(application) or 'payment_success')
     else:
+        # Check if a pending/active pass already exists (answered from the
+        # partial unique index)
+        existing_pass = BusPassApplication.objects.filter(
+            user=request.user, 
+            route=route, 
+            status__in=ACTIVE_APPLICATION_STATUSES
+        ).exists()
+        if existing_pass:
+            # Prevent re-application
+            return render(request, 'BusPass/application_error.html', 
+                          {'message': DUPLICATE_APPLICATION_MESSAGE})
         form = BusPassApplicationForm(route=route)
     
     return render(request, 'BusPass/apply_for_pass.html', {'form': form, 'route': route})
 
 def payment_success(request):
-    """A page confirming simulated payment success."""
+    """Where the user lands after checkout; the payment is confirmed by webhook."""
     return render(request, 'BusPass/payment_success.html')
 
+@login_required
+def fake_gateway_checkout(request, reference):
+    """Checkout page of the local fake gateway (BUSPASS_PAYMENT_PROVIDER = 'fake').
+
+    Paying or declining sends the gateway's signed webhook for the payment.
+    """
+    gateway = get_provider()
+    if not isinstance(gateway, FakeGateway):
+        raise Http404()
+    payment = get_object_or_404(
+        Payment.objects.select_related('application__route'),
+        reference=reference, application__user=request.user,
+    )
+    if request.method == 'POST':
+        if payment.status == 'PENDING':
+            body, headers = gateway.callback(payment, succeeded=request.POST.get('outcome') != 'decline')
+            confirm_payment(gateway.parse_callback(body, headers[gateway.SIGNATURE_HEADER]))
+        return redirect('payment_success')
+    return render(request, 'BusPass/fake_gateway_checkout.html', {'payment': payment})
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request, provider):
+    """Payment confirmation callback from the configured provider. Safe to deliver repeatedly."""
+    gateway = get_provider()
+    if gateway is None or gateway.name != provider:
+        raise Http404()
+    event = gateway.parse_webhook(request)
+    if event is None:
+        return JsonResponse({'ok': False, 'error': 'Invalid signature or payload'}, status=400)
+    return JsonResponse({'ok': True, 'result': confirm_payment(event)})
+
 @login_required
 def my_pass(request):
-    """View the user's latest bus pass and its status."""
-    latest_pass = BusPassApplication.objects.filter(user=request.user).order_by('-application_date').first()
-    return render(request, 'BusPass/my_pass.html', {'bus_pass': latest_pass})
+    """View the user's latest bus pass and its status (and its renewal, if any)."""
+    # A renewal waiting to take over is shown alongside the pass it renews,
+    # and a failed one leaves the renewed pass on show so it can be retried
+    latest_pass = (
+        BusPassApplication.objects.filter(user=request.user)
+        .exclude(renewed_from__status='ALLOCATED')
+        .exclude(renewed_from__isnull=False, status__in=CLOSED_RENEWAL_STATUSES)
+        .order_by('-application_date').first()
+    )
+    position = renewal = renewal_checkout = None
+    renewable = False
+    if latest_pass is not None and latest_pass.status == 'WAITLISTED':
+        position = waitlist_position(latest_pass)
+    if latest_pass is not None and latest_pass.status in ('ALLOCATED', 'EXPIRED'):
+        renewal = open_renewal(latest_pass)
+        renewal_checkout = checkout_url_for(renewal) if renewal is not None else None
+        renewable = can_renew(latest_pass)
+    return render(request, 'BusPass/my_pass.html', {
+        'bus_pass': latest_pass,
+        'waitlist_position': position,
+        'renewal': renewal,
+        'renewal_checkout': renewal_checkout,
+        'can_renew': renewable,
+    })
+
+
+@require_POST
+@login_required
+def renew_pass(request, pass_id):
+    """Renew one of the user's passes for a new term; continues at the payment provider."""
+    bus_pass = get_object_or_404(BusPassApplication, id=pass_id, user=request.user)
+    if not can_renew(bus_pass):
+        messages.error(request, 'This pass cannot be renewed at the moment.')
+        return redirect('my_pass')
+    renewal, created = start_renewal(bus_pass, route_catalogue())
+    if renewal is None:
+        messages.error(request, DUPLICATE_APPLICATION_MESSAGE)
+        return redirect('my_pass')
+    return redirect(checkout_url_for(renewal) or 'my_pass')
 
 
 @login_required
@@ -199,17 +283,20 @@ def change_password(request):
 
 @login_required
 def cancel_pass(request, pass_id):
-    """Allow a user to cancel their own bus pass when not yet allocated."""
+    """Allow a user to cancel their own bus pass; a freed seat goes to the route's waitlist."""
     bus_pass = get_object_or_404(BusPassApplication, id=pass_id, user=request.user)
 
     if request.method != 'POST':
         raise Http404()
 
-    if bus_pass.status in ['PENDING', 'PAID']:
-        bus_pass.status = 'CANCELLED'
-        bus_pass.seat_number = None
-        bus_pass.save()
-        messages.success(request, 'Your bus pass application has been cancelled.')
+    if bus_pass.status in ACTIVE_APPLICATION_STATUSES:
+        promoted = release_seat(bus_pass, 'CANCELLED')
+        if promoted is not None:
+            pass_allocated([promoted.id])
+        if bus_pass.status == 'CANCELLED':
+            messages.success(request, 'Your bus pass application has been cancelled.')
+        else:
+            messages.error(request, 'This pass cannot be cancelled at its current status.')
     else:
         messages.error(request, 'This pass cannot be cancelled at its current status.')
 
@@ -223,143 +310,169 @@ def submit_support_message(request):
     msg = (request.POST.get('message') or '').strip()
     if not msg:
         return JsonResponse({'ok': False, 'error': 'Empty message'}, status=400)
+    retry_after = take_token('support_message', request.user.id)
+    if retry_after:
+        return _rate_limited(retry_after)
     SupportMessage.objects.create(user=request.user, message=msg)
     return JsonResponse({'ok': True})
 
-@require_POST
-@login_required
-def ai_support_chat(request):
-    """Simple AI chat endpoint.
-    - If HUGGINGFACE_API_KEY is set, calls a small instruct model on HF Inference API.
-    - Otherwise, falls back to keyword-based FAQ responses.
-    Returns JSON: { ok: True, reply: str }
+def _rate_limited(retry_after):
+    response = JsonResponse(
+        {'ok': False, 'error': f'Too many messages. Please try again in {retry_after} seconds.'}, status=429
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def _chat_user_and_limit(request, message):
+    """(user or None, seconds to wait or 0) for the chat view, in one thread hop.
+
+    Empty messages are rejected without taking a token.
     """
+    user = request.user
+    if not user.is_authenticated:
+        return None, 0
+    if not message:
+        return user, 0
+    return user, take_token('support_chat', user.id)
+
+async def ai_support_chat(request):
+    """AI support chat endpoint (async; run the project under ASGI).
+
+    Answers from the FAQ when it matches well, otherwise from the reply cache
+    or the LLM backends (local Ollama, then Hugging Face if HUGGINGFACE_API_KEY
+    is set), falling back to the closest FAQ answer. Rate limited per user.
+    Returns JSON { ok: True, reply: str }, or with stream=1 a text/event-stream
+    of {"delta": str} events ending with a "done" event.
+    """
+    # Django 4.2's login_required/require_POST only wrap sync views, so check by hand
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
     user_msg = (request.POST.get('message') or '').strip()
+    user, retry_after = await sync_to_async(_chat_user_and_limit)(request, user_msg)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
     if not user_msg:
         return JsonResponse({'ok': False, 'error': 'Empty message'}, status=400)
+    if retry_after:
+        return _rate_limited(retry_after)
+
+    chunks = reply_chunks(user_msg)
+    if not isinstance(request, ASGIRequest):
+        chunks = _closing_llm_client(chunks)
+    if request.POST.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(_sse_events(chunks), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+        return response
+
+    reply = ''.join([chunk async for chunk in chunks]).strip()
+    return JsonResponse({'ok': True, 'reply': reply})
 
-    # 1) Try local Ollama first, if running (chat API)
-    ollama_model = os.environ.get('OLLAMA_MODEL', 'llama3:latest')
+async def _closing_llm_client(chunks):
+    # Under WSGI each async call runs on its own short-lived event loop, so the
+    # loop's LLM client cannot be reused: close it rather than leak its sockets
     try:
-        system_msg = (
-            "You are a friendly support assistant for a college bus pass system called Busmate. "
-            "Answer concisely. If asked about status or steps, list clear steps."
-        )
-        body = {
-            "model": ollama_model,
-            "messages": [
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": user_msg},
-            ],
-            "stream": False,
-            "options": {"temperature": 0.2, "num_predict": 180},
-        }
-        resp = requests.post(
-            "http://127.0.0.1:11434/api/chat",
-            json=body,
-            timeout=20,
-        )
-        if resp.ok:
-            data = resp.json()
-            # Expect { message: { role, content }, ... }
-            msg = (data.get('message') or {})
-            reply = (msg.get('content') or '').strip()
-            if reply:
-                return JsonResponse({"ok": True, "reply": reply})
-        else:
-            logger.warning("Ollama (chat) responded non-OK: %s %s", resp.status_code, resp.text[:300])
-    except Exception as e:
-        logger.exception("Ollama (chat) request failed: %s", e)
-
-    # 2) Try Hugging Face Inference API if key is available
-    hf_key = os.environ.get('HUGGINGFACE_API_KEY')
-    if hf_key:
-        try:
-            # Keep prompt short and safe for a lightweight response
-            prompt = (
-                "You are a friendly support assistant for a college bus pass system called Busmate. "
-                "Answer concisely. If asked about status or steps, list clear steps.\n\n"
-                f"User: {user_msg}\nAssistant:"
-            )
-            headers = {"Authorization": f"Bearer {hf_key}", "Content-Type": "application/json"}
-            # Choose a small instruct model for faster responses
-            model = "microsoft/Phi-3-mini-4k-instruct"
-            resp = requests.post(
-                f"https://api-inference.huggingface.co/models/{model}",
-                headers=headers,
-                json={"inputs": prompt, "parameters": {"max_new_tokens": 180, "temperature": 0.2}},
-                timeout=20,
-            )
-            if resp.ok:
-                data = resp.json()
-                # API may return a list of dicts with 'generated_text'
-                if isinstance(data, list) and data and 'generated_text' in data[0]:
-                    full = data[0]['generated_text']
-                    reply = full.split("Assistant:")[-1].strip() or full.strip()
-                else:
-                    # Some models return a dict with generated_text or text
-                    reply = (data.get('generated_text') or data.get('text') or 'Sorry, I could not generate a reply.').strip()
-                return JsonResponse({'ok': True, 'reply': reply})
-            else:
-                logger.warning("HF responded non-OK: %s %s", resp.status_code, resp.text[:300])
-        except Exception as e:
-            logger.exception("HF request failed: %s", e)
-
-    # Fallback: simple keyword-based FAQ
-    lower = user_msg.lower()
-    if any(k in lower for k in ["route", "routes", "bus"]):
-        reply = (
-            "To view routes, go to 'View Routes' from your dashboard. "
-            "Click a route to apply, fill the form, and submit."
-        )
-    elif any(k in lower for k in ["apply", "application", "pass"]):
-        reply = (
-            "Apply by choosing a route, completing the form, and submitting. "
-            "Your status will be PENDING, then PAID (simulated), and an admin may ALLOCATE a seat."
-        )
-    elif any(k in lower for k in ["status", "allocated", "seat"]):
-        reply = (
-            "Check 'My Bus Pass' to see the latest status. If ALLOCATED, you'll see your seat number and can download the pass."
-        )
-    elif any(k in lower for k in ["cancel", "refund"]):
-        reply = (
-            "You can cancel a PENDING or PAID application from 'My Bus Pass' using the Cancel button."
-        )
-    elif any(k in lower for k in ["login", "register", "account"]):
-        reply = (
-            "Use Login from the navbar or register at /buspass/register/. If login fails, make sure cookies are enabled and retry."
-        )
-    else:
-        reply = (
-            "I can help with routes, applying for a pass, status, allocation, and cancellations. "
-            "Please share more details about your question."
-        )
-    return JsonResponse({'ok': True, 'reply': reply})
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await aclose_client()
+
+async def _sse_events(chunks):
+    async for chunk in chunks:
+        yield f"data: {json.dumps({'delta': chunk})}\n\n"
+    yield "event: done\ndata: {}\n\n"
 
-# In a real scenario, you'd use a PDF library (like ReportLab or WeasyPrint)
 @login_required
 def download_buspass(request, pass_id):
-    bus_pass = get_object_or_404(BusPassApplication, id=pass_id, user=request.user)
+    """Serve the rendered pass (PDF by default, ?format=png) from the render cache."""
+    bus_pass = get_object_or_404(
+        BusPassApplication.objects.select_related('user', 'user__userprofile', 'route'),
+        id=pass_id, user=request.user,
+    )
 
     if bus_pass.status != 'ALLOCATED':
         raise Http404("Bus Pass not yet allocated/processed.")
 
-    # Simple text response as a placeholder for a PDF download
-    response = HttpResponse(content_type='text/plain')
-    response['Content-Disposition'] = f'attachment; filename="buspass_{bus_pass.id}.txt"'
-    
-    content = f"""
-    --- BUSMATE COLLEGE BUS PASS ---
-    Student: {bus_pass.user.get_full_name() or bus_pass.user.username}
-    Route: {bus_pass.route.name}
-    Boarding Point: {bus_pass.boarding_location}
-    Seat Number: {bus_pass.seat_number}
-    Status: VALID
-    Date Issued: {bus_pass.application_date.strftime('%Y-%m-%d')}
-    """
-    response.write(content)
+    fmt = request.GET.get('format', 'pdf')
+    if fmt not in PASS_FORMATS:
+        raise Http404("Unknown pass format.")
+
+    ensure_pass_token(bus_pass)
+    path, fingerprint = rendered_pass_path(bus_pass, fmt)
+    etag = f'"{fingerprint}"'
+    last_modified = int(path.stat().st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    response = FileResponse(
+        open(path, 'rb'),
+        as_attachment=True,
+        filename=f'buspass_{bus_pass.id}.{fmt}',
+        content_type=PASS_FORMATS[fmt],
+    )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
     return response
 
+# --- Pass verification API (bus door scanners) ---
+# Scanners authenticate with an X-Scanner-Key header checked against settings,
+# so these views never touch the session. Tokens are checked from their
+# signature first; a genuine token is looked up once and then served from the
+# cache (see tokens.py), so the happy path runs no queries.
+
+VERIFY_BATCH_LIMIT = 5000
+
+def _scanner_authorized(request):
+    key = request.headers.get('X-Scanner-Key', '').encode()
+    return bool(key) and any(
+        hmac.compare_digest(key, k.encode()) for k in getattr(settings, 'BUSPASS_SCANNER_KEYS', [])
+    )
+
+def _route_param(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+@csrf_exempt
+@require_POST
+def verify_pass(request):
+    """Verify one scanned token. POST token=<token>[&route=<route id>]."""
+    if not _scanner_authorized(request):
+        return JsonResponse({'ok': False, 'error': 'Unauthorized'}, status=403)
+    result = verify_token(request.POST.get('token'), route_id=_route_param(request.POST.get('route')))
+    return JsonResponse({'ok': True, **result})
+
+@csrf_exempt
+@require_POST
+def verify_pass_batch(request):
+    """Verify scans synced from an offline scanner.
+
+    JSON body: {"route": <id, optional>, "scans": [<token> | {"token": ..., "scanned_at": <ISO time>}, ...]}.
+    Each scan is checked against the day it was scanned; results come back in order.
+    """
+    if not _scanner_authorized(request):
+        return JsonResponse({'ok': False, 'error': 'Unauthorized'}, status=403)
+    try:
+        payload = json.loads(request.body or b'{}')
+        scans = payload.get('scans') or []
+    except (ValueError, AttributeError):
+        return JsonResponse({'ok': False, 'error': 'Invalid JSON'}, status=400)
+    if not isinstance(scans, list) or len(scans) > VERIFY_BATCH_LIMIT:
+        return JsonResponse({'ok': False, 'error': f'Send a list of at most {VERIFY_BATCH_LIMIT} scans'}, status=400)
+
+    checks = []
+    for scan in scans:
+        if isinstance(scan, dict):
+            token, scanned_at = scan.get('token'), parse_datetime(str(scan.get('scanned_at') or ''))
+        else:
+            token, scanned_at = scan, None
+        on_date = timezone.localdate(scanned_at) if scanned_at and timezone.is_aware(scanned_at) else None
+        checks.append((token if isinstance(token, str) else '', on_date))
+    return JsonResponse({'ok': True, 'results': verify_tokens(checks, route_id=_route_param(payload.get('route')))})
+
 # --- Admin Views ---
 
 @login_required
@@ -367,6 +480,19 @@ def download_buspass(request, pass_id):
 def admin_dashboard(request):
     return render(request, 'BusPass/admin_dashboard.html')
 
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_reports(request):
+    """Usage reports from the pre-aggregated rollups (refresh with manage.py refresh_reports)."""
+    if request.method == 'POST':
+        refresh_reports.enqueue()
+        messages.info(request, 'Report refresh queued; the figures update once it has run.')
+        return redirect('admin_reports')
+    days = request.GET.get('days') or ''
+    days = int(days) if days.isdigit() and int(days) in REPORT_PERIODS else REPORT_PERIODS[0]
+    report = usage_report(route_catalogue().routes, days)
+    return render(request, 'BusPass/admin_reports.html', {'report': report, 'periods': REPORT_PERIODS})
+
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
 def admin_add_route(request):
@@ -374,34 +500,51 @@ def admin_add_route(request):
         form = BusRouteForm(request.POST)
         if form.is_valid():
             route = form.save()
-            # Parse and save boarding locations if provided
-            raw = (form.cleaned_data.get('boarding_locations') or '').strip()
-            if raw:
-                # Split by newlines and commas while preserving order
-                parts = []
-                for line in raw.splitlines():
-                    for p in line.split(','):
-                        name = p.strip()
-                        if name:
-                            parts.append(name)
-                # Stable de-duplication preserving first occurrence order
-                seen = set()
-                ordered = []
-                for name in parts:
-                    if name not in seen:
-                        seen.add(name)
-                        ordered.append(name)
-                # Save with 1-based position
-                for idx, name in enumerate(ordered, start=1):
-                    obj, _ = BoardingLocation.objects.get_or_create(route=route, name=name)
-                    if obj.position != idx:
-                        obj.position = idx
-                        obj.save(update_fields=['position'])
+            # Parse and save boarding locations (1-based position) in one insert
+            ordered = split_stop_names(form.cleaned_data.get('boarding_locations'))
+            BoardingLocation.objects.bulk_create([
+                BoardingLocation(route=route, name=name, position=idx)
+                for idx, name in enumerate(ordered, start=1)
+            ])
+            invalidate_catalogue()  # bulk_create sends no signals
             return redirect('admin_view_routes')
     else:
         form = BusRouteForm()
     return render(request, 'BusPass/admin_add_route.html', {'form': form})
 
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_import_routes(request):
+    """Upload a routes/stops CSV, preview the diff, then apply it."""
+    plan = None
+    errors = []
+    if request.method == 'POST':
+        form = RouteImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            rows, errors = parse_routes_csv(form.cleaned_data['csv_text'])
+            if not errors:
+                plan, errors = plan_route_import(rows, prune=form.cleaned_data['prune'])
+            if not errors and form.cleaned_data['confirm']:
+                counts = apply_route_import(plan)
+                messages.success(
+                    request,
+                    "Imported: {routes_created} routes created, {routes_updated} updated; "
+                    "{stops_created} stops created, {stops_updated} moved, {stops_deleted} removed.".format(**counts),
+                )
+                return redirect('admin_view_routes')
+            # Carry the file content into the confirmation step
+            form = RouteImportForm(initial={
+                'csv_text': form.cleaned_data['csv_text'],
+                'prune': form.cleaned_data['prune'],
+            })
+    else:
+        form = RouteImportForm()
+    return render(request, 'BusPass/admin_import_routes.html', {
+        'form': form,
+        'plan': plan,
+        'errors': errors,
+    })
+
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
 def admin_edit_route(request, route_id):
@@ -418,14 +561,120 @@ def admin_edit_route(request, route_id):
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
 def admin_view_routes(request):
-    routes = BusRoute.objects.all()
+    routes = route_catalogue().routes
     return render(request, 'BusPass/admin_view_routes.html', {'routes': routes})
 
+@require_POST
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_bulk_allocate(request, route_id=None):
+    """Allocate seats to the waitlisted/PAID queue of one route, or of every route."""
+    if route_id is not None:
+        routes = [get_object_or_404(BusRoute, id=route_id)]
+    else:
+        routes = BusRoute.objects.order_by('name')
+    for route in routes:
+        result = bulk_allocate(route)
+        pass_allocated(result['allocated_ids'])
+        messages.success(
+            request,
+            f"{route.name}: allocated {result['allocated']}, waitlisted {result['waitlisted']}.",
+        )
+    return redirect('admin_view_routes')
+
+def _application_filters(request):
+    """Parse the status/route query filters shared by the listing and the export."""
+    filters = {}
+    status = request.GET.get('status') or ''
+    if status in dict(BusPassApplication.STATUS_CHOICES):
+        filters['status'] = status
+    else:
+        status = ''
+    route_id = request.GET.get('route') or ''
+    if route_id.isdigit():
+        filters['route_id'] = int(route_id)
+    else:
+        route_id = ''
+    return filters, status, route_id
+
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
 def admin_view_applications(request):
-    applications = BusPassApplication.objects.all().order_by('-application_date')
-    return render(request, 'BusPass/admin_view_applications.html', {'applications': applications})
+    # Join user, profile and route up front so the template does not issue
+    # per-row queries, and page with a (application_date, id) cursor.
+    filters, status, route_id = _application_filters(request)
+    applications = BusPassApplication.objects.select_related('user', 'user__userprofile', 'route').filter(**filters)
+
+    page = keyset_paginate(
+        applications,
+        'application_date',
+        ADMIN_APPLICATIONS_PAGE_SIZE,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return render(request, 'BusPass/admin_view_applications.html', {
+        'applications': page,
+        'page': page,
+        'routes': BusRoute.objects.only('id', 'name').order_by('name'),
+        'status_choices': BusPassApplication.STATUS_CHOICES,
+        'selected_status': status,
+        'selected_route': route_id,
+    })
+
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_export(request, dataset, fmt):
+    """Stream applications, routes or profiles as CSV or JSONL."""
+    if dataset not in EXPORTS or fmt not in EXPORT_FORMATS:
+        raise Http404()
+    filters = _application_filters(request)[0] if dataset == 'applications' else {}
+    lines = stream_export(dataset, fmt, filters)
+    if isinstance(request, ASGIRequest):
+        lines = aiter_export(lines)  # a sync iterator would be read into memory first
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="busmate_{dataset}.{fmt}"'
+    return response
+
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_support_inbox(request, user_id=None):
+    """Support messages, newest first; optionally one user's thread and/or a full-text search."""
+    messages_qs = SupportMessage.objects.select_related('user')
+    thread_user = None
+    if user_id is not None:
+        thread_user = get_object_or_404(User, id=user_id)
+        messages_qs = messages_qs.filter(user=thread_user)
+    query = (request.GET.get('q') or '').strip()
+    messages_qs = search_messages(messages_qs, query)
+
+    page = keyset_paginate(
+        messages_qs,
+        'created_at',
+        SUPPORT_INBOX_PAGE_SIZE,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return render(request, 'BusPass/admin_support_inbox.html', {
+        'support_messages': page,
+        'page': page,
+        'thread_user': thread_user,
+        'query': query,
+    })
+
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_support_latency(request):
+    """Support chat backend latency histograms for this server process."""
+    return JsonResponse({'backends': latency_report()})
+
+@login_required
+@user_passes_test(is_admin, login_url='/accounts/login/')
+def admin_support_questions(request):
+    """Most asked support chat questions (cache hit counts) for this server process."""
+    return JsonResponse({
+        'cache': response_cache.stats(),
+        'top_questions': [{'question': q, 'hits': h} for q, h in response_cache.top_questions()],
+    })
 
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
@@ -435,24 +684,27 @@ def admin_process_pass(request, pass_id):
     if request.method == 'POST':
         action = request.POST.get('action')
         
+        # Emails and pass rendering are queued for the task workers
         if action == 'allocate' and application.status == 'PAID':
-            # Simple seat allocation logic: find the next available seat number for this route
-            current_count = BusPassApplication.objects.filter(
-                route=application.route, status='ALLOCATED'
-            ).count()
-            
-            if current_count < application.route.max_seats:
-                application.seat_number = f"S-{current_count + 1:03d}"
-                application.status = 'ALLOCATED'
-                application.save()
+            if allocate_seat(application) is not None:
+                pass_allocated([application.id])
+            elif application.status == 'WAITLISTED':
+                send_status_email.enqueue(application_id=application.id)
+                messages.info(request, f'{application.route.name} is full; the application was added to the waitlist.')
             else:
-                # Handle bus full scenario
-                # You might set status to 'PENDING_WAITLIST' or similar
-                pass 
+                messages.error(request, 'No seat could be allocated; the application may already have been processed.')
                 
+        elif action == 'reject' and application.status in ACTIVE_APPLICATION_STATUSES:
+            promoted = release_seat(application, 'REJECTED')
+            if application.status == 'REJECTED':
+                send_status_email.enqueue(application_id=application.id)
+            else:
+                messages.error(request, 'The application could not be rejected; it may already have been processed.')
+            if promoted is not None:
+                pass_allocated([promoted.id])
+
         elif action == 'reject':
-            application.status = 'REJECTED'
-            application.save()
+            messages.error(request, 'This application can no longer be rejected.')
             
         return redirect('admin_view_applications')
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -65,6 +66,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'BusPass.middleware.UserRoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,9 +99,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections between requests; check them before reuse
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Extra/overriding PRAGMAs for SQLite connections, e.g. {'busy_timeout': 10000}
+# (see BusPass/dbtuning.py)
+BUSPASS_SQLITE_PRAGMAS = {}
+# Put the database in WAL mode. This changes the database file itself, so set
+# BUSPASS_SQLITE_WAL=1 only in the environment of the served database, not for
+# the checked-in development db.sqlite3
+BUSPASS_SQLITE_WAL = os.environ.get('BUSPASS_SQLITE_WAL') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -144,6 +157,55 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Rendered bus passes (PDF/PNG), keyed by a hash of their content.
+# Kept outside MEDIA_ROOT so passes are only served through the download view.
+BUSPASS_PASS_CACHE_DIR = BASE_DIR / 'cache' / 'passes'
+
+# Bus pass QR tokens: validity of a newly allocated pass, and the API keys
+# that door scanners send in the X-Scanner-Key header (comma separated).
+BUSPASS_PASS_VALIDITY_DAYS = 365
+BUSPASS_SCANNER_KEYS = [k for k in os.environ.get('BUSPASS_SCANNER_KEYS', '').split(',') if k]
+
+# Support chat reply cache: max cached replies, lifetime in seconds, and the
+# word-overlap score (0-1) at which a new question reuses an earlier answer.
+BUSPASS_CHAT_CACHE_SIZE = 500
+BUSPASS_CHAT_CACHE_TTL = 3600
+BUSPASS_CHAT_CACHE_SIMILARITY = 0.75
+
+# Support endpoints: per-user token buckets as (burst, refills per minute),
+# and how many LLM generations may run at once per worker before further
+# chats wait (up to the queue timeout, in seconds) and then get the FAQ answer.
+# The buckets live in Django's cache: with the default local-memory cache each
+# worker process enforces its own limit; configure a shared CACHES backend
+# (Redis, Memcached) for one limit per user across workers.
+BUSPASS_RATE_LIMITS = {
+    'support_message': (3, 2),
+    'support_chat': (5, 10),
+}
+BUSPASS_LLM_MAX_CONCURRENCY = 2
+BUSPASS_LLM_QUEUE_TIMEOUT = 2.0
+
+# Payment provider (BusPass/payments.py). 'fake' is the local stand-in gateway;
+# its webhooks are signed with BUSPASS_PAYMENT_WEBHOOK_SECRET (or SECRET_KEY).
+BUSPASS_PAYMENT_PROVIDER = 'fake'
+BUSPASS_PAYMENT_WEBHOOK_SECRET = os.environ.get('BUSPASS_PAYMENT_WEBHOOK_SECRET', '')
+
+# How many days before a pass ends (BUSPASS_PASS_VALIDITY_DAYS after
+# allocation) holders are reminded and may renew (manage.py expire_passes, nightly)
+BUSPASS_RENEWAL_WINDOW_DAYS = 30
+
+# Background task queues and how many tasks of each one worker runs at once
+# (manage.py run_tasks, see BusPass/taskqueue.py)
+BUSPASS_TASK_QUEUES = {
+    'default': 2,
+    'email': 4,
+    'render': 2,
+}
+
+# Outgoing mail (status notifications). Console backend until SMTP is configured.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'BusMate <noreply@busmate.local>')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 